@@ -19,6 +19,11 @@ requirements = [
 
 test_requirements = []
 
+extras_requirements = {
+    # columnar export of the reports, see vidqa.report_export
+    "arrow": ["pyarrow>=10"],
+}
+
 setup(
     author="apenasrr",
     author_email="apenasrr@gmail.com",
@@ -40,6 +45,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme + "\n\n" + history,
     include_package_data=True,
@@ -3,11 +3,81 @@
 """Tests for `vidqa` package."""
 
 
+import asyncio
+import io
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
 import unittest
+from pathlib import Path
+from unittest import mock
 
+import pandas as pd
 from click.testing import CliRunner
 
-from vidqa import cli, vidqa
+from vidqa import (
+    aioprobe,
+    avi_parser,
+    catalog,
+    cli,
+    conversion_policy,
+    job_cost,
+    job_store,
+    mkv_parser,
+    mp4_parser,
+    pipeline,
+    probe_cache,
+    report_export,
+    salvage,
+    scheduler,
+    segment_encode,
+    utils,
+    video_report,
+    video_tools,
+)
+from vidqa.ffprobe_micro import FFProbeResult, get_command_array
+from vidqa.vidqa import (
+    create_video_report,
+    get_list_path_integrity_failed,
+    is_report_line_unchanged,
+    refresh_video_report,
+)
+
+
+def make_box(type_: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), type_) + payload
+
+
+def make_track(handler: bytes, entry: bytes, sizes: list) -> bytes:
+    mdhd = make_box(b"mdhd", bytes(12) + struct.pack(">II", 1000, 10000))
+    hdlr = make_box(b"hdlr", bytes(8) + handler + bytes(12))
+    stsd = make_box(b"stsd", struct.pack(">II", 0, 1) + entry)
+    stsz = make_box(
+        b"stsz",
+        struct.pack(f">III{len(sizes)}I", 0, 0, len(sizes), *sizes),
+    )
+    stbl = make_box(b"stbl", stsd + stsz)
+    minf = make_box(b"minf", stbl)
+    return make_box(b"trak", make_box(b"mdia", mdhd + hdlr + minf))
+
+
+def make_element(id_: int, payload: bytes) -> bytes:
+    size = (1 << 56) | len(payload)
+    return (
+        id_.to_bytes((id_.bit_length() + 7) // 8, "big")
+        + size.to_bytes(8, "big")
+        + payload
+    )
+
+
+def make_chunk(fourcc: bytes, payload: bytes, list_type: bytes = b"") -> bytes:
+    if list_type:
+        payload = list_type + payload
+    data = struct.pack("<4sI", fourcc, len(payload)) + payload
+    return data + bytes(len(payload) & 1)
 
 
 class TestVidqa(unittest.TestCase):
@@ -31,3 +101,1303 @@ class TestVidqa(unittest.TestCase):
         help_result = runner.invoke(cli.main, ["--help"])
         assert help_result.exit_code == 0
         assert "--help  Show this message and exit." in help_result.output
+
+    def test_probe_workers_order(self):
+        """Test that concurrent probes keep the order of the file list."""
+
+        def ffprobe(file_selected, **kwargs):
+            # the first files finish last
+            index = int(Path(file_selected).stem)
+            time.sleep(0.01 * (5 - index))
+            if index == 2:
+                return FFProbeResult(1, "{}", "Invalid data", "json")
+            metadata = {
+                "format": {
+                    "filename": str(file_selected),
+                    "duration": "1",
+                    "bit_rate": "900",
+                    "format_name": "mov,mp4,m4a,3gp,3g2,mj2",
+                },
+                "streams": [
+                    {
+                        "codec_type": "video",
+                        "codec_name": "h264",
+                        "width": 2,
+                        "height": 2,
+                    }
+                ],
+            }
+            return FFProbeResult(0, json.dumps(metadata), "", "json")
+
+        list_path_file = [Path(f"{x}.mp4") for x in range(6)]
+        metadata_writer = mock.Mock()
+        with mock.patch("vidqa.video_report.ffprobe", side_effect=ffprobe):
+            result = video_report.get_inf_ffprobe(
+                list_path_file, workers=4, metadata_writer=metadata_writer
+            )
+        assert [x.path_file for x in result["records"]] == [
+            str(x) for x in list_path_file if x.stem != "2"
+        ]
+        assert result["corrupt"] == [Path("2.mp4")]
+        # the metadata is written as soon as each file is probed
+        list_path_written = [
+            x.args[0] for x in metadata_writer.write.call_args_list
+        ]
+        assert list_path_written[0] != "0.mp4"
+        assert sorted(list_path_written) == [
+            x.path_file for x in result["records"]
+        ]
+
+    def test_scan_tree_snapshot(self):
+        """Test the single walk tree snapshot and its subtree view."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            (root / "a" / "b").mkdir(parents=True)
+            (root / "c").mkdir()
+            (root / "a" / "b" / "x10.mp4").write_bytes(b"0" * 10)
+            (root / "a" / "b" / "x9.mp4").write_bytes(b"0" * 9)
+            (root / "c" / "y.txt").write_bytes(b"")
+
+            snapshot = utils.scan_tree(root)
+            assert snapshot.get_file_paths() == [
+                root / "a" / "b" / "x9.mp4",
+                root / "a" / "b" / "x10.mp4",
+                root / "c" / "y.txt",
+            ]
+            assert (
+                snapshot.get_stat(root / "a" / "b" / "x10.mp4").st_size == 10
+            )
+            assert snapshot.errors == []
+
+            subtree = snapshot.subtree(root / "a")
+            assert len(subtree.files) == 2
+            assert [x.path for x in subtree.dirs] == [root / "a" / "b"]
+
+            # unreachable long path, as on Windows without long path support
+            path_folder_long = root / ("d" * 200) / ("e" * 100)
+            path_folder_long.mkdir(parents=True)
+            with mock.patch("os.path.exists", return_value=False):
+                snapshot = utils.scan_tree(root)
+            assert snapshot.errors == [path_folder_long]
+
+    def test_probe_cache(self):
+        """Test the cache hit, the miss of a changed file and the prune."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            path_file = root / "a.mp4"
+            path_file.write_bytes(b"0" * 10)
+            cache = probe_cache.ProbeCache(root / "cache.sqlite3")
+            metadata = {"format": {"duration": "1.0"}}
+            fingerprint = probe_cache.get_fingerprint(path_file)
+            cache.put(fingerprint, metadata)
+            assert cache.get(fingerprint) == metadata
+
+            # os.DirEntry.stat reports inode 0 on Windows
+            path, size, mtime_ns, _ = fingerprint
+            assert cache.get((path, size, mtime_ns, 0)) == metadata
+            cache.put((path, size, mtime_ns, 0), metadata)
+            assert cache.get(fingerprint) == metadata
+            assert cache.remove_stale() == 0
+
+            path_file.write_bytes(b"0" * 11)
+            assert cache.get(probe_cache.get_fingerprint(path_file)) is None
+            path_file.write_bytes(b"0" * 10)
+            os.utime(path_file, ns=(mtime_ns, mtime_ns + 10**9))
+            assert cache.get(probe_cache.get_fingerprint(path_file)) is None
+
+            # approximations only serve lookups that allow them
+            cache.put(fingerprint, metadata, probe_cache.PROBE_MODE_NATIVE)
+            assert cache.get(fingerprint, probe_cache.PROBE_MODE_LEAN) is None
+            assert cache.get(fingerprint, "lean", native=True) == metadata
+            cache.put(fingerprint, metadata, "lean" + probe_cache.FAST_SUFFIX)
+            assert cache.get(fingerprint, "lean", native=True) is None
+            assert cache.get(fingerprint, "lean", fast=True) == metadata
+            assert cache.get(fingerprint, "full", fast=True) is None
+            cache.put(fingerprint, metadata, probe_cache.PROBE_MODE_FULL)
+            assert cache.get(fingerprint, "lean", fast=True) == metadata
+
+            path_file_other = root / "b.mp4"
+            path_file_other.write_bytes(b"0")
+            cache.add(probe_cache.get_fingerprint(path_file_other), metadata)
+            path_file_other.unlink()
+            assert cache.remove_stale() == 2
+            assert cache.info()["entries"] == 0
+            cache.close()
+
+    def test_job_store(self):
+        """Test job claims, the reset on open and the report sync."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_report = Path(temp_dir) / "report.csv"
+            df = pd.DataFrame(
+                {
+                    "path_file": ["a.avi", "b.mp4", "c.mkv", "d.mov"],
+                    "file_size": [1, 2, 3, 4],
+                    "type_conversion": [
+                        "5_total_conv",
+                        "1_not_needed",
+                        "2_container",
+                        "3_only_audio",
+                    ],
+                }
+            )
+            path_file_db = job_store.get_path_job_store(path_file_report)
+            store = job_store.JobStore(path_file_db)
+            store.sync_from_report(df)
+            assert store.count(job_store.STATUS_PENDING) == 3
+            assert store.count(job_store.STATUS_NOT_NEEDED) == 1
+
+            job = store.claim_next(["2_container", "3_only_audio"])
+            assert (job["path_file"], job["job_id"]) == ("c.mkv", 2)
+            path_file_converted = Path(temp_dir) / "c.mp4"
+            path_file_converted.write_bytes(b"0")
+            store.mark_done(job["job_id"], path_file_converted)
+            job = store.claim_next()
+            assert job["path_file"] == "a.avi"
+            store.mark_failed(store.claim_next()["job_id"], "error")
+            assert store.claim_next() is None
+            store.close()
+
+            # running and failed jobs of an interrupted run return to pending
+            store = job_store.JobStore(path_file_db)
+            assert store.count(job_store.STATUS_PENDING) == 2
+            df_report = store.export_report(path_file_report)
+            assert df_report["conversion_done"].tolist() == [0, 0, 1, 0]
+            assert df_report["path_file_converted"].tolist()[2] == str(
+                path_file_converted
+            )
+            assert not Path(str(path_file_report) + ".tmp").exists()
+            store.close()
+
+            # the done job is kept, the changed one restarts, the removed
+            # one leaves the store
+            df_report = pd.read_csv(path_file_report)
+            df_report.loc[0, "file_size"] = 10
+            df_report = df_report.drop(index=3)
+            df_report.to_csv(path_file_report, index=False)
+            store = job_store.open_job_store(path_file_report)
+            assert store.count(job_store.STATUS_DONE) == 1
+            assert store.count(job_store.STATUS_PENDING) == 1
+            assert store.to_dataframe()["path_file"].tolist() == [
+                "a.avi",
+                "b.mp4",
+                "c.mkv",
+            ]
+            store.close()
+
+            # a report line reset to pending keeps the done job only while
+            # its converted video exists
+            df_report = pd.read_csv(path_file_report)
+            df_report.loc[2, "conversion_done"] = 0
+            df_report.loc[2, "path_file_converted"] = None
+            store = job_store.JobStore(path_file_db)
+            store.sync_from_report(df_report)
+            assert store.count(job_store.STATUS_DONE) == 1
+            path_file_converted.unlink()
+            store.sync_from_report(df_report)
+            assert store.count(job_store.STATUS_DONE) == 0
+            df_report = store.export_report(path_file_report)
+            assert df_report["conversion_done"].tolist() == [0, 0, 0]
+            assert df_report["path_file_converted"].isna().all()
+            store.close()
+
+    def test_conversion_scheduler(self):
+        """Test the lane limits, the thread budget and quick_wins."""
+
+        def run(list_type_conversion, **kwargs) -> dict:
+            dict_running = {"io": 0, "cpu": 0}
+            dict_max = {"io": 0, "cpu": 0}
+            dict_threads = {}
+            lock = threading.Lock()
+
+            def func_job(job, flags):
+                lane = scheduler.get_lane(job["type_conversion"])
+                with lock:
+                    dict_running[lane] += 1
+                    dict_max[lane] = max(dict_max[lane], dict_running[lane])
+                    dict_threads[job["path_file"]] = flags.get("threads")
+                time.sleep(0.05)
+                with lock:
+                    dict_running[lane] -= 1
+                return job["path_file"]
+
+            def func_done(job, result, exception):
+                assert exception is None
+                store.mark_done(job["job_id"], Path(result))
+
+            with tempfile.TemporaryDirectory() as temp_dir:
+                store = job_store.JobStore(Path(temp_dir) / "jobs.sqlite3")
+                store.sync_from_report(
+                    pd.DataFrame(
+                        {
+                            "path_file": [
+                                f"{x}.avi"
+                                for x in range(len(list_type_conversion))
+                            ],
+                            "type_conversion": list_type_conversion,
+                        }
+                    )
+                )
+                scheduler.ConversionScheduler(**kwargs).run(
+                    store, {}, func_job, func_done
+                )
+                assert store.count(job_store.STATUS_PENDING) == 0
+                store.close()
+            return {"max": dict_max, "threads": dict_threads}
+
+        result = run(
+            ["2_container", "4_only_video"] * 3 + ["3_only_audio"],
+            io_jobs=2,
+            cpu_jobs=1,
+            threads_per_job=3,
+        )
+        assert result["max"] == {"io": 2, "cpu": 1}
+        assert result["threads"] == {
+            "0.avi": None,
+            "1.avi": 3,
+            "2.avi": None,
+            "3.avi": 3,
+            "4.avi": None,
+            "5.avi": 3,
+            "6.avi": None,
+        }
+
+        # with quick_wins, the idle cpu slot also runs io jobs
+        list_type_conversion = ["2_container"] * 4
+        result = run(list_type_conversion, io_jobs=1, cpu_jobs=1)
+        assert result["max"]["io"] == 1
+        result = run(
+            list_type_conversion, io_jobs=1, cpu_jobs=1, job_order="quick_wins"
+        )
+        assert result["max"]["io"] == 2
+
+    def test_cost_model(self):
+        """Test the job orders of the cost model and its calibration."""
+        df = pd.DataFrame(
+            {
+                "path_file": ["a.avi", "b.avi", "c.mkv", "d.avi"],
+                "type_conversion": [
+                    "5_total_conv",
+                    "4_only_video",
+                    "2_container",
+                    "5_total_conv",
+                ],
+                "duration_seconds": [600, 60, 3600, 60],
+                "video_resolution_width": [1920, 1920, 1920, 640],
+                "video_resolution_height": [1080, 1080, 1080, 360],
+            }
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_calibration = Path(temp_dir) / "cost_model.json"
+            cost_model = job_cost.CostModel(path_file_calibration)
+            assert cost_model.estimate(df.iloc[2]) == 18.0
+            store = job_store.JobStore(Path(temp_dir) / "jobs.sqlite3")
+            store.sync_from_report(df)
+            store.update_estimated_cost(cost_model)
+
+            def get_order(job_order: str) -> list[str]:
+                list_path_file = []
+                while True:
+                    job = store.claim_next(job_order=job_order)
+                    if job is None:
+                        break
+                    list_path_file.append(job["path_file"])
+                store.sync_from_report(df)
+                store.update_estimated_cost(cost_model)
+                return list_path_file
+
+            assert get_order("fifo") == ["a.avi", "b.avi", "c.mkv", "d.avi"]
+            assert get_order("lpt") == ["a.avi", "b.avi", "c.mkv", "d.avi"]
+            assert get_order("spt") == ["d.avi", "c.mkv", "b.avi", "a.avi"]
+            assert get_order("quick_wins") == [
+                "c.mkv",
+                "d.avi",
+                "b.avi",
+                "a.avi",
+            ]
+            store.close()
+
+            # a job twice as slow as estimated moves the calibration by
+            # alpha towards 2
+            row = df.iloc[3].to_dict()
+            cost_model.observe(row, cost_model.estimate(row) * 2)
+            calibration = cost_model.dict_calibration["5_total_conv"]
+            self.assertAlmostEqual(calibration, 1.2)
+            cost_model.save()
+            cost_model = job_cost.CostModel(path_file_calibration)
+            assert cost_model.dict_calibration["5_total_conv"] == calibration
+            assert cost_model.dict_calibration["4_only_video"] == 1.0
+
+    def test_ffmpeg_progress(self):
+        """Test the parse of the -progress output of ffmpeg."""
+        output = (
+            "frame=0\nfps=0.00\nout_time_us=N/A\nspeed=N/A\n"
+            "progress=continue\n"
+            "frame=1500\nfps=50.00\ntotal_size=1048576\n"
+            "out_time_us=60000000\nout_time=00:01:00.000000\n"
+            "speed=2.5x\nprogress=continue\n"
+            "frame=3000\nout_time_us=120000000\nspeed=2.4x\n"
+            "progress=end\n"
+        )
+        process = mock.Mock()
+        process.stdout = io.StringIO(output)
+        process.stderr = io.StringIO("")
+        process.wait.return_value = 0
+        list_progress = []
+
+        def on_progress(progress):
+            list_progress.append(
+                (
+                    progress.frame,
+                    progress.out_time_seconds,
+                    progress.speed,
+                    progress.progress,
+                    progress.get_eta_seconds(180),
+                )
+            )
+
+        with mock.patch("subprocess.Popen", return_value=process) as popen:
+            return_code = video_tools.run_ffmpeg(
+                ["-i", Path("a b.avi"), "a.mp4"], on_progress
+            )
+        assert return_code == 0
+        command_array = popen.call_args.args[0]
+        assert command_array[0] == "ffmpeg"
+        assert command_array[-3:] == ["-i", "a b.avi", "a.mp4"]
+        assert "shell" not in popen.call_args.kwargs
+        assert list_progress == [
+            (0, 0.0, 0.0, "continue", None),
+            (1500, 60.0, 2.5, "continue", 48.0),
+            (3000, 120.0, 2.4, "end", 25.0),
+        ]
+
+    def test_segmented_conversion(self):
+        """Test the choice of segmented conversions and their threads."""
+        flags = {"segment_min_duration": 1800}
+        assert segment_encode.use_segmented(flags, "5_total_conv", 3600)
+        assert segment_encode.use_segmented(flags, "4_only_video", 1800)
+        assert not segment_encode.use_segmented(flags, "5_total_conv", 600)
+        # stream copy of the video
+        assert not segment_encode.use_segmented(flags, "3_only_audio", 3600)
+        assert not segment_encode.use_segmented(flags, "5_total_conv", None)
+        flags = {"segment_min_duration": 0}
+        assert not segment_encode.use_segmented(flags, "5_total_conv", 3600)
+
+        flags = {"segment_workers": 4, "threads": 8}
+        assert segment_encode.get_segment_budget(flags) == (4, 2)
+        flags = {"segment_workers": 4, "threads": 2}
+        assert segment_encode.get_segment_budget(flags) == (2, 1)
+        with mock.patch("os.cpu_count", return_value=12):
+            flags = {"segment_workers": 4, "cpu_jobs": 2}
+            assert segment_encode.get_segment_budget(flags) == (4, 1)
+
+        # the stream layout of the segmented and the single-pass conversion
+        list_stream = [
+            {"index": 0, "codec_type": "video", "width": 640, "height": 360},
+            {"index": 1, "codec_type": "audio", "channels": 6},
+            {"index": 2, "codec_type": "audio", "channels": 2},
+            {"index": 3, "codec_type": "data"},
+        ]
+        assert segment_encode.get_default_layout(list_stream) == [0, 1]
+        assert segment_encode.get_segmented_layout(list_stream) == [0, 1]
+        # ffmpeg selects the audio with more channels and a subtitle
+        list_stream[1]["channels"] = 1
+        list_stream.append({"index": 4, "codec_type": "subtitle"})
+        assert segment_encode.get_default_layout(list_stream) == [0, 2, 4]
+        assert segment_encode.get_segmented_layout(list_stream) == [0, 1]
+        # a cover picture comes first, but ffmpeg selects the video
+        list_stream = [
+            {
+                "index": 0,
+                "codec_type": "video",
+                "width": 1000,
+                "height": 1000,
+                "disposition": {"attached_pic": 1},
+            },
+            {"index": 1, "codec_type": "video", "width": 640, "height": 360},
+        ]
+        assert segment_encode.get_default_layout(list_stream) == [1]
+        assert segment_encode.get_segmented_layout(list_stream) == [0]
+
+        metadata = {"streams": list_stream}
+        with mock.patch(
+            "vidqa.segment_encode.ffprobe",
+            return_value=FFProbeResult(0, json.dumps(metadata), "", "json"),
+        ):
+            assert not segment_encode.is_layout_kept(Path("a.avi"))
+        metadata = {"streams": list_stream[1:]}
+        with mock.patch(
+            "vidqa.segment_encode.ffprobe",
+            return_value=FFProbeResult(0, json.dumps(metadata), "", "json"),
+        ):
+            assert segment_encode.is_layout_kept(Path("a.avi"))
+        with mock.patch(
+            "vidqa.segment_encode.ffprobe",
+            return_value=FFProbeResult(1, "", "Invalid data", "json"),
+        ):
+            assert not segment_encode.is_layout_kept(Path("a.avi"))
+
+    def test_segment_checkpoint(self):
+        """Test the resume of segments and the reset on a new recipe."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            path_file_origin = root / "a.avi"
+            path_file_origin.write_bytes(b"0" * 10)
+            list_path_file_chunk = [root / f"source_{x}.mkv" for x in range(3)]
+            for path_file_chunk in list_path_file_chunk:
+                path_file_chunk.write_bytes(b"0")
+            store = job_store.JobStore(root / "jobs.sqlite3")
+            checkpoint = segment_encode.SegmentCheckpoint(store, "a.avi")
+            flags = {"crf": 18, "maxrate": 4, "threads": 4}
+            recipe = segment_encode.get_recipe(path_file_origin, flags)
+            checkpoint.set_chunks(recipe, list_path_file_chunk)
+            for index in range(2):
+                path_file_encoded = segment_encode.get_path_file_encoded(
+                    list_path_file_chunk[index]
+                )
+                path_file_encoded.write_bytes(b"00")
+                checkpoint.commit(index, path_file_encoded, 300.0)
+            # a segment changed after its commit is encoded again
+            path_file_encoded.write_bytes(b"000")
+
+            # the thread budget does not change the recipe
+            flags["threads"] = 2
+            recipe = segment_encode.get_recipe(path_file_origin, flags)
+            list_segment = checkpoint.load(recipe)
+            list_committed = [
+                x["path_file_encoded"] is not None for x in list_segment
+            ]
+            assert list_committed == [True, False, False]
+            assert list_segment[0]["duration_seconds"] == 300.0
+
+            flags["crf"] = 23
+            recipe = segment_encode.get_recipe(path_file_origin, flags)
+            assert checkpoint.load(recipe) == []
+            path_file_origin.write_bytes(b"0" * 11)
+            flags["crf"] = 18
+            recipe = segment_encode.get_recipe(path_file_origin, flags)
+            assert checkpoint.load(recipe) == []
+            store.close()
+
+    def test_pipeline(self):
+        """Test the pipeline stages through the probe cache."""
+
+        def probe_file(file_selected, probe_mode, *args):
+            if file_selected.stem == "bad":
+                return video_report.classify_metadata(file_selected, {})
+            metadata = {
+                "format": {
+                    "filename": str(file_selected),
+                    "duration": "60",
+                    "bit_rate": "900",
+                    "format_name": "avi",
+                    "size": "1",
+                },
+                "streams": [
+                    {
+                        "codec_type": "video",
+                        "codec_name": "mpeg4",
+                        "width": 640,
+                        "height": 360,
+                    }
+                ],
+            }
+            result = video_report.classify_metadata(file_selected, metadata)
+            result["probe_mode"] = probe_mode
+            return result
+
+        def run_jobs(job_store, path_file_report, path_folder, flags, feed):
+            while not feed.closed:
+                time.sleep(0.01)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            list_path_video = [root / f"{x}.avi" for x in ("a", "bad", "c")]
+            for path_file in list_path_video:
+                path_file.write_bytes(b"0")
+            path_file_report = root / "report.csv"
+            flags = {
+                "probe_workers": 2,
+                "cache_probe": 1,
+                "cache_path": str(root / "cache.sqlite3"),
+            }
+            # the job store of a deleted report, with a.avi converted
+            path_file_converted = root / "a_converted.mp4"
+            path_file_converted.write_bytes(b"0")
+            store = job_store.JobStore(
+                job_store.get_path_job_store(path_file_report)
+            )
+            store.sync_from_report(
+                pd.DataFrame(
+                    {
+                        "path_file": [str(root / "a.avi")],
+                        "type_conversion": ["5_total_conv"],
+                        "file_size": [1],
+                        "conversion_done": [1],
+                        "path_file_converted": [str(path_file_converted)],
+                    }
+                )
+            )
+            store.close()
+            qt_thread = threading.active_count()
+            for _ in range(2):
+                with mock.patch.dict(
+                    os.environ, {"VIDQA_CACHE_DIR": temp_dir}
+                ), mock.patch(
+                    "vidqa.video_report.probe_file", side_effect=probe_file
+                ) as probe, mock.patch(
+                    "vidqa.make_reencode.run_jobs", side_effect=run_jobs
+                ):
+                    list_path_corrupt = pipeline.run_pipeline(
+                        path_file_report, list_path_video, root, flags
+                    )
+                assert list_path_corrupt == [root / "bad.avi"]
+                # all stages joined
+                assert threading.active_count() == qt_thread
+                df = pd.read_csv(path_file_report)
+                assert sorted(df["path_file"]) == [
+                    str(root / "a.avi"),
+                    str(root / "c.avi"),
+                ]
+                assert set(df["type_conversion"]) == {"5_total_conv"}
+                assert df["conversion_done"].tolist() == [0, 0]
+                assert pipeline.is_discovery_complete(path_file_report)
+            # only the corrupt file is probed again
+            assert probe.call_count == 1
+
+    def test_aioprobe(self):
+        """Test the limit, the order and the cancel of the async probes."""
+        dict_running = {"now": 0, "max": 0}
+        list_process = []
+
+        class Process:
+            def __init__(self, delay: float):
+                self.delay = delay
+                self.returncode = None
+                dict_running["now"] += 1
+                dict_running["max"] = max(
+                    dict_running["max"], dict_running["now"]
+                )
+
+            async def communicate(self):
+                try:
+                    await asyncio.sleep(self.delay)
+                finally:
+                    dict_running["now"] -= 1
+                self.returncode = 0
+                return b'{"format": {}}', b""
+
+            def kill(self):
+                self.returncode = -9
+
+            async def wait(self):
+                return self.returncode
+
+        async def create_subprocess_exec(*command_array, **kwargs):
+            # the file name is the delay of its probe, in hundredths
+            process = Process(int(command_array[-1]) / 100)
+            list_process.append(process)
+            return process
+
+        async def probe_all(list_file_path, **kwargs):
+            return [
+                x.file_path
+                async for x in aioprobe.probe_many(list_file_path, **kwargs)
+            ]
+
+        async def probe_first(list_file_path):
+            iterator = aioprobe.probe_many(list_file_path, limit=3)
+            result = await iterator.__anext__()
+            await iterator.aclose()
+            return result.file_path
+
+        loop = asyncio.new_event_loop()
+        try:
+            with mock.patch(
+                "asyncio.create_subprocess_exec",
+                side_effect=create_subprocess_exec,
+            ):
+                list_file_path = loop.run_until_complete(
+                    probe_all(["12", "1", "4", "2", "1"], limit=2)
+                )
+                assert list_file_path == ["1", "4", "2", "1", "12"]
+                assert dict_running["max"] == 2
+
+                result = loop.run_until_complete(
+                    aioprobe.probe("50", timeout=0.01)
+                )
+                assert result.timed_out and result.return_code == -9
+
+                # leaving the iteration kills the probes still running and
+                # cancels the one not started yet
+                list_process.clear()
+                file_path = loop.run_until_complete(
+                    probe_first(["50", "1", "50", "50"])
+                )
+                assert file_path == "1"
+                assert [x.returncode for x in list_process] == [-9, 0, -9]
+                assert dict_running["now"] == 0
+        finally:
+            loop.close()
+
+    def test_lean_probe(self):
+        """Test the ffprobe command of the lean and full probe modes."""
+        command_array = get_command_array(
+            "a.mp4", show_entries=video_report.PROBE_ENTRIES
+        )
+        assert command_array[-3:] == [
+            "-show_entries",
+            video_report.PROBE_ENTRIES,
+            "a.mp4",
+        ]
+        assert "-show_streams" not in command_array
+        command_array = get_command_array("a.mp4")
+        assert command_array[-4:] == [
+            "-show_programs",
+            "-show_format",
+            "-show_streams",
+            "a.mp4",
+        ]
+
+        assert video_report.get_probe_mode({}) == "lean"
+        assert video_report.get_probe_mode({"probe_full": 1}) == "full"
+        ok = FFProbeResult(0, '{"format": {}}', "", "json")
+        with mock.patch(
+            "vidqa.video_report.ffprobe", return_value=ok
+        ) as ffprobe:
+            video_report.probe_file("a.mp4")
+            assert (
+                ffprobe.call_args.kwargs["show_entries"]
+                == video_report.PROBE_ENTRIES
+            )
+            result = video_report.probe_file("a.mp4", "full")
+            assert ffprobe.call_args.kwargs["show_entries"] is None
+        assert result["probe_mode"] == "full"
+
+    def test_fast_probe(self):
+        """Test the fast probe limits and the fallback to the defaults."""
+        command_array = get_command_array(
+            "a.mp4", probesize=1000000, analyzeduration=2000000
+        )
+        assert command_array[-5:] == [
+            "-probesize",
+            "1000000",
+            "-analyzeduration",
+            "2000000",
+            "a.mp4",
+        ]
+        assert video_report.get_fast_probe({}) is None
+        fast_probe = video_report.get_fast_probe(
+            {"probe_fast": 1, "probe_fast_duration": 2000000}
+        )
+        assert fast_probe == {"probesize": 1000000, "analyzeduration": 2000000}
+
+        metadata = {
+            "format": {"filename": "a.mp4", "duration": "1", "bit_rate": "9"},
+            "streams": [{"codec_type": "video", "codec_name": "h264"}],
+        }
+        partial = FFProbeResult(0, json.dumps(metadata), "", "json")
+        metadata["streams"][0].update({"width": 2, "height": 2})
+        complete = FFProbeResult(0, json.dumps(metadata), "", "json")
+        with mock.patch(
+            "vidqa.video_report.ffprobe", side_effect=[complete]
+        ) as ffprobe:
+            result = video_report.probe_file("a.mp4", fast_probe=fast_probe)
+        assert ffprobe.call_args.kwargs["probesize"] == 1000000
+        assert not result["fallback"]
+        assert result["probe_mode"] == "lean_fast"
+
+        # missing dimensions: probed again with the default limits
+        with mock.patch(
+            "vidqa.video_report.ffprobe", side_effect=[partial, complete]
+        ) as ffprobe:
+            result = video_report.probe_file("a.mp4", fast_probe=fast_probe)
+        assert "probesize" not in ffprobe.call_args.kwargs
+        assert result["fallback"]
+        assert result["probe_mode"] == "lean"
+        assert result["metadata"]["streams"][0]["width"] == 2
+
+    def test_mp4_parser(self):
+        """Test the native parser on a synthetic h264/aac mp4."""
+        avcc = make_box(b"avcC", bytes([1, 100, 0, 40]))
+        avc1 = make_box(
+            b"avc1",
+            bytes(24) + struct.pack(">HH", 1280, 720) + bytes(50) + avcc,
+        )
+        # AudioSpecificConfig: AAC LC, 44100 Hz, 2 channels
+        esds = make_box(
+            b"esds",
+            bytes(4)
+            + bytes([0x03, 22, 0, 1, 0])
+            + bytes([0x04, 17, 0x40, 0x15])
+            + bytes(11)
+            + bytes([0x05, 2, 0x12, 0x10]),
+        )
+        mp4a = make_box(
+            b"mp4a", bytes(16) + struct.pack(">H", 6) + bytes(10) + esds
+        )
+        mvhd = make_box(b"mvhd", bytes(12) + struct.pack(">II", 1000, 10000))
+        moov = make_box(
+            b"moov",
+            mvhd
+            + make_track(b"vide", avc1, [1000] * 10)
+            + make_track(b"soun", mp4a, [250] * 20),
+        )
+        data = make_box(b"ftyp", b"isom" + bytes(4)) + moov
+        data += make_box(b"mdat", bytes(15000))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file = Path(temp_dir) / "a.mp4"
+            path_file.write_bytes(data)
+            metadata = mp4_parser.parse(path_file)
+
+            path_file_other = Path(temp_dir) / "b.mp4"
+            path_file_other.write_bytes(data.replace(b"avc1", b"hvc1"))
+            assert mp4_parser.parse(path_file_other) is None
+
+        assert metadata["format"]["format_name"] == mp4_parser.FORMAT_NAME
+        assert float(metadata["format"]["duration"]) == 10.0
+        assert metadata["format"]["bit_rate"] == str(len(data) * 8 // 10)
+        stream_video, stream_audio = metadata["streams"]
+        assert stream_video["codec_name"] == "h264"
+        assert stream_video["profile"] == "High"
+        assert (stream_video["width"], stream_video["height"]) == (1280, 720)
+        assert stream_video["bit_rate"] == "8000"
+        assert stream_audio["codec_name"] == "aac"
+        assert stream_audio["profile"] == "LC"
+        assert stream_audio["channels"] == 2
+        assert stream_audio["bit_rate"] == "4000"
+
+    def test_mkv_avi_parser(self):
+        """Test the native parsers on a synthetic mkv and avi."""
+        track_video = make_element(
+            0xAE,
+            make_element(0x83, bytes([1]))
+            + make_element(0x86, b"V_MPEG4/ISO/AVC")
+            + make_element(0x63A2, bytes([1, 77, 0, 30]))
+            + make_element(
+                0xE0,
+                make_element(0xB0, struct.pack(">H", 640))
+                + make_element(0xBA, struct.pack(">H", 360)),
+            ),
+        )
+        track_audio = make_element(
+            0xAE,
+            make_element(0x83, bytes([2]))
+            + make_element(0x86, b"A_AC3")
+            + make_element(0xE1, make_element(0x9F, bytes([6]))),
+        )
+        segment = make_element(
+            0x18538067,
+            make_element(
+                0x1549A966, make_element(0x4489, struct.pack(">d", 5e3))
+            )
+            + make_element(0x1654AE6B, track_video + track_audio)
+            + make_element(0x1F43B675, bytes(1000)),
+        )
+        data_mkv = make_element(0x1A45DFA3, make_element(0x4282, b"matroska"))
+        data_mkv += segment
+
+        strh_video = b"vids" + bytes(16) + struct.pack("<IIII", 1, 25, 0, 250)
+        strf_video = struct.pack("<Iii", 40, 320, -240) + b"\x00" * 4 + b"XVID"
+        strh_audio = b"auds" + bytes(16) + struct.pack("<IIII", 1, 1, 0, 0)
+        strf_audio = struct.pack("<HHIIHH", 0x55, 2, 44100, 16000, 1, 0)
+        hdrl = make_chunk(
+            b"LIST",
+            make_chunk(b"avih", bytes(56))
+            + make_chunk(
+                b"LIST",
+                make_chunk(b"strh", strh_video + bytes(16))
+                + make_chunk(b"strf", strf_video + bytes(20)),
+                b"strl",
+            )
+            + make_chunk(
+                b"LIST",
+                make_chunk(b"strh", strh_audio + bytes(16))
+                + make_chunk(b"strf", strf_audio),
+                b"strl",
+            ),
+            b"hdrl",
+        )
+        movi = make_chunk(b"LIST", bytes(3000), b"movi")
+        data_avi = make_chunk(b"RIFF", hdrl + movi, b"AVI ")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_mkv = Path(temp_dir) / "a.mkv"
+            path_file_mkv.write_bytes(data_mkv)
+            metadata_mkv = mkv_parser.parse(path_file_mkv)
+            path_file_avi = Path(temp_dir) / "a.avi"
+            path_file_avi.write_bytes(data_avi)
+            metadata_avi = avi_parser.parse(path_file_avi)
+
+        assert metadata_mkv["format"]["format_name"] == "matroska,webm"
+        assert float(metadata_mkv["format"]["duration"]) == 5.0
+        stream_video, stream_audio = metadata_mkv["streams"]
+        assert stream_video["codec_name"] == "h264"
+        assert stream_video["profile"] == "Main"
+        assert (stream_video["width"], stream_video["height"]) == (640, 360)
+        assert stream_audio["codec_name"] == "ac3"
+        assert stream_audio["channels"] == 6
+
+        assert metadata_avi["format"]["format_name"] == "avi"
+        assert float(metadata_avi["format"]["duration"]) == 10.0
+        stream_video, stream_audio = metadata_avi["streams"]
+        assert stream_video["codec_name"] == "mpeg4"
+        assert (stream_video["width"], stream_video["height"]) == (320, 240)
+        assert stream_audio["codec_name"] == "mp3"
+        assert stream_audio["channels"] == 2
+        assert stream_audio["bit_rate"] == "128000"
+
+    def test_probe_timeout_retry(self):
+        """Test the retry of transient errors and the timeout category."""
+        error_io = FFProbeResult(1, "{}", "a.mp4: Input/output error", "json")
+        ok = FFProbeResult(0, '{"format": {}}', "", "json")
+        timed_out = FFProbeResult(-9, "{}", "", "json", timed_out=True)
+        policy = video_report.get_probe_policy(
+            {"probe_timeout": 5, "probe_retries": 2}
+        )
+        assert policy == {"timeout": 5.0, "retries": 2}
+
+        with mock.patch.object(video_report, "RETRY_BACKOFF", 0), mock.patch(
+            "vidqa.video_report.ffprobe", side_effect=[error_io, ok]
+        ) as ffprobe:
+            result = video_report.run_ffprobe("a.mp4", policy)
+        assert result is ok
+        assert ffprobe.call_count == 2
+        assert ffprobe.call_args.kwargs["timeout"] == 5.0
+
+        with mock.patch(
+            "vidqa.video_report.ffprobe", return_value=timed_out
+        ) as ffprobe:
+            result = video_report.probe_file("a.mp4", policy=policy)
+        assert ffprobe.call_count == 1
+        assert result["timeout"] and not result["corrupt"]
+        assert result["metadata"] is None
+
+    def test_probe_record(self):
+        """Test the probe record and the streamed metadata json."""
+        metadata = {
+            "format": {
+                "filename": "a.mkv",
+                "duration": "61.5",
+                "bit_rate": "900",
+                "format_name": "matroska,webm",
+                "size": "10",
+            },
+            "streams": [
+                {"codec_type": "audio", "codec_name": "ac3", "channels": 6},
+                {
+                    "codec_type": "video",
+                    "codec_name": "h264",
+                    "width": 640,
+                    "height": 360,
+                },
+            ],
+        }
+        record = video_report.ProbeRecord.from_metadata("a.mkv", metadata)
+        assert not hasattr(record, "__dict__")
+        assert record.duration_seconds == 61.5
+        assert (record.video_codec, record.video_bitrate) == ("h264", 900)
+        assert (record.audio_codec, record.audio_channels) == ("ac3", 6)
+        assert (
+            video_report.ProbeRecord.from_metadata(
+                "b.mkv", {"format": {"filename": "b.mkv"}, "streams": []}
+            )
+            is None
+        )
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_report = Path(temp_dir) / "a.csv"
+            path_file_dump = video_report.get_path_metadata_dump(
+                path_file_report, compress=True
+            )
+            with video_report.MetadataWriter(path_file_dump) as writer:
+                writer.write("a.mkv", metadata)
+                writer.write("b.mkv", {})
+            list_dict = list(video_report.iter_metadata_dump(path_file_dump))
+            path_file_video = Path(temp_dir) / "a.mkv"
+            with video_report.MetadataWriter(path_file_dump) as writer:
+                writer.write(path_file_video, metadata)
+            df = video_report.rebuild_report(path_file_dump, path_file_report)
+            assert path_file_report.exists()
+        assert path_file_dump.name == "a_metadata.jsonl.gz"
+        assert list_dict == [
+            {"path_file": "a.mkv", "metadata": metadata},
+            {"path_file": "b.mkv", "metadata": {}},
+        ]
+        assert df["path_file"].tolist() == [str(path_file_video)]
+        # sizes come from the metadata, the rebuild does not stat files
+        assert df["file_size"].tolist() == [10]
+        assert df["file_mtime_ns"].tolist() == [None]
+        assert df["duration"].tolist() == ["00:01:01.50"]
+        assert df["file_name"].tolist() == ["a.mkv"]
+        assert df["type_conversion"].tolist() == ["3_only_audio"]
+
+    def test_metadata_dump(self):
+        """Test the rebuild of a report from a dump cut by a crash."""
+
+        def ffprobe(file_selected, **kwargs):
+            metadata = {
+                "format": {
+                    "filename": str(file_selected),
+                    "duration": "61.5",
+                    "bit_rate": "900",
+                    "format_name": "avi",
+                    "size": str(Path(file_selected).stat().st_size),
+                },
+                "streams": [
+                    {
+                        "codec_type": "video",
+                        "codec_name": "mpeg4",
+                        "width": 640,
+                        "height": 360,
+                    },
+                    {"codec_type": "audio", "codec_name": "mp3"},
+                ],
+            }
+            return FFProbeResult(0, json.dumps(metadata), "", "json")
+
+        for metadata_gzip in (0, 1):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                root = Path(temp_dir)
+                folder_path = root / "videos"
+                folder_path.mkdir()
+                for name in ("a", "b", "c"):
+                    (folder_path / f"{name}.avi").write_bytes(b"0" * 10)
+                report_path = root / "report.csv"
+                flags = {
+                    "max_path": 240,
+                    "max_name": 150,
+                    "metadata_gzip": metadata_gzip,
+                }
+                with mock.patch(
+                    "vidqa.video_report.ffprobe", side_effect=ffprobe
+                ):
+                    create_video_report(
+                        report_path, folder_path, ("avi",), flags
+                    )
+                path_file_dump = video_report.get_path_metadata_dump(
+                    report_path, metadata_gzip == 1
+                )
+                assert path_file_dump.exists()
+                list_path_file = [
+                    x["path_file"]
+                    for x in video_report.iter_metadata_dump(path_file_dump)
+                ]
+                assert sorted(list_path_file) == [
+                    str(folder_path / f"{x}.avi") for x in ("a", "b", "c")
+                ]
+
+                # crash while the line of a fourth video was written
+                with video_report.open_metadata_dump(
+                    path_file_dump, "a"
+                ) as f:
+                    f.write('{"path_file":"d.avi","metadata":{"form')
+                if metadata_gzip == 1:
+                    data = path_file_dump.read_bytes()
+                    path_file_dump.write_bytes(data[:-8])
+
+                path_file_rebuilt = root / "rebuilt.csv"
+                video_report.rebuild_report(path_file_dump, path_file_rebuilt)
+                # the rebuild takes the sizes from the metadata and does not
+                # stat the files
+                df = pd.read_csv(report_path).drop(columns="file_mtime_ns")
+                df_rebuilt = pd.read_csv(path_file_rebuilt).drop(
+                    columns="file_mtime_ns"
+                )
+                pd.testing.assert_frame_equal(df_rebuilt, df)
+
+    def test_report_line_unchanged(self):
+        """Test the change check of the incremental report refresh."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file = Path(temp_dir) / "a.mp4"
+            path_file.write_bytes(bytes(10))
+            stat_result = path_file.stat()
+        row = {"file_size": 10, "file_mtime_ns": stat_result.st_mtime_ns}
+        assert is_report_line_unchanged(row, stat_result)
+        assert not is_report_line_unchanged(row, None)
+        row_changed = dict(row, file_mtime_ns=stat_result.st_mtime_ns + 1)
+        assert not is_report_line_unchanged(row_changed, stat_result)
+        # reports written before the column: compared by size only
+        assert is_report_line_unchanged({"file_size": 10}, stat_result)
+        assert not is_report_line_unchanged({"file_size": 11}, stat_result)
+
+    def test_refresh_video_report(self):
+        """Test a report refresh with new, changed and removed videos."""
+        list_path_probed = []
+
+        def ffprobe(file_selected, **kwargs):
+            list_path_probed.append(Path(file_selected).name)
+            metadata = {
+                "format": {
+                    "filename": str(file_selected),
+                    "duration": "60",
+                    "bit_rate": "900",
+                    "format_name": "avi",
+                },
+                "streams": [
+                    {
+                        "codec_type": "video",
+                        "codec_name": "mpeg4",
+                        "width": 640,
+                        "height": 360,
+                    }
+                ],
+            }
+            return FFProbeResult(0, json.dumps(metadata), "", "json")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            folder_path = root / "videos"
+            folder_path.mkdir()
+            for name in ("a", "b", "c", "d"):
+                (folder_path / f"{name}.avi").write_bytes(b"0")
+            report_path = root / "report.csv"
+            flags = {"max_path": 240, "max_name": 150}
+            with mock.patch(
+                "vidqa.video_report.ffprobe", side_effect=ffprobe
+            ):
+                create_video_report(report_path, folder_path, ("avi",), flags)
+            assert sorted(list_path_probed) == [
+                "a.avi",
+                "b.avi",
+                "c.avi",
+                "d.avi",
+            ]
+
+            # b and c were converted, but the output of c was lost
+            path_file_converted = root / "b.mp4"
+            path_file_converted.write_bytes(b"0")
+            df = pd.read_csv(report_path)
+            df["conversion_done"] = [0, 1, 1, 0]
+            df["path_file_converted"] = [
+                None,
+                str(path_file_converted),
+                str(root / "c.mp4"),
+                None,
+            ]
+            df.to_csv(report_path, index=False)
+            (folder_path / "a.avi").write_bytes(b"00")
+            (folder_path / "d.avi").unlink()
+            (folder_path / "e.avi").write_bytes(b"0")
+
+            list_path_probed.clear()
+            with mock.patch(
+                "vidqa.video_report.ffprobe", side_effect=ffprobe
+            ):
+                refresh_video_report(report_path, folder_path, ("avi",), flags)
+            assert sorted(list_path_probed) == ["a.avi", "e.avi"]
+            df = pd.read_csv(report_path).set_index("file_name")
+            assert sorted(df.index) == ["a.avi", "b.avi", "c.avi", "e.avi"]
+            assert df.loc["a.avi", "file_size"] == 2
+            assert df["conversion_done"].to_dict() == {
+                "b.avi": 1,
+                "c.avi": 0,
+                "a.avi": 0,
+                "e.avi": 0,
+            }
+            assert df.loc["b.avi", "path_file_converted"] == str(
+                path_file_converted
+            )
+            assert pd.isna(df.loc["c.avi", "path_file_converted"])
+
+            # nothing changed: the report is left as it is
+            list_path_probed.clear()
+            with mock.patch(
+                "vidqa.video_report.ffprobe", side_effect=ffprobe
+            ):
+                refresh_video_report(report_path, folder_path, ("avi",), flags)
+            assert list_path_probed == []
+
+    def test_conversion_policy(self):
+        """Test the classification and recipes of target profiles."""
+        df = pd.DataFrame(
+            {
+                "video_codec": ["h264", "h264", "h264", "hevc", "vp9"],
+                "audio_codec": ["aac", "aac", "ac3", "aac", "opus"],
+                "audio_channels": [2, 2, 2, 2, 2],
+                "is_avc": [1, 1, 1, 0, 0],
+                "path_file": ["a.MP4", "b.mkv", "c.mp4", "d.mp4", "e.webm"],
+                "format_name": ["mov,mp4,m4a,3gp,3g2,mj2"] * 3
+                + ["mov,mp4,m4a,3gp,3g2,mj2", "matroska,webm"],
+                "video_resolution_height": [720, 720, 720, 720, 2160],
+                "video_bitrate": [1e6] * 5,
+            }
+        )
+        profile = conversion_policy.get_profile({})
+        assert profile.classify(df).tolist() == [
+            "1_not_needed",
+            "2_container",
+            "3_only_audio",
+            "4_only_video",
+            "5_total_conv",
+        ]
+        list_arg = profile.get_recipe_args("3_only_audio", "a", "b", {})
+        assert list_arg[5:] == ["-c:v", "copy", "-c:a", "aac", "-ac", "2", "b"]
+        # the converters of video_tools follow the target profile
+        assert video_tools.convert_only_audio_get_args("a", "b") == list_arg
+        flags = {"crf": 18, "maxrate": 4}
+        assert video_tools.convert_audio_video_get_args(
+            "a", "b", flags
+        ) == profile.get_recipe_args("5_total_conv", "a", "b", flags)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_config = Path(temp_dir) / "config.ini"
+            path_file_config.write_text(
+                "[profile:webm]\n"
+                "video_codecs = vp9\n"
+                "audio_codecs = opus\n"
+                "extensions = webm\n"
+                "format_names = matroska,webm\n"
+                "require_avc = 0\n"
+                "height_max = 1080\n"
+                "video_args = -c:v libvpx-vp9 -crf {crf:.0f}\n"
+            )
+            profile = conversion_policy.get_profile(
+                {"target_profile": "webm"}, path_file_config
+            )
+            with self.assertRaises(ValueError):
+                conversion_policy.get_profile(
+                    {"target_profile": "other"}, path_file_config
+                )
+        # too tall for the cap: the video is encoded and scaled down
+        assert profile.classify(df).tolist()[4] == "4_only_video"
+        assert profile.extension == "webm"
+        assert profile.get_video_args({"crf": 20.0})[:4] == [
+            "-c:v",
+            "libvpx-vp9",
+            "-crf",
+            "20",
+        ]
+
+    def test_report_export(self):
+        """Test the typed read and the columnar export of reports."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_report = Path(temp_dir) / "vidqa_a" / "a.csv"
+            path_file_report.parent.mkdir()
+            path_file_report.write_text(
+                "file_size,file_mtime_ns,video_codec,path_file,"
+                "path_file_converted\n"
+                "10,1792198096190541896,h264,/a/x.mp4,\n"
+                "11,,hevc,/a/y.mkv,/b/y.mp4\n"
+            )
+            df = report_export.read_report_csv(path_file_report)
+            assert list(df.columns) == list(report_export.COLUMN_TYPES)
+            assert df["project"].tolist() == ["a", "a"]
+            assert df["file_mtime_ns"].tolist()[0] == 1792198096190541896
+            assert str(df["video_codec"].dtype) == "category"
+            assert df["path_file_converted"].isna().tolist() == [True, False]
+            if report_export.pa is None:
+                self.skipTest("pyarrow not installed")
+            report_export.export_report(path_file_report, "parquet")
+            df = report_export.read_reports(
+                [temp_dir],
+                columns=["path_file", "file_mtime_ns"],
+                filters=[("video_codec", "!=", "h264")],
+            )
+        assert df["path_file"].tolist() == ["/a/y.mkv"]
+        assert df["file_mtime_ns"].isna().tolist() == [True]
+
+    def test_catalog(self):
+        """Test the catalog records and queries of reports."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_report = Path(temp_dir) / "a.csv"
+            path_file_report.write_text(
+                "path_file,file_size,duration_seconds,video_codec,"
+                "type_conversion,conversion_done\n"
+                "/a/x.mp4,10,3600,h264,1_not_needed,0\n"
+                "/a/y.avi,20,7200,mpeg4,5_total_conv,0\n"
+            )
+            catalog_ = catalog.get_catalog(str(Path(temp_dir) / "c.sqlite3"))
+            try:
+                assert catalog_.record_report(path_file_report) == 2
+                catalog_.record_report(path_file_report)
+                df = catalog_.query(catalog.DICT_QUERY["pending_hours"][1])
+                df_run = catalog_.query("SELECT COUNT(*) AS qt FROM run")
+                with self.assertRaises(catalog.sqlite3.Error):
+                    catalog_.query("DELETE FROM file")
+            finally:
+                catalog_.close()
+        assert df.to_dict("records") == [
+            {"type_conversion": "5_total_conv", "files": 1, "hours": 2.0}
+        ]
+        assert df_run["qt"].tolist() == [2]
+
+    def test_report_integrity(self):
+        """Test the batched check of the files of a report."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_a = Path(temp_dir) / "a.mp4"
+            path_file_b = Path(temp_dir) / "b.mp4"
+            path_file_a.write_bytes(b"a")
+            path_file_b.write_bytes(b"b")
+            dict_stat = utils.stat_files(
+                [path_file_a, Path(temp_dir) / "x" / "c.mp4"]
+            )
+            assert dict_stat[str(path_file_a)].st_size == 1
+            assert dict_stat[str(Path(temp_dir) / "x" / "c.mp4")] is None
+            df = pd.DataFrame(
+                {
+                    "path_file": [str(path_file_a), str(path_file_b)],
+                    "file_size": pd.array([1, 2], dtype="Int64"),
+                    "file_mtime_ns": pd.array([None, None], dtype="Int64"),
+                    "path_file_converted": [None, str(path_file_a) + "2"],
+                }
+            )
+            list_path_failed = get_list_path_integrity_failed(df)
+        assert list_path_failed == [
+            f"{path_file_b} (changed)",
+            f"{path_file_a}2",
+        ]
+
+    def test_salvage(self):
+        """Test the validation of converted videos left in the log folder."""
+        metadata = {
+            "format": {
+                "filename": "a_1.mp4",
+                "duration": "60.2",
+                "format_name": "mov,mp4,m4a,3gp,3g2,mj2",
+            },
+            "streams": [
+                {
+                    "codec_type": "video",
+                    "codec_name": "h264",
+                    "width": 640,
+                    "height": 480,
+                },
+                {"codec_type": "audio", "codec_name": "aac", "channels": 2},
+            ],
+        }
+        result = {"metadata": metadata, "corrupt": False}
+        dict_video_data = {
+            "type_conversion": "3_only_audio",
+            "duration_seconds": 60.0,
+            "video_codec": "h264",
+            "audio_codec": "mp3",
+            "file_mtime_ns": 0,
+        }
+        profile = conversion_policy.get_profile({})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path_file_dest = Path(temp_dir) / "a_1.mp4"
+            assert not salvage.is_output_valid(
+                dict_video_data, path_file_dest, profile, {}
+            )
+            path_file_dest.write_bytes(b"x")
+            with mock.patch.object(
+                video_report, "probe_file", return_value=result
+            ) as probe_file:
+                assert salvage.is_output_valid(
+                    dict_video_data, path_file_dest, profile, {}
+                )
+                # no approximated probe
+                assert probe_file.call_args.kwargs["native"] is False
+                assert probe_file.call_args.kwargs["fast_probe"] is None
+                # the recipe copies the video stream
+                dict_video_data["video_codec"] = "hevc"
+                assert not salvage.is_output_valid(
+                    dict_video_data, path_file_dest, profile, {}
+                )
+                dict_video_data["video_codec"] = "h264"
+                # truncated output
+                dict_video_data["duration_seconds"] = 120.0
+                assert not salvage.is_output_valid(
+                    dict_video_data, path_file_dest, profile, {}
+                )
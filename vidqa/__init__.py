@@ -1,6 +1,6 @@
 """Top-level package for vidqa."""
-from . import utils, video_tools
-from .vidqa import *
+from . import utils, video_tools  # noqa: F401
+from .vidqa import *  # noqa: F401,F403
 
 __author__ = """apenasrr"""
 __email__ = "apenasrr@gmail.com"
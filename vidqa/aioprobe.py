@@ -0,0 +1,174 @@
+"""asyncio probe engine, for services that run an event loop.
+
+Same command and result as ffprobe_micro.ffprobe, but the ffprobe processes
+run through asyncio.create_subprocess_exec, so probing never blocks the
+event loop.
+
+Example:
+    async for result in probe_many(list_path_file, limit=8, timeout=30):
+        metadata = result.get_output_as_dict()
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import AsyncIterator, Iterable, Union
+
+from .ffprobe_micro import FFProbeResult, get_command_array
+
+
+async def _kill(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+
+async def probe(
+    file_path,
+    ffprobe_format: str = "json",
+    format_optn: str = "",
+    log_level: str = "error",
+    timeout: Union[float, None] = None,
+    semaphore: Union[asyncio.Semaphore, None] = None,
+    show_entries: Union[str, None] = None,
+) -> FFProbeResult:
+    """Runs ffprobe on a file without blocking the event loop.
+
+    Args:
+        file_path (Path): video file path
+        ffprobe_format (str, optional): 'json' or 'flat'. Defaults to 'json'.
+        format_optn (str, optional): options of the print format.
+            Defaults to ''.
+        log_level (str, optional): ffprobe log level. Defaults to 'error'.
+        timeout (float, optional): seconds before the process is killed.
+            Defaults to None, no limit.
+        semaphore (asyncio.Semaphore, optional): limits the ffprobe
+            processes running at the same time. Defaults to None.
+        show_entries (str, optional): ffprobe -show_entries specification.
+            Defaults to None, for programs, format and streams in full.
+
+    Returns:
+        FFProbeResult: ffprobe result. On timeout, return_code is the one of
+            the killed process, output is an empty document, error
+            describes the timeout and timed_out is True.
+
+    Raises:
+        FileNotFoundError: if ffprobe is not in the path
+        asyncio.CancelledError: if cancelled. The process is killed first.
+    """
+
+    if semaphore is not None:
+        async with semaphore:
+            return await probe(
+                file_path,
+                ffprobe_format,
+                format_optn,
+                log_level,
+                timeout,
+                show_entries=show_entries,
+            )
+
+    command_array = get_command_array(
+        file_path, ffprobe_format, format_optn, log_level, show_entries
+    )
+    process = await asyncio.create_subprocess_exec(
+        *command_array,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        await _kill(process)
+        logging.error("ffprobe timeout (%ss): %s", timeout, file_path)
+        return FFProbeResult(
+            return_code=process.returncode,
+            output="{}" if ffprobe_format == "json" else "",
+            error=f"ffprobe timeout after {timeout}s",
+            format=ffprobe_format,
+            file_path=file_path,
+            timed_out=True,
+        )
+    except BaseException:
+        # cancelled: do not leave the process running
+        await asyncio.shield(_kill(process))
+        raise
+
+    return FFProbeResult(
+        return_code=process.returncode,
+        output=stdout.decode("utf8", errors="replace"),
+        error=stderr.decode("utf8", errors="replace"),
+        format=ffprobe_format,
+        file_path=file_path,
+    )
+
+
+async def probe_many(
+    list_file_path: Iterable,
+    limit: int = 4,
+    timeout: Union[float, None] = None,
+    semaphore: Union[asyncio.Semaphore, None] = None,
+    **kwargs,
+) -> AsyncIterator[FFProbeResult]:
+    """Probes many files, yielding each result as soon as it completes.
+
+    At most `limit` probes are started at a time, so the paths may come
+    from a long or lazy iterable. Leaving the iteration early cancels and
+    kills the probes still running.
+
+    Args:
+        list_file_path (Iterable): video file paths
+        limit (int, optional): maximum probes running at the same time.
+            Defaults to 4.
+        timeout (float, optional): seconds of each probe before its process
+            is killed. Defaults to None, no limit.
+        semaphore (asyncio.Semaphore, optional): semaphore shared with
+            other callers, to limit the ffprobe processes of the whole
+            service. Defaults to None.
+        **kwargs: ffprobe_format, format_optn, log_level and show_entries,
+            see probe.
+
+    Yields:
+        FFProbeResult: results in completion order. The attribute file_path
+            identifies the file.
+    """
+
+    limit = max(1, int(limit))
+    iterator_path = iter(list_file_path)
+    set_task = set()
+
+    def start_next() -> bool:
+        for file_path in iterator_path:
+            set_task.add(
+                asyncio.ensure_future(
+                    probe(
+                        file_path,
+                        timeout=timeout,
+                        semaphore=semaphore,
+                        **kwargs,
+                    )
+                )
+            )
+            return True
+        return False
+
+    try:
+        while len(set_task) < limit and start_next():
+            pass
+        while len(set_task) > 0:
+            set_done, set_task = await asyncio.wait(
+                set_task, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in set_done:
+                while len(set_task) < limit and start_next():
+                    pass
+                yield task.result()
+    finally:
+        for task in set_task:
+            task.cancel()
+        if len(set_task) > 0:
+            await asyncio.gather(*set_task, return_exceptions=True)
@@ -0,0 +1,203 @@
+"""Native parser of AVI (RIFF) headers.
+
+Maps only the head of the file (HEAD_SIZE) and reads the hdrl list: the
+stream headers (strh) and formats (strf) of each strl list. Returns the
+metadata in the shape of the lean ffprobe output (see
+video_report.PROBE_ENTRIES), or None, so the caller falls back to ffprobe,
+if a codec is not in DICT_FOURCC/DICT_FORMAT_TAG or the video stream has
+no length.
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterator, Union
+
+# format_name of the ffprobe avi demuxer
+FORMAT_NAME = "avi"
+
+# bytes of the file read, enough for the hdrl list
+HEAD_SIZE = 512 * 1024
+
+# BITMAPINFOHEADER biCompression, upper case: ffprobe codec_name
+DICT_FOURCC = {
+    b"XVID": "mpeg4",
+    b"DIVX": "mpeg4",
+    b"DX50": "mpeg4",
+    b"FMP4": "mpeg4",
+    b"MP4V": "mpeg4",
+    b"H264": "h264",
+    b"X264": "h264",
+    b"AVC1": "h264",
+    b"HEVC": "hevc",
+    b"H265": "hevc",
+    b"MJPG": "mjpeg",
+    b"DIV3": "msmpeg4v3",
+    b"MP43": "msmpeg4v3",
+    b"MPG2": "mpeg2video",
+}
+
+# WAVEFORMATEX wFormatTag: ffprobe codec_name
+DICT_FORMAT_TAG = {
+    0x0050: "mp2",
+    0x0055: "mp3",
+    0x00FF: "aac",
+    0x1600: "aac",
+    0x1601: "aac",
+    0x2000: "ac3",
+    0x2001: "dts",
+}
+
+WAVE_FORMAT_PCM = 0x0001
+
+
+def iter_chunk(data: mmap.mmap, start: int, end: int) -> Iterator[tuple]:
+    """Iterates the RIFF chunks between two offsets.
+
+    Yields:
+        tuple: (fourcc, offset of the payload, offset after the payload).
+            For LIST chunks the fourcc is the list type and the payload
+            starts after it.
+
+    Raises:
+        ValueError: if a chunk goes beyond `end`
+    """
+
+    offset = start
+    while offset + 8 <= end:
+        fourcc, size = struct.unpack_from("<4sI", data, offset)
+        start_payload = offset + 8
+        end_payload = start_payload + size
+        if end_payload > end:
+            raise ValueError(f"truncated chunk {fourcc!r}")
+        if fourcc == b"LIST":
+            fourcc = data[start_payload:start_payload + 4]
+            start_payload += 4
+        yield fourcc, start_payload, end_payload
+        # chunks are word aligned
+        offset = end_payload + (size & 1)
+
+
+def parse_stream(data: mmap.mmap, start: int, end: int) -> Union[dict, None]:
+    """Returns the ffprobe-like stream of a strl list, with the key
+    'duration' for video streams. None if the codec is not known. An empty
+    dict for streams that are neither video nor audio."""
+
+    dict_chunk = {}
+    for fourcc, start_chunk, end_chunk in iter_chunk(data, start, end):
+        dict_chunk.setdefault(fourcc, (start_chunk, end_chunk))
+    if b"strh" not in dict_chunk or b"strf" not in dict_chunk:
+        return None
+    start_strh = dict_chunk[b"strh"][0]
+    start_strf, end_strf = dict_chunk[b"strf"]
+    fcc_type = data[start_strh:start_strh + 4]
+
+    if fcc_type == b"vids":
+        if end_strf - start_strf < 20:
+            return None
+        scale, rate, _, length = struct.unpack_from(
+            "<IIII", data, start_strh + 20
+        )
+        width, height = struct.unpack_from("<ii", data, start_strf + 4)
+        compression = data[start_strf + 16:start_strf + 20].upper()
+        codec_name = DICT_FOURCC.get(compression)
+        if codec_name is None or rate == 0:
+            return None
+        return {
+            "codec_name": codec_name,
+            "codec_type": "video",
+            "width": width,
+            "height": abs(height),
+            "duration": length * scale / rate,
+        }
+
+    if fcc_type == b"auds":
+        if end_strf - start_strf < 16:
+            return None
+        (
+            format_tag,
+            channels,
+            _,
+            avg_bytes_per_sec,
+            _,
+            bits,
+        ) = struct.unpack_from("<HHIIHH", data, start_strf)
+        codec_name = DICT_FORMAT_TAG.get(format_tag)
+        if format_tag == WAVE_FORMAT_PCM:
+            codec_name = {8: "pcm_u8", 16: "pcm_s16le"}.get(bits)
+        if codec_name is None:
+            return None
+        return {
+            "codec_name": codec_name,
+            "codec_type": "audio",
+            "channels": channels,
+            "bit_rate": str(avg_bytes_per_sec * 8),
+        }
+
+    return {}
+
+
+def parse(path_file: Path) -> Union[dict, None]:
+    """Parses the headers of an AVI file.
+
+    Args:
+        path_file (Path): video file path
+
+    Returns:
+        Union[dict, None]: metadata with the keys of the lean ffprobe
+            output: {'streams': [...], 'format': {...}}. None if the file
+            is not AVI or the parser can't decide.
+
+    Raises:
+        OSError: if the file can't be read
+        ValueError: if the chunk structure is broken
+    """
+
+    path_file = Path(path_file)
+    with open(path_file, "rb") as f:
+        file_size = path_file.stat().st_size
+        if file_size < 12:
+            return None
+        head_size = min(file_size, HEAD_SIZE)
+        with mmap.mmap(f.fileno(), head_size, access=mmap.ACCESS_READ) as data:
+            riff, form = struct.unpack_from("<4s4x4s", data, 0)
+            if riff != b"RIFF" or form != b"AVI ":
+                return None
+            # the RIFF chunk goes beyond the head, walk its first chunks
+            hdrl = None
+            for fourcc, start, end in iter_chunk(data, 12, head_size):
+                if fourcc == b"hdrl":
+                    hdrl = (start, end)
+                    break
+            if hdrl is None:
+                return None
+
+            duration_seconds = 0.0
+            list_stream = []
+            for fourcc, start, end in iter_chunk(data, *hdrl):
+                if fourcc != b"strl":
+                    continue
+                stream = parse_stream(data, start, end)
+                if stream is None:
+                    return None
+                if "duration" in stream:
+                    duration_seconds = max(
+                        duration_seconds, stream.pop("duration")
+                    )
+                if len(stream) > 0:
+                    list_stream.append(stream)
+
+    if not duration_seconds > 0:
+        return None
+    return {
+        "streams": list_stream,
+        "format": {
+            "filename": str(path_file),
+            "format_name": FORMAT_NAME,
+            "duration": f"{duration_seconds:.6f}",
+            "size": str(file_size),
+            "bit_rate": str(int(file_size * 8 / duration_seconds)),
+        },
+    }
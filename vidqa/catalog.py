@@ -0,0 +1,378 @@
+"""Persistent catalog of the videos of all projects.
+
+With the flag catalog set to 1 (off by default), each vidqa run records
+the lines of its report in a user-level SQLite database: fingerprint
+(size, mtime_ns), metadata, classification, and the conversion outcome
+from the job store of the report (status, output size, timings, error).
+Rows are kept by absolute path across projects and runs, so files
+replaced by their converted version stay as history.
+
+Questions over the whole collection are answered by indexed queries (see
+DICT_QUERY), without reading the report CSVs again.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from .job_store import STATUS_DONE, get_path_job_store, get_status_from_row
+from .probe_cache import get_cache_dir
+
+# columns of the file table taken from the report lines
+LIST_COLUMN_REPORT = [
+    "duration_seconds",
+    "format_name",
+    "video_codec",
+    "audio_codec",
+    "audio_channels",
+    "video_resolution_height",
+    "video_resolution_width",
+    "video_bitrate",
+    "type_conversion",
+]
+
+# name: (description, sql)
+DICT_QUERY = {
+    "summary": (
+        "files, hours and GB by status",
+        "SELECT status, COUNT(*) AS files, "
+        "ROUND(SUM(duration_seconds) / 3600, 2) AS hours, "
+        "ROUND(SUM(size) / 1e9, 3) AS gb "
+        "FROM file GROUP BY status ORDER BY status",
+    ),
+    "pending_hours": (
+        "hours still needing conversion, by type of conversion",
+        "SELECT type_conversion, COUNT(*) AS files, "
+        "ROUND(SUM(duration_seconds) / 3600, 2) AS hours "
+        "FROM file WHERE status IN ('pending', 'failed') "
+        "GROUP BY type_conversion ORDER BY type_conversion",
+    ),
+    "saved_by_codec": (
+        "bytes saved by the conversions, by source video codec",
+        "SELECT video_codec, COUNT(*) AS files, "
+        "SUM(size) AS bytes_source, SUM(size_converted) AS bytes_converted, "
+        "SUM(size - size_converted) AS bytes_saved "
+        "FROM file WHERE status = 'done' AND size_converted IS NOT NULL "
+        "GROUP BY video_codec ORDER BY bytes_saved DESC",
+    ),
+    "conversion_speed": (
+        "conversion time per hour of video, by type of conversion",
+        "SELECT type_conversion, COUNT(*) AS files, "
+        "ROUND(SUM(elapsed_seconds) / 3600, 2) AS hours_spent, "
+        "ROUND(SUM(elapsed_seconds) / SUM(duration_seconds), 3) "
+        "AS seconds_per_second "
+        "FROM file WHERE status = 'done' AND elapsed_seconds IS NOT NULL "
+        "GROUP BY type_conversion ORDER BY type_conversion",
+    ),
+    "projects": (
+        "files and pending conversions by project",
+        "SELECT project, COUNT(*) AS files, "
+        "SUM(status IN ('pending', 'failed')) AS pending, "
+        "SUM(status = 'done') AS done, "
+        "DATETIME(MAX(last_seen), 'unixepoch', 'localtime') AS last_seen "
+        "FROM file GROUP BY project ORDER BY project",
+    ),
+    "failed": (
+        "conversions that failed in the last run of their project",
+        "SELECT project, path, type_conversion, error "
+        "FROM file WHERE status = 'failed' ORDER BY project, path",
+    ),
+}
+
+
+def read_job_states(path_file_report: Path) -> dict[str, dict]:
+    """Reads the state of the jobs of a report, without opening the job
+    store for writing, which would reset the failed jobs to pending.
+
+    Args:
+        path_file_report (Path): report path. csv.
+
+    Returns:
+        dict[str, dict]: {path_file: {'status', 'path_file_converted',
+            'started_at', 'finished_at', 'error'}}. Empty if the report has
+            no job store.
+    """
+
+    path_file_db = get_path_job_store(path_file_report)
+    if not path_file_db.exists():
+        return {}
+    conn = sqlite3.connect(
+        f"{path_file_db.absolute().as_uri()}?mode=ro", uri=True
+    )
+    try:
+        list_row = conn.execute(
+            "SELECT path_file, status, path_file_converted, started_at, "
+            "finished_at, error FROM job"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {
+        row[0]: {
+            "status": row[1],
+            "path_file_converted": row[2],
+            "started_at": row[3],
+            "finished_at": row[4],
+            "error": row[5],
+        }
+        for row in list_row
+    }
+
+
+def get_value(value):
+    """Returns None for missing values of a report line"""
+
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value
+
+
+class Catalog:
+    """SQLite catalog of the videos of all projects, one row per absolute
+    path.
+
+    Args:
+        path_file_db (Path): sqlite file path
+    """
+
+    def __init__(self, path_file_db: Path):
+        self.path_file_db = Path(path_file_db)
+        self.path_file_db.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path_file_db), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS run ("
+            "id INTEGER PRIMARY KEY, "
+            "project TEXT NOT NULL, "
+            "path_report TEXT NOT NULL, "
+            "target_profile TEXT, "
+            "recorded_at REAL NOT NULL, "
+            "files INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file ("
+            "path TEXT PRIMARY KEY, "
+            "project TEXT NOT NULL, "
+            "size INTEGER, "
+            "mtime_ns INTEGER, "
+            "duration_seconds REAL, "
+            "format_name TEXT, "
+            "video_codec TEXT, "
+            "audio_codec TEXT, "
+            "audio_channels INTEGER, "
+            "video_resolution_height INTEGER, "
+            "video_resolution_width INTEGER, "
+            "video_bitrate INTEGER, "
+            "type_conversion TEXT, "
+            "target_profile TEXT, "
+            "status TEXT NOT NULL, "
+            "path_converted TEXT, "
+            "size_converted INTEGER, "
+            "started_at REAL, "
+            "finished_at REAL, "
+            "elapsed_seconds REAL, "
+            "error TEXT, "
+            "first_seen REAL NOT NULL, "
+            "last_seen REAL NOT NULL, "
+            "run_id INTEGER NOT NULL)"
+        )
+        # covering indexes of the queries of DICT_QUERY
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_file_status_type "
+            "ON file (status, type_conversion, duration_seconds)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_file_status_codec "
+            "ON file (status, video_codec, size, size_converted)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_file_project "
+            "ON file (project, status)"
+        )
+        self._conn.commit()
+
+    def record_report(
+        self,
+        path_file_report: Path,
+        target_profile: str = "",
+    ) -> int:
+        """Records the lines of a report and the outcome of their
+        conversions, in a single transaction.
+
+        Args:
+            path_file_report (Path): report path. csv.
+            target_profile (str, optional): target profile of the
+                classification. Defaults to "".
+
+        Returns:
+            int: number of files recorded
+        """
+
+        path_file_report = Path(path_file_report)
+        df = pd.read_csv(path_file_report, dtype={"path_file_converted": str})
+        dict_job = read_job_states(path_file_report)
+        project = path_file_report.stem
+        now = time.time()
+
+        list_row = []
+        for row in df.to_dict("records"):
+            path_file = str(row["path_file"])
+            job = dict_job.get(path_file, {})
+            status = job.get("status") or get_status_from_row(row)
+            path_converted = job.get("path_file_converted") or get_value(
+                row.get("path_file_converted")
+            )
+            size_converted = None
+            if status == STATUS_DONE and path_converted is not None:
+                try:
+                    size_converted = os.stat(path_converted).st_size
+                except OSError:
+                    # already moved to the project folder, the size
+                    # recorded before is kept
+                    size_converted = None
+            started_at = job.get("started_at")
+            finished_at = job.get("finished_at")
+            elapsed_seconds = None
+            if started_at is not None and finished_at is not None:
+                elapsed_seconds = finished_at - started_at
+            list_row.append(
+                [path_file, project]
+                + [
+                    get_value(row.get("file_size")),
+                    get_value(row.get("file_mtime_ns")),
+                ]
+                + [get_value(row.get(x)) for x in LIST_COLUMN_REPORT]
+                + [
+                    target_profile,
+                    status,
+                    path_converted,
+                    size_converted,
+                    path_file,
+                    started_at,
+                    finished_at,
+                    elapsed_seconds,
+                    job.get("error"),
+                    path_file,
+                    now,
+                    now,
+                ]
+            )
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO run "
+                "(project, path_report, target_profile, recorded_at, files) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    project,
+                    str(path_file_report.absolute()),
+                    target_profile,
+                    now,
+                    len(list_row),
+                ),
+            )
+            run_id = cursor.lastrowid
+            # a file keeps the time it was first seen and the size of its
+            # converted video
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO file "
+                "(path, project, size, mtime_ns, duration_seconds, "
+                "format_name, video_codec, audio_codec, audio_channels, "
+                "video_resolution_height, video_resolution_width, "
+                "video_bitrate, type_conversion, target_profile, status, "
+                "path_converted, size_converted, started_at, finished_at, "
+                "elapsed_seconds, error, first_seen, last_seen, run_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                "COALESCE(?, (SELECT size_converted FROM file "
+                "WHERE path = ? AND status = 'done')), ?, ?, ?, ?, "
+                "COALESCE((SELECT first_seen FROM file WHERE path = ?), ?), "
+                "?, ?)",
+                [x + [run_id] for x in list_row],
+            )
+            self._conn.commit()
+        logging.info(
+            "Catalog: %s files of %s recorded", len(list_row), project
+        )
+        return len(list_row)
+
+    def query(self, sql: str, parameters: tuple = ()) -> pd.DataFrame:
+        """Runs a read-only query.
+
+        Args:
+            sql (str): SELECT statement
+            parameters (tuple, optional): query parameters. Defaults to ().
+
+        Returns:
+            pd.DataFrame: query result
+
+        Raises:
+            sqlite3.Error: if the query is invalid or writes
+        """
+
+        with self._lock:
+            self._conn.execute("PRAGMA query_only = ON")
+            try:
+                cursor = self._conn.execute(sql, parameters)
+                list_column = [x[0] for x in cursor.description or []]
+                list_row = cursor.fetchall()
+            finally:
+                self._conn.execute("PRAGMA query_only = OFF")
+        return pd.DataFrame(list_row, columns=list_column)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_catalog(catalog_path: str = "") -> Catalog:
+    """Opens the catalog.
+
+    Args:
+        catalog_path (str, optional): sqlite file path. If empty, uses
+            catalog.sqlite3 in the user-level folder of vidqa, see
+            probe_cache.get_cache_dir. Defaults to "".
+
+    Returns:
+        Catalog: catalog
+    """
+
+    if catalog_path:
+        path_file_db = Path(catalog_path)
+    else:
+        path_file_db = get_cache_dir() / "catalog.sqlite3"
+    logging.info("Catalog: %s", path_file_db)
+    return Catalog(path_file_db)
+
+
+def record_report(path_file_report: Path, flags: dict) -> None:
+    """Records a report in the catalog, if flags['catalog'] is 1. Errors
+    are logged, the run goes on.
+
+    Args:
+        path_file_report (Path): report path. csv.
+        flags (dict): flags. Keys 'catalog', 'catalog_path' and
+            'target_profile'.
+    """
+
+    if flags.get("catalog", 0) != 1 or not Path(path_file_report).exists():
+        return
+    try:
+        catalog = get_catalog(flags.get("catalog_path", ""))
+        try:
+            catalog.record_report(
+                path_file_report, flags.get("target_profile", "")
+            )
+        finally:
+            catalog.close()
+    except (sqlite3.Error, OSError) as e:
+        logging.error("Catalog not updated: %s", e)
@@ -4,12 +4,16 @@ import logging
 import os
 import sys
 from pathlib import Path
+from typing import Union
 
 from . import utils
 
 
 def test_folders_has_path_too_long(
-    list_path_folder: list[Path], max_path: int = 260, max_name: int = 150
+    list_path_folder: list[Path],
+    max_path: int = 260,
+    max_name: int = 150,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
 ) -> tuple[list[Path], list[Path]]:
     """tests a serie of folders if any of them has files whose filepath
     has a larger length than stipulated in max_path
@@ -18,6 +22,8 @@ def test_folders_has_path_too_long(
         list_path_folder (list[Path]): list of path_folder to be tested
         max_path (int, optional): max filepath len permitted. Defaults to 260.
         max_name (int, optional): max name len permitted. Defaults to 150.
+        snapshot (utils.TreeSnapshot, optional): tree snapshot already taken,
+            containing the folders. Defaults to None.
 
     Returns:
         list[Path]: [list_folders_path_approved: less than max_path
@@ -28,8 +34,14 @@ def test_folders_has_path_too_long(
     list_folders_path_rejected: list[Path] = []
 
     for path_folder in list_path_folder:
+        if snapshot is None:
+            snapshot_folder = None
+        elif Path(path_folder) == snapshot.root:
+            snapshot_folder = snapshot
+        else:
+            snapshot_folder = snapshot.subtree(path_folder)
         dict_result_test_filepath_too_long = test_folder_has_filepath_too_long(
-            path_folder, max_path, max_name
+            path_folder, max_path, max_name, snapshot_folder
         )
         if dict_result_test_filepath_too_long["result"]:
             list_folders_path_approved.append(path_folder)
@@ -42,7 +54,10 @@ def test_folders_has_path_too_long(
 
 
 def test_folder_has_filepath_too_long(
-    folder_path: Path, max_path: int = 260, max_name: int = 260
+    folder_path: Path,
+    max_path: int = 260,
+    max_name: int = 260,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
 ) -> dict[str, bool | list[Path]]:
     """Test if a folder has any file with filepath too long
 
@@ -50,14 +65,17 @@ def test_folder_has_filepath_too_long(
         folder_path (Path): _description_
         max_path (int, optional): _description_. Defaults to 260.
         max_name (int, optional): _description_. Defaults to 260.
+        snapshot (utils.TreeSnapshot, optional): tree snapshot of
+            folder_path. If None, the folder is walked. Defaults to None.
 
     Returns:
         dict[str, bool | list[Path]]: _description_
     """
 
-    all_file_path = utils.get_all_file_path(folder_path)
-    list_file_path = all_file_path["content"]
-    list_file_path_errors = all_file_path["errors"]
+    if snapshot is None:
+        snapshot = utils.scan_tree(folder_path)
+    list_file_path = snapshot.get_file_paths()
+    list_file_path_errors = snapshot.errors
 
     list_file_name_long: list[Path] = []
     list_file_path_long: list[Path] = []
@@ -105,7 +123,6 @@ def open_folder_in_explorer(list_file_path: list[Path]):
 def show_alert_filepath_too_long(
     dict_result_test_filepath_too_long: dict[str, list[Path] | bool]
 ):
-
     return_ = dict_result_test_filepath_too_long
     if return_["result"] is False:
         # Open folders that need adjustments
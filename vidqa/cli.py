@@ -1,13 +1,25 @@
 """Console script for vidqa."""
 from __future__ import annotations
 
+import sqlite3
 import sys
+from datetime import datetime
 from pathlib import Path
 from typing import Union
 
 import click
 
-from . import config, move_project, sanitize_files, show_corrupt_videos, vidqa
+from . import (
+    config,
+    move_project,
+    sanitize_files,
+    show_corrupt_videos,
+    utils,
+    vidqa,
+)
+from .catalog import DICT_QUERY, get_catalog
+from .conversion_policy import get_profile
+from .probe_cache import get_probe_cache
 
 
 def one_time(
@@ -64,12 +76,19 @@ def batch_mode(
     config_data = config.get_data(config_file)
     max_path = int(config_data.get("max_path", 260))
     max_name = int(config_data.get("max_name", 150))
+    # single walk of the whole tree, shared by all the subprojects
+    snapshot = utils.scan_tree(folder_path)
     sanitize_files(
-        folder_path=folder_path, max_path=max_path, max_name=max_name
+        folder_path=folder_path,
+        max_path=max_path,
+        max_name=max_name,
+        snapshot=snapshot,
     )
 
     list_folder_path = [
-        path for path in folder_path.iterdir() if path.is_dir()
+        entry.path
+        for entry in snapshot.dirs
+        if entry.path.parent == folder_path
     ]
     for folder_path in list_folder_path:
         vidqa(
@@ -77,6 +96,7 @@ def batch_mode(
             report_path=None,
             path_folder_convert=path_folder_convert,
             video_extensions=video_extensions,
+            snapshot=snapshot.subtree(folder_path),
         )
         move_project(folder_path)
     for folder_path in list_folder_path:
@@ -252,6 +272,205 @@ def main(
     type=click.Choice(["0", "1"]),
     help="Flag to allow project to be moved after optimization",
 )
+@click.option(
+    "-pw",
+    "--probe_workers",
+    required=False,
+    type=click.IntRange(min=1),
+    help="set number of ffprobe processes running at the same time",
+)
+@click.option(
+    "-cp",
+    "--cache_probe",
+    required=False,
+    type=click.Choice(["0", "1"]),
+    help="flag to allow reuse of ffprobe metadata from the probe cache",
+)
+@click.option(
+    "-ca",
+    "--cache_path",
+    required=False,
+    type=click.STRING,
+    help="set probe cache file path. Empty for the user cache folder",
+)
+@click.option(
+    "-cm",
+    "--cache_max_entries",
+    required=False,
+    type=click.IntRange(min=1),
+    help="set maximum number of files kept in the probe cache",
+)
+@click.option(
+    "-ij",
+    "--io_jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    help="set number of concurrent stream copy conversions",
+)
+@click.option(
+    "-cj",
+    "--cpu_jobs",
+    required=False,
+    type=click.IntRange(min=1),
+    help="set number of concurrent libx264 conversions",
+)
+@click.option(
+    "-tj",
+    "--threads_per_job",
+    required=False,
+    type=click.IntRange(min=0),
+    help="set libx264 threads of each conversion. 0 lets ffmpeg decide",
+)
+@click.option(
+    "-jo",
+    "--job_order",
+    required=False,
+    type=click.Choice(["fifo", "lpt", "spt", "quick_wins"]),
+    help="set order of the conversions",
+)
+@click.option(
+    "-sm",
+    "--segment_min_duration",
+    required=False,
+    type=click.FloatRange(min=0),
+    help=(
+        "set minimum duration in seconds to encode a video in parallel "
+        "segments. 0 disables"
+    ),
+)
+@click.option(
+    "-ss",
+    "--segment_seconds",
+    required=False,
+    type=click.FloatRange(min=1),
+    help="set duration in seconds of each segment",
+)
+@click.option(
+    "-sw",
+    "--segment_workers",
+    required=False,
+    type=click.IntRange(min=1),
+    help="set number of segments encoded in parallel",
+)
+@click.option(
+    "-pl",
+    "--pipeline",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help=(
+        "set 1 to probe and convert at the same time, as a streaming pipeline"
+    ),
+)
+@click.option(
+    "-pf",
+    "--probe_full",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help=(
+        "set 1 to keep the full ffprobe output in the metadata dump. 0 asks "
+        "ffprobe only for the fields of the report"
+    ),
+)
+@click.option(
+    "-pq",
+    "--probe_fast",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help="set 1 to probe first with small probesize/analyzeduration limits",
+)
+@click.option(
+    "-ps",
+    "--probe_fast_size",
+    required=False,
+    type=click.IntRange(min=32),
+    help="set maximum bytes read by the fast probe",
+)
+@click.option(
+    "-pd",
+    "--probe_fast_duration",
+    required=False,
+    type=click.IntRange(min=0),
+    help="set maximum microseconds analyzed by the fast probe",
+)
+@click.option(
+    "-pn",
+    "--probe_native",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help="set 1 to read mp4/mov/mkv/webm/avi headers without ffprobe",
+)
+@click.option(
+    "-pt",
+    "--probe_timeout",
+    required=False,
+    type=click.FloatRange(min=0),
+    help="seconds before a hung ffprobe is killed. 0 for no limit",
+)
+@click.option(
+    "-pr",
+    "--probe_retries",
+    required=False,
+    type=click.IntRange(min=0),
+    help="retries of ffprobe on transient I/O errors",
+)
+@click.option(
+    "-mg",
+    "--metadata_gzip",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help="set 1 to gzip the metadata dump (jsonl.gz)",
+)
+@click.option(
+    "-rr",
+    "--report_refresh",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help=(
+        "set 1 to refresh an existing report, probing only new or changed "
+        "videos"
+    ),
+)
+@click.option(
+    "-tp",
+    "--target_profile",
+    required=False,
+    type=str,
+    help=(
+        "target profile of the conversion, a [profile:<name>] section of "
+        "config.ini"
+    ),
+)
+@click.option(
+    "-re",
+    "--report_export",
+    required=False,
+    type=click.Choice(["none", "parquet", "feather"]),
+    help="export the report also as parquet or feather (needs pyarrow)",
+)
+@click.option(
+    "-cg",
+    "--catalog",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help="set 1 to record the projects in the cross-project catalog",
+)
+@click.option(
+    "-cgp",
+    "--catalog_path",
+    required=False,
+    type=str,
+    help="catalog file path. Empty to use the user cache folder",
+)
+@click.option(
+    "-sv",
+    "--salvage",
+    required=False,
+    type=click.IntRange(min=0, max=1),
+    help=(
+        "set 1 to adopt valid converted videos already in the log folder "
+        "instead of converting again"
+    ),
+)
 def flags(
     crf: Union[float, None],
     maxrate: Union[float, None],
@@ -263,6 +482,32 @@ def flags(
     max_name: Union[int, None],
     folder_destination: Union[str, None],
     move_done: Union[int, None],
+    probe_workers: Union[int, None],
+    cache_probe: Union[int, None],
+    cache_path: Union[str, None],
+    cache_max_entries: Union[int, None],
+    io_jobs: Union[int, None],
+    cpu_jobs: Union[int, None],
+    threads_per_job: Union[int, None],
+    job_order: Union[str, None],
+    segment_min_duration: Union[float, None],
+    segment_seconds: Union[float, None],
+    segment_workers: Union[int, None],
+    pipeline: Union[int, None],
+    probe_full: Union[int, None],
+    probe_fast: Union[int, None],
+    probe_fast_size: Union[int, None],
+    probe_fast_duration: Union[int, None],
+    probe_native: Union[int, None],
+    probe_timeout: Union[float, None],
+    probe_retries: Union[int, None],
+    metadata_gzip: Union[int, None],
+    report_refresh: Union[int, None],
+    target_profile: Union[str, None],
+    report_export: Union[str, None],
+    catalog: Union[int, None],
+    catalog_path: Union[str, None],
+    salvage: Union[int, None],
 ):
     """Update Flags from Config.ini file
 
@@ -283,6 +528,58 @@ def flags(
             moved after optimization.
         move_done: (Union[int, None]): Flag to allow project to be moved after
             optimization (1 for allowed, 0 for disallowed).
+        probe_workers: (Union[int, None]): Number of ffprobe processes running
+            at the same time during the metadata analysis.
+        cache_probe: (Union[int, None]): Flag to allow reuse of ffprobe
+            metadata from the probe cache (1 for allowed, 0 for disallowed).
+        cache_path: (Union[str, None]): Probe cache file path.
+        cache_max_entries: (Union[int, None]): Maximum number of files kept
+            in the probe cache.
+        io_jobs: (Union[int, None]): Number of concurrent stream copy
+            conversions (container and audio only).
+        cpu_jobs: (Union[int, None]): Number of concurrent libx264
+            conversions.
+        threads_per_job: (Union[int, None]): libx264 threads of each
+            conversion. 0 lets ffmpeg decide.
+        job_order: (Union[str, None]): Order of the conversions. fifo:
+            report order. lpt: longest first. spt: shortest first.
+            quick_wins: container and audio conversions first.
+        segment_min_duration: (Union[float, None]): Minimum duration in
+            seconds of a video to encode it in parallel segments. 0
+            disables.
+        segment_seconds: (Union[float, None]): Duration in seconds of each
+            segment. Segments end at the next keyframe.
+        segment_workers: (Union[int, None]): Number of segments encoded in
+            parallel.
+        pipeline: (Union[int, None]): Flag to probe and convert at the
+            same time, as a streaming pipeline.
+        probe_full: (Union[int, None]): Flag to keep the full ffprobe
+            output. 0 asks ffprobe only for the fields of the report.
+        probe_fast: (Union[int, None]): Flag to probe first with small
+            probesize/analyzeduration limits.
+        probe_fast_size: (Union[int, None]): Maximum bytes read by the
+            fast probe (-probesize).
+        probe_fast_duration: (Union[int, None]): Maximum microseconds of
+            media analyzed by the fast probe (-analyzeduration).
+        probe_native: (Union[int, None]): Flag to read video headers with
+            the native parsers, without ffprobe, when possible.
+        probe_timeout: (Union[float, None]): Seconds before a hung ffprobe
+            is killed. 0 for no limit.
+        probe_retries: (Union[int, None]): Retries of ffprobe on transient
+            I/O errors, with exponential backoff.
+        metadata_gzip: (Union[int, None]): Flag to gzip the metadata
+            dump of the report.
+        report_refresh: (Union[int, None]): Flag to refresh an existing
+            report, probing only new or changed videos.
+        target_profile: (Union[str, None]): Name of the target profile
+            of the conversion, a [profile:<name>] section of config.ini.
+        report_export: (Union[str, None]): Columnar export of the
+            report: none, parquet or feather.
+        catalog: (Union[int, None]): Flag to record each analysed
+            project in the cross-project catalog (1 for yes, 0 for no).
+        catalog_path: (Union[str, None]): Catalog file path.
+        salvage: (Union[int, None]): Flag to adopt valid converted
+            videos already in the log folder (1 for yes, 0 for no).
     Raises:
         ValueError: If the given CRF value is not a number
             or not between 0 and 51
@@ -358,6 +655,190 @@ def flags(
             value=str(move_done),
         )
         click.echo(f"Flag move_done set to: {move_done}")
+    elif probe_workers is not None:
+        config.set_data(
+            config_file,
+            variable="probe_workers",
+            value=str(probe_workers),
+        )
+        click.echo(f"Flag probe_workers set to: {probe_workers}")
+    elif cache_probe is not None:
+        config.set_data(
+            config_file,
+            variable="cache_probe",
+            value=str(cache_probe),
+        )
+        click.echo(f"Flag cache_probe set to: {cache_probe}")
+    elif cache_path is not None:
+        config.set_data(
+            config_file,
+            variable="cache_path",
+            value=str(cache_path),
+        )
+        click.echo(f"Flag cache_path set to: {cache_path}")
+    elif cache_max_entries is not None:
+        config.set_data(
+            config_file,
+            variable="cache_max_entries",
+            value=str(cache_max_entries),
+        )
+        click.echo(f"Flag cache_max_entries set to: {cache_max_entries}")
+    elif io_jobs is not None:
+        config.set_data(
+            config_file,
+            variable="io_jobs",
+            value=str(io_jobs),
+        )
+        click.echo(f"Flag io_jobs set to: {io_jobs}")
+    elif cpu_jobs is not None:
+        config.set_data(
+            config_file,
+            variable="cpu_jobs",
+            value=str(cpu_jobs),
+        )
+        click.echo(f"Flag cpu_jobs set to: {cpu_jobs}")
+    elif threads_per_job is not None:
+        config.set_data(
+            config_file,
+            variable="threads_per_job",
+            value=str(threads_per_job),
+        )
+        click.echo(f"Flag threads_per_job set to: {threads_per_job}")
+    elif job_order is not None:
+        config.set_data(
+            config_file,
+            variable="job_order",
+            value=str(job_order),
+        )
+        click.echo(f"Flag job_order set to: {job_order}")
+    elif segment_min_duration is not None:
+        config.set_data(
+            config_file,
+            variable="segment_min_duration",
+            value=str(segment_min_duration),
+        )
+        click.echo(f"Flag segment_min_duration set to: {segment_min_duration}")
+    elif segment_seconds is not None:
+        config.set_data(
+            config_file,
+            variable="segment_seconds",
+            value=str(segment_seconds),
+        )
+        click.echo(f"Flag segment_seconds set to: {segment_seconds}")
+    elif segment_workers is not None:
+        config.set_data(
+            config_file,
+            variable="segment_workers",
+            value=str(segment_workers),
+        )
+        click.echo(f"Flag segment_workers set to: {segment_workers}")
+    elif pipeline is not None:
+        config.set_data(
+            config_file,
+            variable="pipeline",
+            value=str(pipeline),
+        )
+        click.echo(f"Flag pipeline set to: {pipeline}")
+    elif probe_full is not None:
+        config.set_data(
+            config_file,
+            variable="probe_full",
+            value=str(probe_full),
+        )
+        click.echo(f"Flag probe_full set to: {probe_full}")
+    elif probe_fast is not None:
+        config.set_data(
+            config_file,
+            variable="probe_fast",
+            value=str(probe_fast),
+        )
+        click.echo(f"Flag probe_fast set to: {probe_fast}")
+    elif probe_fast_size is not None:
+        config.set_data(
+            config_file,
+            variable="probe_fast_size",
+            value=str(probe_fast_size),
+        )
+        click.echo(f"Flag probe_fast_size set to: {probe_fast_size}")
+    elif probe_fast_duration is not None:
+        config.set_data(
+            config_file,
+            variable="probe_fast_duration",
+            value=str(probe_fast_duration),
+        )
+        click.echo(f"Flag probe_fast_duration set to: {probe_fast_duration}")
+    elif probe_native is not None:
+        config.set_data(
+            config_file,
+            variable="probe_native",
+            value=str(probe_native),
+        )
+        click.echo(f"Flag probe_native set to: {probe_native}")
+    elif probe_timeout is not None:
+        config.set_data(
+            config_file,
+            variable="probe_timeout",
+            value=str(probe_timeout),
+        )
+        click.echo(f"Flag probe_timeout set to: {probe_timeout}")
+    elif probe_retries is not None:
+        config.set_data(
+            config_file,
+            variable="probe_retries",
+            value=str(probe_retries),
+        )
+        click.echo(f"Flag probe_retries set to: {probe_retries}")
+    elif metadata_gzip is not None:
+        config.set_data(
+            config_file,
+            variable="metadata_gzip",
+            value=str(metadata_gzip),
+        )
+        click.echo(f"Flag metadata_gzip set to: {metadata_gzip}")
+    elif report_refresh is not None:
+        config.set_data(
+            config_file,
+            variable="report_refresh",
+            value=str(report_refresh),
+        )
+        click.echo(f"Flag report_refresh set to: {report_refresh}")
+    elif target_profile is not None:
+        # raises ValueError if config.ini has no such profile
+        get_profile({"target_profile": target_profile}, config_file)
+        config.set_data(
+            config_file,
+            variable="target_profile",
+            value=str(target_profile),
+        )
+        click.echo(f"Flag target_profile set to: {target_profile}")
+    elif report_export is not None:
+        config.set_data(
+            config_file,
+            variable="report_export",
+            value=str(report_export),
+        )
+        click.echo(f"Flag report_export set to: {report_export}")
+    elif catalog is not None:
+        config.set_data(
+            config_file,
+            variable="catalog",
+            value=str(catalog),
+        )
+        click.echo(f"Flag catalog set to: {catalog}")
+    elif catalog_path is not None:
+        config.set_data(
+            config_file,
+            variable="catalog_path",
+            value=str(catalog_path),
+        )
+        click.echo(f"Flag catalog_path set to: {catalog_path}")
+    elif salvage is not None:
+        config.set_data(
+            config_file,
+            variable="salvage",
+            value=str(salvage),
+        )
+        click.echo(f"Flag salvage set to: {salvage}")
 
     else:
         click.echo("--Actual flags--")
@@ -366,5 +847,131 @@ def flags(
             click.echo(f"{key}: {value}")
 
 
+@main.command()
+@click.option(
+    "-p",
+    "--prune",
+    is_flag=True,
+    help="remove entries of missing or changed files and apply the size cap",
+)
+@click.option(
+    "-cm",
+    "--max_entries",
+    required=False,
+    type=click.IntRange(min=0),
+    help="size cap to apply when pruning. Defaults to cache_max_entries",
+)
+@click.option(
+    "--clear",
+    is_flag=True,
+    help="remove all entries",
+)
+def cache(prune: bool, max_entries: Union[int, None], clear: bool):
+    """Inspect and prune the probe cache
+
+    Args:
+        prune (bool): Remove entries of missing or changed files and keep
+            only the most recently used max_entries.
+        max_entries (Union[int, None]): Size cap to apply when pruning.
+        clear (bool): Remove all entries.
+    """
+
+    config_file = Path(__file__).absolute().parent / "config.ini"
+    config_data = config.get_data(config_file)
+    cache_max_entries = int(config_data.get("cache_max_entries", 200000))
+    probe_cache = get_probe_cache(
+        config_data.get("cache_path", ""), max_entries=cache_max_entries
+    )
+    try:
+        if clear:
+            probe_cache.clear()
+            click.echo("Probe cache cleared")
+        elif prune:
+            qt_stale = probe_cache.remove_stale()
+            qt_evicted = probe_cache.evict(max_entries)
+            click.echo(f"Removed {qt_stale} stale entries")
+            click.echo(f"Evicted {qt_evicted} entries over the size cap")
+
+        click.echo("--Probe cache--")
+        for key, value in probe_cache.info().items():
+            if key.endswith("_access") and value is not None:
+                value = datetime.fromtimestamp(value).isoformat(
+                    sep=" ", timespec="seconds"
+                )
+            click.echo(f"{key}: {value}")
+    finally:
+        probe_cache.close()
+
+
+@main.group()
+def catalog():
+    """Query the catalog of all the analysed projects"""
+
+
+@catalog.command()
+@click.argument("name", required=False, type=click.Choice(sorted(DICT_QUERY)))
+@click.option(
+    "-s",
+    "--sql",
+    required=False,
+    type=str,
+    help="read-only SQL query over the tables file and run",
+)
+def query(name: Union[str, None], sql: Union[str, None]):
+    """Run a named query or a read-only SQL query over the catalog.
+    Without arguments, lists the named queries.
+
+    Args:
+        name (Union[str, None]): Named query, key of catalog.DICT_QUERY.
+        sql (Union[str, None]): SQL query.
+    """
+
+    if name is None and sql is None:
+        click.echo("--Catalog queries--")
+        for key, (description, _) in sorted(DICT_QUERY.items()):
+            click.echo(f"{key}: {description}")
+        return
+    config_file = Path(__file__).absolute().parent / "config.ini"
+    config_data = config.get_data(config_file)
+    catalog_ = get_catalog(config_data.get("catalog_path", ""))
+    try:
+        df = catalog_.query(sql if sql is not None else DICT_QUERY[name][1])
+    except sqlite3.Error as e:
+        raise click.ClickException(f"Catalog query failed: {e}")
+    finally:
+        catalog_.close()
+    if df.empty:
+        click.echo("No rows")
+    else:
+        click.echo(df.to_string(index=False))
+
+
+@catalog.command()
+@click.argument(
+    "list_path_report",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+)
+def add(list_path_report: tuple):
+    """Record existing reports in the catalog
+
+    Args:
+        list_path_report (tuple): Report paths. csv.
+    """
+
+    config_file = Path(__file__).absolute().parent / "config.ini"
+    config_data = config.get_data(config_file)
+    catalog_ = get_catalog(config_data.get("catalog_path", ""))
+    try:
+        for path_report in list_path_report:
+            qt_file = catalog_.record_report(
+                Path(path_report), config_data.get("target_profile", "")
+            )
+            click.echo(f"{path_report}: {qt_file} files recorded")
+    finally:
+        catalog_.close()
+
+
 if __name__ == "__main__":
     sys.exit(main())
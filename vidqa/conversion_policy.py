@@ -0,0 +1,294 @@
+"""Target profiles of the conversion.
+
+A target profile declares the streams and the container a video must have
+to be left as is: allowed codecs, audio channel limit, container
+extensions and format names, resolution and video bitrate caps. Profiles
+are config.ini sections named 'profile:<name>' and flags['target_profile']
+selects one. The built-in DICT_PROFILE_DEFAULT, the historical mp4
+H264/AAC stereo target, is used when the config has no such section.
+
+Each profile is compiled into column predicates over the report, so a
+whole report is classified at once (see TargetProfile.classify), and into
+the ffmpeg arguments of each type_conversion, through the recipes of
+DICT_RECIPE.
+"""
+
+from __future__ import annotations
+
+import shlex
+from configparser import ConfigParser
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from .video_tools import get_libx264_args
+
+PROFILE_DEFAULT = "mp4_h264_aac"
+
+# prefix of the config.ini sections of the target profiles
+SECTION_PREFIX = "profile:"
+
+# keys of a profile section, values as written in config.ini
+DICT_PROFILE_DEFAULT = {
+    "video_codecs": "h264",
+    "audio_codecs": "aac",
+    "audio_channels_max": "2",
+    "extensions": "mp4",
+    "format_names": "mov,mp4,m4a,3gp,3g2,mj2",
+    "require_avc": "1",
+    "height_max": "0",
+    "video_bitrate_max": "0",
+    "video_args": "",
+    "audio_args": "-c:a aac -ac 2",
+}
+
+# type_conversion: (name, video is encoded, audio is encoded)
+DICT_RECIPE = {
+    "2_container": ("container", False, False),
+    "3_only_audio": ("only audio", False, True),
+    "4_only_video": ("only video", True, False),
+    "5_total_conv": ("both audio and video", True, True),
+}
+
+
+def split_list(value: str) -> list[str]:
+    return [x.strip().lower() for x in value.split(",") if x.strip() != ""]
+
+
+class TargetProfile:
+    """Target of the conversion.
+
+    Attributes:
+        name (str): profile name
+        video_codecs (list[str]): allowed video codec_name
+        audio_codecs (list[str]): allowed audio codec_name
+        audio_channels_max (int): maximum audio channels. 0 for no limit.
+        extensions (list[str]): allowed file extensions, without dot. The
+            first one is the extension of converted videos.
+        format_names (list[str]): allowed ffprobe format_name. Separated
+            by ';' in config.ini, as format names have commas.
+        require_avc (bool): the video stream must be avc
+        height_max (int): maximum video height. Taller videos are scaled
+            down when encoded. 0 for no limit.
+        video_bitrate_max (float): maximum video bitrate, Mbit/s. 0 for no
+            limit.
+        video_args (str): ffmpeg arguments to encode the video. Keys of
+            the flags, like {crf} and {maxrate}, are replaced. Empty for
+            libx264, see video_tools.get_libx264_args.
+        audio_args (str): ffmpeg arguments to encode the audio
+    """
+
+    __slots__ = (
+        "name",
+        "video_codecs",
+        "audio_codecs",
+        "audio_channels_max",
+        "extensions",
+        "format_names",
+        "require_avc",
+        "height_max",
+        "video_bitrate_max",
+        "video_args",
+        "audio_args",
+    )
+
+    def __init__(self, name: str, dict_section: dict):
+        dict_value = dict(DICT_PROFILE_DEFAULT)
+        dict_value.update(dict_section)
+        self.name = name
+        self.video_codecs = split_list(dict_value["video_codecs"])
+        self.audio_codecs = split_list(dict_value["audio_codecs"])
+        self.audio_channels_max = int(dict_value["audio_channels_max"])
+        self.extensions = [
+            x.lstrip(".") for x in split_list(dict_value["extensions"])
+        ]
+        self.format_names = [
+            x.strip() for x in dict_value["format_names"].split(";")
+        ]
+        self.require_avc = int(dict_value["require_avc"]) == 1
+        self.height_max = int(dict_value["height_max"])
+        self.video_bitrate_max = float(dict_value["video_bitrate_max"])
+        self.video_args = dict_value["video_args"].strip()
+        self.audio_args = dict_value["audio_args"].strip()
+        if len(self.extensions) == 0:
+            raise ValueError(f"Target profile without extensions: {name}")
+
+    @property
+    def extension(self) -> str:
+        """Extension of converted videos, without dot"""
+
+        return self.extensions[0]
+
+    def classify(self, df: pd.DataFrame) -> pd.Series:
+        """Sets the type of conversion of each video of a report.
+
+        Args:
+            df (pd.DataFrame): report. Columns video_codec, audio_codec,
+                audio_channels, is_avc, path_file and format_name, and
+                video_resolution_height and video_bitrate if the profile
+                caps them.
+
+        Returns:
+            pd.Series: type_conversion of each line
+        """
+
+        stream_video_ok = df["video_codec"].isin(self.video_codecs)
+        if self.height_max > 0:
+            # unknown values do not fail the cap
+            stream_video_ok &= ~(
+                pd.to_numeric(df["video_resolution_height"], errors="coerce")
+                > self.height_max
+            )
+        if self.video_bitrate_max > 0:
+            stream_video_ok &= ~(
+                pd.to_numeric(df["video_bitrate"], errors="coerce")
+                > self.video_bitrate_max * 1e6
+            )
+
+        audio_stream_ok = df["audio_codec"].isin(self.audio_codecs)
+        if self.audio_channels_max > 0:
+            audio_stream_ok &= df["audio_channels"] <= self.audio_channels_max
+
+        # the container matters only for videos with both streams ok
+        streams_ok = stream_video_ok & audio_stream_ok
+        df_candidate = df.loc[streams_ok]
+        tuple_extension = tuple("." + x for x in self.extensions)
+        container_ok = pd.Series(
+            [
+                str(x).lower().endswith(tuple_extension)
+                for x in df_candidate["path_file"].tolist()
+            ],
+            index=df_candidate.index,
+            dtype=bool,
+        ) & df_candidate["format_name"].isin(self.format_names)
+        if self.require_avc:
+            container_ok &= df_candidate["is_avc"].isin([1])
+        container_ok = container_ok.reindex(df.index, fill_value=False)
+
+        array_type = np.select(
+            [
+                container_ok,
+                streams_ok,
+                stream_video_ok,
+                audio_stream_ok,
+            ],
+            ["1_not_needed", "2_container", "3_only_audio", "4_only_video"],
+            default="5_total_conv",
+        )
+        return pd.Series(array_type, index=df.index, dtype=object)
+
+    def get_video_args(self, flags: dict, faststart: bool = True) -> list[str]:
+        """Returns the ffmpeg arguments to encode the video stream.
+
+        Args:
+            flags (dict): video conversion flags
+            faststart (bool, optional): include the mp4 muxer flag
+                faststart, for the libx264 default. Defaults to True.
+
+        Returns:
+            list[str]: ffmpeg arguments
+        """
+
+        if self.video_args == "":
+            list_arg = get_libx264_args(flags, faststart)
+        else:
+            list_arg = shlex.split(self.video_args.format(**flags))
+        if self.height_max > 0:
+            list_arg += ["-vf", f"scale=-2:'min({self.height_max},ih)'"]
+        return list_arg
+
+    def get_audio_args(self) -> list[str]:
+        """Returns the ffmpeg arguments to encode the audio stream"""
+
+        return shlex.split(self.audio_args)
+
+    def get_recipe_args(
+        self,
+        type_conversion: str,
+        path_file_origin: str,
+        path_file_dest: str,
+        flags: dict,
+    ) -> list[str]:
+        """Returns the ffmpeg arguments of a conversion.
+
+        Args:
+            type_conversion (str): type of conversion, key of DICT_RECIPE
+            path_file_origin (str): input video path
+            path_file_dest (str): output video path
+            flags (dict): video conversion flags
+
+        Returns:
+            list[str]: ffmpeg arguments
+
+        Raises:
+            KeyError: if type_conversion has no recipe
+        """
+
+        _, video_encoded, audio_encoded = DICT_RECIPE[type_conversion]
+        list_arg = ["-y", "-i", path_file_origin, "-map_metadata", "-1"]
+        if video_encoded:
+            list_arg += self.get_video_args(flags)
+        else:
+            list_arg += ["-c:v", "copy"]
+        if audio_encoded:
+            list_arg += self.get_audio_args()
+        else:
+            list_arg += ["-c:a", "copy"]
+        return list_arg + [path_file_dest]
+
+
+@lru_cache(maxsize=None)
+def load_profiles(path_file_config: Path) -> dict[str, TargetProfile]:
+    """Reads the target profiles of a config file.
+
+    Args:
+        path_file_config (Path): path configuration file
+
+    Returns:
+        dict[str, TargetProfile]: profiles by name, with the built-in
+            PROFILE_DEFAULT if the file does not declare it
+    """
+
+    config_file = ConfigParser(interpolation=None)
+    config_file.read(path_file_config)
+    dict_profile = {PROFILE_DEFAULT: TargetProfile(PROFILE_DEFAULT, {})}
+    for section in config_file.sections():
+        if section.startswith(SECTION_PREFIX):
+            name = section[len(SECTION_PREFIX):]
+            dict_profile[name] = TargetProfile(
+                name, dict(config_file[section])
+            )
+    return dict_profile
+
+
+def get_profile(
+    flags: dict, path_file_config: Union[Path, None] = None
+) -> TargetProfile:
+    """Returns the target profile of the flags.
+
+    Args:
+        flags (dict): video conversion flags. Key 'target_profile':
+            profile name. Defaults to PROFILE_DEFAULT.
+        path_file_config (Path, optional): path configuration file.
+            Defaults to the config.ini of the package.
+
+    Returns:
+        TargetProfile: target profile
+
+    Raises:
+        ValueError: if the config has no such profile
+    """
+
+    if path_file_config is None:
+        path_file_config = Path(__file__).absolute().parent / "config.ini"
+    name = flags.get("target_profile") or PROFILE_DEFAULT
+    dict_profile = load_profiles(Path(path_file_config))
+    if name not in dict_profile:
+        raise ValueError(
+            f"Target profile not found: {name}. "
+            f"Available: {', '.join(sorted(dict_profile))}"
+        )
+    return dict_profile[name]
@@ -4,22 +4,39 @@ source: https://stackoverflow.com/a/63215561/10681595
 
 import json
 import logging
+import os
+import signal
 import subprocess
 from pathlib import Path
 
 
 class FFProbeResult:
+    # one per probed file: no per-instance __dict__
+    __slots__ = (
+        "return_code",
+        "output",
+        "error",
+        "format",
+        "file_path",
+        "timed_out",
+        "_output_as_dict",
+    )
+
     def __init__(
         self,
         return_code: int = None,
         output: str = "",
         error: str = "",
         format=None,
+        file_path=None,
+        timed_out: bool = False,
     ):
         self.return_code = return_code
         self.output = output
         self.error = error
         self.format = format
+        self.file_path = file_path
+        self.timed_out = timed_out
         self._output_as_dict = None
 
     def get_output_as_dict(self):
@@ -51,9 +68,21 @@ class FFProbeResult:
             logging.debug("Dumped ffprobe output into %s", path)
 
 
-def ffprobe(
-    file_path, ffprobe_format="json", format_optn="", log_level="error"
-) -> FFProbeResult:
+def get_command_array(
+    file_path,
+    ffprobe_format="json",
+    format_optn="",
+    log_level="error",
+    show_entries=None,
+    probesize=None,
+    analyzeduration=None,
+) -> list:
+    """
+    :param show_entries: ffprobe -show_entries specification. If None, shows
+        programs, format and streams in full.
+    :param probesize: maximum bytes read to analyze the input
+    :param analyzeduration: maximum microseconds of input analyzed
+    """
 
     assert ffprobe_format in ["json", "flat"], (
         "format must be json or flat, not %s" % ffprobe_format
@@ -65,32 +94,109 @@ def ffprobe(
         log_level,
         "-print_format",
         ffprobe_format + format_optn,
-        "-show_programs",
-        "-show_format",
-        "-show_streams",
-        f"{file_path}",
     ]
+    if show_entries is None:
+        command_array += ["-show_programs", "-show_format", "-show_streams"]
+    else:
+        command_array += ["-show_entries", show_entries]
+    if probesize is not None:
+        command_array += ["-probesize", str(probesize)]
+    if analyzeduration is not None:
+        command_array += ["-analyzeduration", str(analyzeduration)]
+    command_array.append(f"{file_path}")
+    return command_array
+
+
+def get_popen_kwargs() -> dict:
+    """Returns the Popen arguments that start ffprobe in its own process
+    group, so a hung probe can be killed with everything it spawned."""
+
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def kill_process_group(process: subprocess.Popen) -> None:
+    """Kills a process started with get_popen_kwargs and its children."""
+
     try:
-        result = subprocess.run(
+        if os.name == "nt":
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # already gone
+        pass
+
+
+def ffprobe(
+    file_path,
+    ffprobe_format="json",
+    format_optn="",
+    log_level="error",
+    show_entries=None,
+    probesize=None,
+    analyzeduration=None,
+    timeout=None,
+) -> FFProbeResult:
+    """
+    :param timeout: seconds before ffprobe and its process group are
+        killed. On timeout the result has timed_out True and an empty
+        output. If None, waits forever.
+    """
+
+    command_array = get_command_array(
+        file_path,
+        ffprobe_format,
+        format_optn,
+        log_level,
+        show_entries,
+        probesize,
+        analyzeduration,
+    )
+    try:
+        process = subprocess.Popen(
             command_array,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             universal_newlines=True,
             encoding="utf8",
+            **get_popen_kwargs(),
         )
     except Exception as e:
         logging.critical(
             "ffprobe failed to run on %s, with the following error: '%s'\n"
             " check first that cmd is in your path",
             file_path,
-            result.stderr,
+            e,
             exc_info=True,
         )
         raise e
 
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        process.communicate()
+        logging.error("ffprobe timeout (%ss): %s", timeout, file_path)
+        return FFProbeResult(
+            return_code=process.returncode,
+            output="{}" if ffprobe_format == "json" else "",
+            error=f"ffprobe timeout after {timeout}s",
+            format=ffprobe_format,
+            file_path=file_path,
+            timed_out=True,
+        )
+    except BaseException:
+        # interrupted: do not leave the process running
+        kill_process_group(process)
+        process.communicate()
+        raise
+
     return FFProbeResult(
-        return_code=result.returncode,
-        output=result.stdout,
-        error=result.stderr,
+        return_code=process.returncode,
+        output=stdout,
+        error=stderr,
         format=ffprobe_format,
+        file_path=file_path,
     )
@@ -0,0 +1,155 @@
+"""Cost model of conversion jobs and ordering policies of the job store.
+
+The processing time of a job is estimated from the report metadata as:
+
+    duration_seconds * (base + per_megapixel * megapixels) * calibration
+
+base and per_megapixel depend on the type_conversion. calibration starts at
+1.0 and follows the ratio between measured and estimated times of the
+finished jobs. It is kept in cost_model.json in the user cache folder, so
+it improves from one run to the next.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+from pathlib import Path
+from typing import Union
+
+from .probe_cache import get_cache_dir
+
+# seconds of processing per second of media
+DICT_COEFFICIENT = {
+    "2_container": {"base": 0.005, "per_megapixel": 0.0},
+    "3_only_audio": {"base": 0.02, "per_megapixel": 0.0},
+    "4_only_video": {"base": 0.02, "per_megapixel": 0.25},
+    "5_total_conv": {"base": 0.04, "per_megapixel": 0.25},
+}
+
+# Job ordering policies: ORDER BY clause of the job store claim.
+# - fifo: report order
+# - lpt: longest processing time first, minimizes makespan on a pool
+# - spt: shortest processing time first, maximizes files finished early
+# - quick_wins: stream copy jobs first, then shortest first
+DICT_ORDER_BY = {
+    "fifo": "id",
+    "lpt": "est_cost DESC, id",
+    "spt": "est_cost ASC, id",
+    "quick_wins": (
+        "CASE WHEN type_conversion IN ('2_container', '3_only_audio') "
+        "THEN 0 ELSE 1 END, est_cost ASC, id"
+    ),
+}
+
+
+def get_float(value, default: float = 0.0) -> float:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    if math.isnan(value):
+        return default
+    return value
+
+
+class CostModel:
+    """Estimates the processing seconds of conversion jobs.
+
+    Args:
+        path_file_calibration (Path, optional): json file with the
+            calibration of each type_conversion. Defaults to None, for
+            no persistence.
+        alpha (float, optional): weight of each new measure in the
+            calibration. Defaults to 0.2.
+    """
+
+    def __init__(
+        self,
+        path_file_calibration: Union[Path, None] = None,
+        alpha: float = 0.2,
+    ):
+        self.path_file_calibration = path_file_calibration
+        self.alpha = alpha
+        self.dict_calibration = {x: 1.0 for x in DICT_COEFFICIENT}
+        if path_file_calibration is not None:
+            self.load()
+
+    def load(self) -> None:
+        if not self.path_file_calibration.exists():
+            return
+        try:
+            with open(self.path_file_calibration, encoding="utf-8") as f:
+                dict_calibration = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error("Can't read cost model calibration: %s", e)
+            return
+        for type_conversion, calibration in dict_calibration.items():
+            if type_conversion in self.dict_calibration:
+                self.dict_calibration[type_conversion] = float(calibration)
+
+    def save(self) -> None:
+        if self.path_file_calibration is None:
+            return
+        self.path_file_calibration.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path_file_calibration, "w", encoding="utf-8") as f:
+            json.dump(self.dict_calibration, f, indent=4)
+
+    def get_base_estimate(self, dict_video_data: dict) -> float:
+        """Returns the uncalibrated estimate of processing seconds"""
+
+        type_conversion = dict_video_data.get("type_conversion")
+        coefficient = DICT_COEFFICIENT.get(type_conversion)
+        if coefficient is None:
+            return 0.0
+        duration_seconds = get_float(dict_video_data.get("duration_seconds"))
+        megapixels = (
+            get_float(dict_video_data.get("video_resolution_width"))
+            * get_float(dict_video_data.get("video_resolution_height"))
+            / 1000000
+        )
+        return duration_seconds * (
+            coefficient["base"] + coefficient["per_megapixel"] * megapixels
+        )
+
+    def estimate(self, dict_video_data: dict) -> float:
+        """Returns the estimated processing seconds of a job
+
+        Args:
+            dict_video_data (dict): report line. keys: ['type_conversion',
+                'duration_seconds', 'video_resolution_width',
+                'video_resolution_height']
+
+        Returns:
+            float: seconds
+        """
+
+        calibration = self.dict_calibration.get(
+            dict_video_data.get("type_conversion"), 1.0
+        )
+        return self.get_base_estimate(dict_video_data) * calibration
+
+    def observe(self, dict_video_data: dict, elapsed_seconds: float) -> None:
+        """Calibrates the model with the measured time of a finished job
+
+        Args:
+            dict_video_data (dict): report line
+            elapsed_seconds (float): measured processing seconds
+        """
+
+        type_conversion = dict_video_data.get("type_conversion")
+        base_estimate = self.get_base_estimate(dict_video_data)
+        if type_conversion not in self.dict_calibration or base_estimate <= 0:
+            return
+        ratio = elapsed_seconds / base_estimate
+        calibration = self.dict_calibration[type_conversion]
+        self.dict_calibration[type_conversion] = (
+            1 - self.alpha
+        ) * calibration + self.alpha * ratio
+
+
+def get_cost_model() -> CostModel:
+    """Returns the cost model calibrated by the previous runs"""
+
+    return CostModel(get_cache_dir() / "cost_model.json")
@@ -0,0 +1,613 @@
+"""Transactional state of the conversion jobs of a report.
+
+The report CSV stays the compatibility view of the project. make_reencode
+claims and updates jobs here, one indexed row at a time, and exports the
+CSV back at checkpoints.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from .job_cost import DICT_ORDER_BY, CostModel
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_NOT_NEEDED = "not_needed"
+
+
+def get_path_job_store(path_file_report: Path) -> Path:
+    """Returns the job store path of a report: {report_stem}_jobs.sqlite3,
+    next to the report.
+
+    Args:
+        path_file_report (Path): report path. csv.
+
+    Returns:
+        Path: job store path
+    """
+
+    path_file_report = Path(path_file_report)
+    return path_file_report.parent / (path_file_report.stem + "_jobs.sqlite3")
+
+
+def get_status_from_row(row: dict) -> str:
+    if row.get("type_conversion") == "1_not_needed":
+        return STATUS_NOT_NEEDED
+    if row.get("conversion_done", 0) == 1:
+        return STATUS_DONE
+    return STATUS_PENDING
+
+
+def is_converted_kept(job: sqlite3.Row) -> bool:
+    """Checks if a job done in the store still has its converted video.
+    Jobs in other statuses are always kept."""
+
+    if job["status"] != STATUS_DONE:
+        return True
+    path_file_converted = job["path_file_converted"]
+    return path_file_converted is not None and os.path.exists(
+        path_file_converted
+    )
+
+
+class JobStore:
+    """SQLite store of conversion jobs, one row per report line.
+
+    Statuses: pending, running, done, failed and not_needed.
+    Jobs left running or failed by a previous execution return to pending
+    when the store is opened.
+    """
+
+    def __init__(self, path_file_db: Path):
+        self.path_file_db = Path(path_file_db)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            str(self.path_file_db), check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job ("
+            "id INTEGER PRIMARY KEY, "
+            "path_file TEXT NOT NULL UNIQUE, "
+            "type_conversion TEXT, "
+            "file_size INTEGER, "
+            "data TEXT NOT NULL, "
+            "status TEXT NOT NULL, "
+            "path_file_converted TEXT, "
+            "started_at REAL, "
+            "finished_at REAL, "
+            "error TEXT, "
+            "est_cost REAL)"
+        )
+        list_column = [
+            x["name"] for x in self._conn.execute("PRAGMA table_info(job)")
+        ]
+        if "est_cost" not in list_column:
+            self._conn.execute("ALTER TABLE job ADD COLUMN est_cost REAL")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_job_status ON job (status, id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_job_status_type "
+            "ON job (status, type_conversion, id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_job_status_cost "
+            "ON job (status, est_cost)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS segment ("
+            "path_file TEXT NOT NULL, "
+            "idx INTEGER NOT NULL, "
+            "recipe TEXT NOT NULL, "
+            "path_file_chunk TEXT NOT NULL, "
+            "path_file_encoded TEXT, "
+            "encoded_size INTEGER, "
+            "duration_seconds REAL, "
+            "PRIMARY KEY (path_file, idx))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "UPDATE job SET status = ?, started_at = NULL "
+            "WHERE status IN (?, ?)",
+            (STATUS_PENDING, STATUS_RUNNING, STATUS_FAILED),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _get_meta(self, key: str, default=None):
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        return json.loads(row["value"])
+
+    def _set_meta(self, key: str, value) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value)),
+        )
+
+    def sync_from_report(self, df: pd.DataFrame) -> None:
+        """Loads the report lines into the store.
+
+        A fresh report (without the column conversion_done) replaces all
+        jobs. Otherwise the state of a job is kept while its path_file,
+        type_conversion and file_size are still the same in the report,
+        unless the job is done and its converted video no longer exists;
+        jobs whose line left the report are removed.
+
+        Args:
+            df (pd.DataFrame): report
+        """
+
+        fresh_report = "conversion_done" not in df.columns
+        list_column = [
+            x
+            for x in df.columns
+            if x not in ("conversion_done", "path_file_converted")
+        ]
+        list_row = df.to_dict("records")
+        with self._lock:
+            dict_job = {}
+            if not fresh_report:
+                for job in self._conn.execute(
+                    "SELECT path_file, type_conversion, file_size, status, "
+                    "path_file_converted, started_at, finished_at, error "
+                    "FROM job"
+                ):
+                    dict_job[job["path_file"]] = job
+            list_job = []
+            for position, row in enumerate(list_row):
+                path_file = str(row["path_file"])
+                type_conversion = row.get("type_conversion")
+                file_size = row.get("file_size")
+                file_size = None if pd.isna(file_size) else int(file_size)
+                data = json.dumps({k: row[k] for k in list_column})
+
+                job = dict_job.get(path_file)
+                status = get_status_from_row(row)
+                path_file_converted = row.get("path_file_converted")
+                if pd.isna(path_file_converted) or status != STATUS_DONE:
+                    path_file_converted = None
+                timing = (None, None, None)
+                if (
+                    job is not None
+                    and job["type_conversion"] == type_conversion
+                    and job["file_size"] == file_size
+                    and status != STATUS_DONE
+                    and is_converted_kept(job)
+                ):
+                    status = job["status"]
+                    path_file_converted = job["path_file_converted"]
+                    timing = (
+                        job["started_at"],
+                        job["finished_at"],
+                        job["error"],
+                    )
+                list_job.append(
+                    (
+                        position,
+                        path_file,
+                        type_conversion,
+                        file_size,
+                        data,
+                        status,
+                        path_file_converted,
+                    )
+                    + timing
+                )
+            self._conn.execute("DELETE FROM job")
+            self._conn.executemany(
+                "INSERT INTO job (id, path_file, type_conversion, file_size, "
+                "data, status, path_file_converted, started_at, finished_at, "
+                "error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                list_job,
+            )
+            # segments are kept only for jobs still to be converted
+            self._conn.execute(
+                "DELETE FROM segment WHERE path_file NOT IN "
+                "(SELECT path_file FROM job WHERE status = ?)",
+                (STATUS_PENDING,),
+            )
+            self._set_meta("columns", list_column)
+            self._conn.commit()
+
+    def add_jobs(
+        self, list_row: list[dict], cost_model: Union[CostModel, None] = None
+    ) -> None:
+        """Adds report lines to the store while it is in use, after the
+        current jobs.
+
+        The state of a job already in the store is kept while its
+        type_conversion and file_size are still the same.
+
+        Args:
+            list_row (list[dict]): report lines
+            cost_model (CostModel, optional): cost model to estimate the
+                new jobs. Defaults to None.
+        """
+
+        if len(list_row) == 0:
+            return
+        with self._lock:
+            list_column = self._get_meta("columns")
+            if list_column is None:
+                list_column = [
+                    x
+                    for x in list_row[0]
+                    if x not in ("conversion_done", "path_file_converted")
+                ]
+                self._set_meta("columns", list_column)
+            next_id = self._conn.execute(
+                "SELECT COALESCE(MAX(id), -1) + 1 FROM job"
+            ).fetchone()[0]
+            for row in list_row:
+                path_file = str(row["path_file"])
+                type_conversion = row.get("type_conversion")
+                file_size = row.get("file_size")
+                file_size = None if pd.isna(file_size) else int(file_size)
+                data = json.dumps({k: row.get(k) for k in list_column})
+                est_cost = (
+                    None if cost_model is None else cost_model.estimate(row)
+                )
+                job = self._conn.execute(
+                    "SELECT id, type_conversion, file_size FROM job "
+                    "WHERE path_file = ?",
+                    (path_file,),
+                ).fetchone()
+                if job is None:
+                    self._conn.execute(
+                        "INSERT INTO job (id, path_file, type_conversion, "
+                        "file_size, data, status, est_cost) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            next_id,
+                            path_file,
+                            type_conversion,
+                            file_size,
+                            data,
+                            get_status_from_row(row),
+                            est_cost,
+                        ),
+                    )
+                    next_id += 1
+                elif (
+                    job["type_conversion"] == type_conversion
+                    and job["file_size"] == file_size
+                ):
+                    self._conn.execute(
+                        "UPDATE job SET data = ?, est_cost = ? WHERE id = ?",
+                        (data, est_cost, job["id"]),
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE job SET type_conversion = ?, file_size = ?, "
+                        "data = ?, status = ?, path_file_converted = NULL, "
+                        "started_at = NULL, finished_at = NULL, "
+                        "error = NULL, est_cost = ? WHERE id = ?",
+                        (
+                            type_conversion,
+                            file_size,
+                            data,
+                            get_status_from_row(row),
+                            est_cost,
+                            job["id"],
+                        ),
+                    )
+                    self._conn.execute(
+                        "DELETE FROM segment WHERE path_file = ?",
+                        (path_file,),
+                    )
+            self._conn.commit()
+
+    def remove_jobs_except(self, list_path_file: list[str]) -> int:
+        """Removes the jobs whose path_file is not in the list
+
+        Args:
+            list_path_file (list[str]): path_file of the jobs to keep
+
+        Returns:
+            int: number of jobs removed
+        """
+
+        set_path_file = {str(x) for x in list_path_file}
+        with self._lock:
+            list_path_file_removed = [
+                (job["path_file"],)
+                for job in self._conn.execute("SELECT path_file FROM job")
+                if job["path_file"] not in set_path_file
+            ]
+            self._conn.executemany(
+                "DELETE FROM job WHERE path_file = ?", list_path_file_removed
+            )
+            self._conn.executemany(
+                "DELETE FROM segment WHERE path_file = ?",
+                list_path_file_removed,
+            )
+            self._conn.commit()
+        return len(list_path_file_removed)
+
+    def is_discovery_complete(self) -> bool:
+        """Returns False while the jobs are still being added by a
+        streaming pipeline, or if it was interrupted"""
+
+        with self._lock:
+            return self._get_meta("discovery_complete", True)
+
+    def set_discovery_complete(self, complete: bool) -> None:
+        with self._lock:
+            self._set_meta("discovery_complete", complete)
+            self._conn.commit()
+
+    def _job_to_dict(self, job: sqlite3.Row) -> dict:
+        dict_job = json.loads(job["data"])
+        dict_job["job_id"] = job["id"]
+        return dict_job
+
+    def update_estimated_cost(self, cost_model: CostModel) -> None:
+        """Sets the estimated processing seconds of the pending jobs
+
+        Args:
+            cost_model (CostModel): cost model
+        """
+
+        with self._lock:
+            list_job = self._conn.execute(
+                "SELECT id, data FROM job WHERE status = ?",
+                (STATUS_PENDING,),
+            ).fetchall()
+            list_cost = [
+                (cost_model.estimate(json.loads(job["data"])), job["id"])
+                for job in list_job
+            ]
+            self._conn.executemany(
+                "UPDATE job SET est_cost = ? WHERE id = ?", list_cost
+            )
+            self._conn.commit()
+
+    def claim_next(
+        self,
+        list_type_conversion: Union[list[str], None] = None,
+        job_order: str = "fifo",
+    ) -> Union[dict, None]:
+        """Marks the first pending job as running and returns it.
+
+        Args:
+            list_type_conversion (list[str], optional): claim only jobs of
+                these types of conversion. Defaults to None, for any type.
+            job_order (str, optional): ordering policy. One of
+                job_cost.DICT_ORDER_BY. Defaults to 'fifo'.
+
+        Returns:
+            Union[dict, None]: report line of the job, plus the key job_id.
+                None if there are no pending jobs.
+        """
+
+        sql = "SELECT id, data FROM job WHERE status = ? "
+        params = [STATUS_PENDING]
+        if list_type_conversion is not None:
+            sql += "AND type_conversion IN ({}) ".format(
+                ", ".join("?" * len(list_type_conversion))
+            )
+            params += list(list_type_conversion)
+        sql += "ORDER BY " + DICT_ORDER_BY[job_order] + " LIMIT 1"
+        with self._lock:
+            job = self._conn.execute(sql, params).fetchone()
+            if job is None:
+                return None
+            self._conn.execute(
+                "UPDATE job SET status = ?, started_at = ?, error = NULL "
+                "WHERE id = ?",
+                (STATUS_RUNNING, time.time(), job["id"]),
+            )
+            self._conn.commit()
+        return self._job_to_dict(job)
+
+    def mark_done(self, job_id: int, path_file_converted: Path) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job SET status = ?, path_file_converted = ?, "
+                "finished_at = ? WHERE id = ?",
+                (
+                    STATUS_DONE,
+                    str(path_file_converted),
+                    time.time(),
+                    job_id,
+                ),
+            )
+            self._conn.execute(
+                "DELETE FROM segment WHERE path_file = "
+                "(SELECT path_file FROM job WHERE id = ?)",
+                (job_id,),
+            )
+            self._conn.commit()
+
+    def mark_failed(self, job_id: int, error: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job SET status = ?, finished_at = ?, error = ? "
+                "WHERE id = ?",
+                (STATUS_FAILED, time.time(), str(error), job_id),
+            )
+            self._conn.commit()
+
+    def get_segments(self, path_file: str) -> list[dict]:
+        """Returns the segments recorded for the segmented conversion of a
+        job, in order.
+
+        Args:
+            path_file (str): path_file of the job
+
+        Returns:
+            list[dict]: keys: ['idx', 'recipe', 'path_file_chunk',
+                'path_file_encoded', 'encoded_size', 'duration_seconds'].
+                path_file_encoded is None while the segment is not
+                committed.
+        """
+
+        with self._lock:
+            list_segment = self._conn.execute(
+                "SELECT idx, recipe, path_file_chunk, path_file_encoded, "
+                "encoded_size, duration_seconds FROM segment "
+                "WHERE path_file = ? ORDER BY idx",
+                (str(path_file),),
+            ).fetchall()
+        return [dict(x) for x in list_segment]
+
+    def set_segments(
+        self, path_file: str, recipe: str, list_path_file_chunk: list[Path]
+    ) -> None:
+        """Records the chunks of a new segmented conversion of a job,
+        replacing the previous ones.
+
+        Args:
+            path_file (str): path_file of the job
+            recipe (str): identification of the source and of the encode
+                parameters. Segments of other recipes are not reused.
+            list_path_file_chunk (list[Path]): chunks of the source, in
+                order
+        """
+
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM segment WHERE path_file = ?", (str(path_file),)
+            )
+            self._conn.executemany(
+                "INSERT INTO segment (path_file, idx, recipe, "
+                "path_file_chunk) VALUES (?, ?, ?, ?)",
+                [
+                    (str(path_file), index, recipe, str(path_file_chunk))
+                    for index, path_file_chunk in enumerate(
+                        list_path_file_chunk
+                    )
+                ],
+            )
+            self._conn.commit()
+
+    def commit_segment(
+        self,
+        path_file: str,
+        index: int,
+        path_file_encoded: Path,
+        encoded_size: int,
+        duration_seconds: float,
+    ) -> None:
+        """Records an encoded segment of a job as complete"""
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE segment SET path_file_encoded = ?, encoded_size = ?, "
+                "duration_seconds = ? WHERE path_file = ? AND idx = ?",
+                (
+                    str(path_file_encoded),
+                    encoded_size,
+                    duration_seconds,
+                    str(path_file),
+                    index,
+                ),
+            )
+            self._conn.commit()
+
+    def clear_segments(self, path_file: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM segment WHERE path_file = ?", (str(path_file),)
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Removes all jobs, segments and meta of the store."""
+
+        with self._lock:
+            self._conn.execute("DELETE FROM job")
+            self._conn.execute("DELETE FROM segment")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.commit()
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM job WHERE status = ?", (status,)
+            ).fetchone()[0]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the report view of the store: the original report
+        columns plus conversion_done and path_file_converted.
+
+        Returns:
+            pd.DataFrame: report
+        """
+
+        with self._lock:
+            list_column = self._get_meta("columns", [])
+            list_job = self._conn.execute(
+                "SELECT data, status, path_file_converted FROM job "
+                "ORDER BY id"
+            ).fetchall()
+        list_row = []
+        for job in list_job:
+            row = json.loads(job["data"])
+            row["conversion_done"] = int(job["status"] == STATUS_DONE)
+            row["path_file_converted"] = job["path_file_converted"]
+            list_row.append(row)
+        return pd.DataFrame(
+            list_row,
+            columns=list_column + ["conversion_done", "path_file_converted"],
+        )
+
+    def export_report(self, path_file_report: Path) -> pd.DataFrame:
+        """Writes the report view of the store to the CSV report, replacing
+        it atomically.
+
+        Args:
+            path_file_report (Path): report path. csv.
+
+        Returns:
+            pd.DataFrame: report
+        """
+
+        with self._lock:
+            df = self.to_dataframe()
+            path_file_temp = Path(str(path_file_report) + ".tmp")
+            df.to_csv(path_file_temp, index=False)
+            os.replace(path_file_temp, path_file_report)
+        logging.info("Report checkpoint: %s", path_file_report)
+        return df
+
+
+def open_job_store(path_file_report: Path) -> JobStore:
+    """Opens the job store of a report and syncs it with the report CSV.
+
+    Args:
+        path_file_report (Path): report path. csv.
+
+    Returns:
+        JobStore: job store
+    """
+
+    job_store = JobStore(get_path_job_store(path_file_report))
+    df = pd.read_csv(path_file_report, dtype={"path_file_converted": str})
+    job_store.sync_from_report(df)
+    return job_store
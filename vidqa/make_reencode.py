@@ -3,16 +3,29 @@ from __future__ import annotations
 import hashlib
 import logging
 import sys
+import time
 from pathlib import Path
+from typing import Callable, Union
 
 import pandas as pd
 
-from .video_tools import (
-    convert_audio_video,
-    convert_container,
-    convert_only_audio,
-    convert_only_video,
+from . import salvage
+from .conversion_policy import DICT_RECIPE, get_profile
+from .job_cost import get_cost_model
+from .job_store import (
+    STATUS_PENDING,
+    STATUS_RUNNING,
+    JobStore,
+    open_job_store,
 )
+from .scheduler import ConversionScheduler, JobFeed
+from .segment_encode import (
+    SegmentCheckpoint,
+    convert_segmented,
+    is_layout_kept,
+    use_segmented,
+)
+from .video_tools import FFmpegProgress, get_progress_logger, run_ffmpeg
 
 
 def get_next_video_to_reencode(file_path_report: Path) -> dict[str, str]:
@@ -65,16 +78,25 @@ def convert_video_from_dict(
     dict_metadata: dict[str, str],
     path_file_dest: str,
     flags: dict = {"crf": 18, "maxrate": 4},
-) -> None:
-    """convert video
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+    segment_checkpoint: Union[SegmentCheckpoint, None] = None,
+) -> bool:
+    """convert video to the target profile of the flags (see
+    conversion_policy), with the ffmpeg recipe of its type_conversion
 
     Args:
         dict_metadata (dict[str, str]): keys: ["path_file", "video_codec",
                                                "audio_codec", "format_name"]
 
         path_file_dest (str): file_path destination for converted video
-        flags (dict, optional): video conversion flags.
+        flags (dict, optional): video conversion flags. Key
+            'target_profile': target profile name.
             Defaults to {'crf': 18, 'maxrate': 4}.
+        on_progress (Callable[[FFmpegProgress], None], optional): ffmpeg
+            progress callback. Defaults to None.
+        segment_checkpoint (SegmentCheckpoint, optional): records the
+            segments of a segmented conversion, to resume it if interrupted.
+            Defaults to None.
     Return:
         (boolean): False if error.
     """
@@ -86,38 +108,44 @@ def convert_video_from_dict(
 
     path_file_origin = dict_metadata["path_file"]
 
-    dict_func_conversion = {
-        "2_container": {"func": convert_container, "name": "container"},
-        "3_only_audio": {"func": convert_only_audio, "name": "only audio"},
-        "4_only_video": {"func": convert_only_video, "name": "only video"},
-        "5_total_conv": {
-            "func": convert_audio_video,
-            "name": "both audio and video",
-        },
-    }
-
     type_conversion = dict_metadata["type_conversion"]
-    if type_conversion in dict_func_conversion:
-        dict_optimal_conversion = dict_func_conversion[type_conversion]
-        optimal_conversion_name = dict_optimal_conversion["name"]
+    if type_conversion in DICT_RECIPE:
+        profile = get_profile(flags)
+        optimal_conversion_name = DICT_RECIPE[type_conversion][0]
         logging.info(
-            "Start conversion '%s': %s-%s ac-%s-%s",
+            "Start conversion '%s' to %s: %s-%s ac-%s-%s",
             optimal_conversion_name,
+            profile.name,
             audio_codec,
             audio_channels,
             video_codec,
             format_name,
         )
-        optimal_conversion_func = dict_optimal_conversion["func"]
-        optimal_conversion_func(path_file_origin, path_file_dest, flags)
+        if use_segmented(
+            flags, type_conversion, dict_metadata.get("duration_seconds")
+        ) and is_layout_kept(path_file_origin):
+            return_code = convert_segmented(
+                path_file_origin,
+                path_file_dest,
+                type_conversion,
+                flags,
+                on_progress,
+                segment_checkpoint,
+            )
+        else:
+            list_arg = profile.get_recipe_args(
+                type_conversion, path_file_origin, path_file_dest, flags
+            )
+            return_code = run_ffmpeg(list_arg, on_progress)
         print("")
+        return return_code == 0
     else:
         logging.error(
             "type_conversion not recognized: %s",
             path_file_origin,
         )
         logging.info("File: %s", path_file_origin)
-        sys.exit()
+        return False
 
 
 def get_file_name_dest(
@@ -199,6 +227,35 @@ def update_file_report(
     return df
 
 
+def get_path_file_dest(
+    dict_video_data: dict[str, str],
+    path_folder_encoded: Path,
+    extension: str = "mp4",
+) -> Path:
+    """Returns the destination path of the converted video
+
+    Args:
+        dict_video_data (dict[str, str]): keys: ['file_path_folder',
+                                                 'file_name']
+        path_folder_encoded (Path): converted videos folder path
+        extension (str, optional): extension of the converted video,
+            without dot. Defaults to "mp4".
+
+    Returns:
+        Path: converted video path
+    """
+
+    file_folder_origin = Path(dict_video_data["file_path_folder"])
+    file_name_origin = Path(dict_video_data["file_name"])
+
+    file_name_dest = get_file_name_dest(
+        file_folder_origin, file_name_origin, "", extension
+    )
+
+    path_file_dest = path_folder_encoded / file_name_dest
+    return path_file_dest
+
+
 def make_reencode(
     path_file_report: Path,
     path_folder_encoded: Path,
@@ -207,6 +264,23 @@ def make_reencode(
     """Converts all videos of the report.
         Required columns: file_path_folder, file_name, type_conversion
 
+    The state of each conversion is kept in the job store next to the
+    report (see job_store). The report CSV is refreshed from it at
+    checkpoints, every flags['checkpoint_seconds'] (default 60) and at the
+    end.
+
+    Conversions run concurrently (see scheduler). Stream copy jobs use up to
+    flags['io_jobs'] (default 2) slots and libx264 jobs up to
+    flags['cpu_jobs'] (default 1) slots, with flags['threads_per_job']
+    ffmpeg threads each (default 0, ffmpeg decides). Jobs are claimed in
+    the order of the policy flags['job_order'] (default 'fifo'), using the
+    estimates of the cost model (see job_cost), which is calibrated with
+    the time of each finished job.
+
+    Long videos may be converted in parallel segments (see segment_encode).
+    Each encoded segment is committed to the job store, so an interrupted
+    conversion resumes from the last complete segments.
+
     Args:
         path_file_report (Path): report path. csv.
         path_folder_encoded (Path): converted videos folder path
@@ -217,47 +291,128 @@ def make_reencode(
         pd.DataFrame: updated report dataframe
     """
 
-    def get_path_file_dest(dict_video_data, path_folder_encoded):
-        # find path_folder_dest and path_file_dest
-        file_folder_origin = Path(dict_video_data["file_path_folder"])
-        file_name_origin = Path(dict_video_data["file_name"])
-
-        file_name_dest = get_file_name_dest(
-            file_folder_origin, file_name_origin, "", "mp4"
+    job_store = open_job_store(path_file_report)
+    try:
+        return run_jobs(
+            job_store, path_file_report, path_folder_encoded, flags
         )
+    finally:
+        job_store.close()
 
-        path_file_dest = path_folder_encoded / file_name_dest
-        return path_file_dest
 
-    df = pd.read_csv(path_file_report)
-    # Ensure creation of column 'conversion_done'.
-    if "conversion_done" not in df.columns:
-        df["conversion_done"] = 0
-        df["path_file_converted"] = ""
-        # Save reports
-        df.to_csv(path_file_report, index=False)
+def run_jobs(
+    job_store: JobStore,
+    path_file_report: Path,
+    path_folder_encoded: Path,
+    flags: dict = {"crf": 18, "maxrate": 4},
+    job_feed: Union[JobFeed, None] = None,
+) -> pd.DataFrame:
+    """Runs the pending jobs of a job store and keeps the report CSV
+    updated. See make_reencode.
 
-    need_reencode = True
-    while need_reencode:
-        dict_video_data = get_next_video_to_reencode(path_file_report)
+    Args:
+        job_store (JobStore): job store of the report
+        path_file_report (Path): report path. csv.
+        path_folder_encoded (Path): converted videos folder path
+        flags (dict, optional): video conversion flags. Defaults to
+            {'crf': 18, 'maxrate': 4}.
+        job_feed (JobFeed, optional): feed of jobs added to the job store
+            during the run, by a streaming pipeline. Defaults to None.
 
-        if dict_video_data is False:
-            print("")
-            logging.info("There are no videos to convert")
-            need_reencode = False
-            continue
+    Returns:
+        pd.DataFrame: updated report dataframe
+    """
 
+    def run_job(dict_video_data: dict, flags_job: dict) -> dict:
+        start = time.monotonic()
+        profile = get_profile(flags_job)
         path_file_dest = get_path_file_dest(
-            dict_video_data, path_folder_encoded
+            dict_video_data, path_folder_encoded, profile.extension
+        )
+        if flags_job.get("salvage", 0) == 1 and salvage.is_output_valid(
+            dict_video_data, path_file_dest, profile, flags_job
+        ):
+            logging.info("Converted video salvaged: %s", path_file_dest)
+            return {"path_file_dest": path_file_dest, "elapsed_seconds": None}
+        on_progress = get_progress_logger(
+            dict_video_data["file_name"],
+            dict_video_data.get("duration_seconds", 0),
         )
         # run reencode
-        convert_video_from_dict(dict_video_data, path_file_dest, flags)
+        conversion_ok = convert_video_from_dict(
+            dict_video_data,
+            path_file_dest,
+            flags_job,
+            on_progress,
+            SegmentCheckpoint(job_store, dict_video_data["path_file"]),
+        )
+        if not conversion_ok:
+            # do not leave a partial output to be taken as converted
+            if path_file_dest.exists():
+                path_file_dest.unlink()
+            raise RuntimeError(f"ffmpeg failed: {path_file_dest.name}")
+        return {
+            "path_file_dest": path_file_dest,
+            "elapsed_seconds": time.monotonic() - start,
+        }
+
+    def job_done(
+        dict_video_data: dict, result: dict, exception: BaseException
+    ) -> None:
+        nonlocal last_checkpoint
 
         # after reencode, update flag conversion_done
-        df = update_file_report(
-            path_file_report, dict_video_data, path_file_dest
-        )
+        job_id = dict_video_data["job_id"]
+        if exception is not None:
+            logging.error(
+                "Conversion failed: %s\n%s",
+                dict_video_data["path_file"],
+                exception,
+            )
+            job_store.mark_failed(job_id, repr(exception))
+        elif result["path_file_dest"].exists():
+            job_store.mark_done(job_id, result["path_file_dest"].absolute())
+            if result["elapsed_seconds"] is not None:
+                cost_model.observe(dict_video_data, result["elapsed_seconds"])
+        else:
+            logging.error(
+                "After reencode, when update, "
+                + f"reencoded file not exist:\n{result['path_file_dest']}"
+            )
+            job_store.mark_failed(job_id, "reencoded file not exist")
 
+        logging.info(
+            "There are %s videos to convert.",
+            job_store.count(STATUS_PENDING) + job_store.count(STATUS_RUNNING),
+        )
+        if time.monotonic() - last_checkpoint >= checkpoint_seconds:
+            job_store.export_report(path_file_report)
+            last_checkpoint = time.monotonic()
+
+    checkpoint_seconds = float(flags.get("checkpoint_seconds", 60))
+    conversion_scheduler = ConversionScheduler(
+        io_jobs=int(flags.get("io_jobs", 2)),
+        cpu_jobs=int(flags.get("cpu_jobs", 1)),
+        threads_per_job=int(flags.get("threads_per_job", 0)),
+        job_order=flags.get("job_order", "fifo"),
+    )
+    cost_model = get_cost_model()
+    job_store.update_estimated_cost(cost_model)
+    try:
+        # Ensure creation of column 'conversion_done'.
+        job_store.export_report(path_file_report)
+        last_checkpoint = time.monotonic()
+        conversion_scheduler.run(job_store, flags, run_job, job_done, job_feed)
+        qt_not_recognized = job_store.count(STATUS_PENDING)
+        if qt_not_recognized > 0:
+            logging.error(
+                "%s videos with type_conversion not recognized",
+                qt_not_recognized,
+            )
+        print("")
+        logging.info("There are no videos to convert")
+    finally:
         # Save reports
-        df.to_csv(path_file_report, index=False)
+        df = job_store.export_report(path_file_report)
+        cost_model.save()
     return df
@@ -0,0 +1,310 @@
+"""Native parser of Matroska/WebM (EBML) headers.
+
+Maps only the head of the file (HEAD_SIZE) and reads the Segment Info and
+Tracks elements, returning the metadata in the shape of the lean ffprobe
+output (see video_report.PROBE_ENTRIES). Returns None, so the caller falls
+back to ffprobe, if those elements are not in the head, if there is no
+duration or if a codec is not in DICT_CODEC.
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterator, Union
+
+# format_name of the ffprobe matroska demuxer
+FORMAT_NAME = "matroska,webm"
+
+# bytes of the file read, enough for the elements before the first Cluster
+HEAD_SIZE = 512 * 1024
+
+ID_EBML = 0x1A45DFA3
+ID_DOCTYPE = 0x4282
+ID_SEGMENT = 0x18538067
+ID_INFO = 0x1549A966
+ID_TIMECODE_SCALE = 0x2AD7B1
+ID_DURATION = 0x4489
+ID_TRACKS = 0x1654AE6B
+ID_TRACK_ENTRY = 0xAE
+ID_TRACK_TYPE = 0x83
+ID_CODEC_ID = 0x86
+ID_CODEC_PRIVATE = 0x63A2
+ID_VIDEO = 0xE0
+ID_PIXEL_WIDTH = 0xB0
+ID_PIXEL_HEIGHT = 0xBA
+ID_AUDIO = 0xE1
+ID_CHANNELS = 0x9F
+ID_CLUSTER = 0x1F43B675
+
+TRACK_TYPE_VIDEO = 1
+TRACK_TYPE_AUDIO = 2
+
+# Matroska CodecID: ffprobe codec_name
+DICT_CODEC = {
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_MPEG4/ISO/ASP": "mpeg4",
+    "V_MPEG4/ISO/SP": "mpeg4",
+    "V_MPEG4/ISO/AP": "mpeg4",
+    "V_MPEG2": "mpeg2video",
+    "V_VP8": "vp8",
+    "V_VP9": "vp9",
+    "V_AV1": "av1",
+    "A_AAC": "aac",
+    "A_AC3": "ac3",
+    "A_EAC3": "eac3",
+    "A_DTS": "dts",
+    "A_MPEG/L3": "mp3",
+    "A_MPEG/L2": "mp2",
+    "A_OPUS": "opus",
+    "A_VORBIS": "vorbis",
+    "A_FLAC": "flac",
+}
+
+DICT_AVC_PROFILE = {
+    66: "Baseline",
+    77: "Main",
+    88: "Extended",
+    100: "High",
+    110: "High 10",
+    122: "High 4:2:2",
+    244: "High 4:4:4 Predictive",
+}
+
+DICT_AAC_PROFILE = {1: "Main", 2: "LC", 3: "SSR", 4: "LTP", 5: "HE-AAC"}
+
+
+def read_vint(data: mmap.mmap, offset: int, keep_marker: bool) -> tuple:
+    """Reads an EBML variable size integer.
+
+    Args:
+        data (mmap.mmap): file data
+        offset (int): offset of the first byte
+        keep_marker (bool): True for element IDs, which keep the length
+            marker bit. False for sizes.
+
+    Returns:
+        tuple: (value, length in bytes). The value is None for the reserved
+            unknown size.
+
+    Raises:
+        ValueError: if the first byte is zero
+    """
+
+    first = data[offset]
+    if first == 0:
+        raise ValueError(f"invalid EBML integer at {offset}")
+    length = 1
+    mask = 0x80
+    while first & mask == 0:
+        mask >>= 1
+        length += 1
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[offset + 1:offset + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def iter_element(data: mmap.mmap, start: int, end: int) -> Iterator[tuple]:
+    """Iterates the elements between two offsets.
+
+    Yields:
+        tuple: (id, offset of the payload, offset after the element). The
+            end may lie beyond `end` for elements truncated by the head
+            limit, and is `end` for elements of unknown size.
+    """
+
+    offset = start
+    while offset + 2 <= end:
+        id_, length_id = read_vint(data, offset, keep_marker=True)
+        size, length_size = read_vint(data, offset + length_id, False)
+        start_payload = offset + length_id + length_size
+        end_element = end if size is None else start_payload + size
+        yield id_, start_payload, end_element
+        offset = end_element
+
+
+def read_uint(data: mmap.mmap, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], "big")
+
+
+def read_float(data: mmap.mmap, start: int, end: int) -> float:
+    if end - start == 4:
+        return struct.unpack_from(">f", data, start)[0]
+    if end - start == 8:
+        return struct.unpack_from(">d", data, start)[0]
+    raise ValueError("invalid EBML float size")
+
+
+def read_children(data: mmap.mmap, start: int, end: int) -> dict:
+    """Returns the first occurrence of each child element.
+
+    Returns:
+        dict: {id: (offset of the payload, offset after the element)}
+    """
+
+    dict_child = {}
+    for id_, start_child, end_child in iter_element(data, start, end):
+        if end_child > end:
+            raise ValueError(f"truncated element {id_:#x}")
+        dict_child.setdefault(id_, (start_child, end_child))
+    return dict_child
+
+
+def parse_track(data: mmap.mmap, start: int, end: int) -> Union[dict, None]:
+    """Returns the ffprobe-like stream of a TrackEntry. None if the codec
+    is not known. An empty dict for tracks that are neither video nor
+    audio."""
+
+    dict_child = read_children(data, start, end)
+    if ID_TRACK_TYPE not in dict_child or ID_CODEC_ID not in dict_child:
+        return None
+    track_type = read_uint(data, *dict_child[ID_TRACK_TYPE])
+    if track_type not in (TRACK_TYPE_VIDEO, TRACK_TYPE_AUDIO):
+        return {}
+    codec_id = (
+        data[slice(*dict_child[ID_CODEC_ID])]
+        .rstrip(b"\x00")
+        .decode("ascii", errors="replace")
+    )
+    # A_AAC/MPEG4/LC and similar old ids carry the profile in the id
+    codec_name = DICT_CODEC.get(codec_id)
+    if codec_name is None and codec_id.startswith("A_AAC/"):
+        codec_name = "aac"
+    if codec_name is None:
+        return None
+    codec_private = None
+    if ID_CODEC_PRIVATE in dict_child:
+        codec_private = data[slice(*dict_child[ID_CODEC_PRIVATE])]
+
+    if track_type == TRACK_TYPE_VIDEO:
+        if ID_VIDEO not in dict_child:
+            return None
+        dict_video = read_children(data, *dict_child[ID_VIDEO])
+        if (
+            ID_PIXEL_WIDTH not in dict_video
+            or ID_PIXEL_HEIGHT not in dict_video
+        ):
+            return None
+        stream = {
+            "codec_name": codec_name,
+            "codec_type": "video",
+            "width": read_uint(data, *dict_video[ID_PIXEL_WIDTH]),
+            "height": read_uint(data, *dict_video[ID_PIXEL_HEIGHT]),
+        }
+        if codec_name == "h264" and codec_private and codec_private[0] == 1:
+            stream["is_avc"] = "true"
+            profile = DICT_AVC_PROFILE.get(codec_private[1])
+            if codec_private[1] == 66 and codec_private[2] & 0x40:
+                profile = "Constrained Baseline"
+            if profile is not None:
+                stream["profile"] = profile
+        return stream
+
+    channels = 1
+    if ID_AUDIO in dict_child:
+        dict_audio = read_children(data, *dict_child[ID_AUDIO])
+        if ID_CHANNELS in dict_audio:
+            channels = read_uint(data, *dict_audio[ID_CHANNELS])
+    stream = {
+        "codec_name": codec_name,
+        "codec_type": "audio",
+        "channels": channels,
+    }
+    if codec_name == "aac" and codec_private:
+        profile = DICT_AAC_PROFILE.get(codec_private[0] >> 3)
+        if profile is not None:
+            stream["profile"] = profile
+    return stream
+
+
+def parse(path_file: Path) -> Union[dict, None]:
+    """Parses the headers of a Matroska/WebM file.
+
+    Args:
+        path_file (Path): video file path
+
+    Returns:
+        Union[dict, None]: metadata with the keys of the lean ffprobe
+            output: {'streams': [...], 'format': {...}}. None if the file
+            is not EBML or the parser can't decide.
+
+    Raises:
+        OSError: if the file can't be read
+        ValueError: if the element structure is broken
+    """
+
+    path_file = Path(path_file)
+    with open(path_file, "rb") as f:
+        file_size = path_file.stat().st_size
+        if file_size < 8:
+            return None
+        head_size = min(file_size, HEAD_SIZE)
+        with mmap.mmap(f.fileno(), head_size, access=mmap.ACCESS_READ) as data:
+            if read_vint(data, 0, keep_marker=True)[0] != ID_EBML:
+                return None
+            iterator = iter_element(data, 0, head_size)
+            _, start, end = next(iterator)
+            dict_ebml = read_children(data, start, end)
+            if ID_DOCTYPE in dict_ebml:
+                doctype = data[slice(*dict_ebml[ID_DOCTYPE])].rstrip(b"\x00")
+                if doctype not in (b"matroska", b"webm"):
+                    return None
+            id_, start, end = next(iterator, (None, 0, 0))
+            if id_ != ID_SEGMENT:
+                return None
+
+            info = None
+            tracks = None
+            for id_, start_child, end_child in iter_element(
+                data, start, min(end, head_size)
+            ):
+                if id_ == ID_CLUSTER or end_child > head_size:
+                    break
+                if id_ == ID_INFO:
+                    info = (start_child, end_child)
+                elif id_ == ID_TRACKS:
+                    tracks = (start_child, end_child)
+                if info is not None and tracks is not None:
+                    break
+            if info is None or tracks is None:
+                return None
+
+            dict_info = read_children(data, *info)
+            if ID_DURATION not in dict_info:
+                return None
+            timecode_scale = 1000000
+            if ID_TIMECODE_SCALE in dict_info:
+                timecode_scale = read_uint(data, *dict_info[ID_TIMECODE_SCALE])
+            duration_seconds = (
+                read_float(data, *dict_info[ID_DURATION])
+                * timecode_scale
+                / 1e9
+            )
+            if not duration_seconds > 0:
+                return None
+
+            list_stream = []
+            for id_, start_child, end_child in iter_element(data, *tracks):
+                if id_ != ID_TRACK_ENTRY:
+                    continue
+                stream = parse_track(data, start_child, end_child)
+                if stream is None:
+                    return None
+                if len(stream) > 0:
+                    list_stream.append(stream)
+
+    return {
+        "streams": list_stream,
+        "format": {
+            "filename": str(path_file),
+            "format_name": FORMAT_NAME,
+            "duration": f"{duration_seconds:.6f}",
+            "size": str(file_size),
+            "bit_rate": str(int(file_size * 8 / duration_seconds)),
+        },
+    }
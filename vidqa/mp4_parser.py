@@ -0,0 +1,323 @@
+"""Native parser of MP4/MOV (ISO-BMFF) headers.
+
+Reads the ftyp and moov boxes through mmap, without spawning ffprobe, and
+returns the metadata in the shape of the lean ffprobe output (see
+video_report.PROBE_ENTRIES). Only the sample descriptions needed by the
+report are decoded: avc1/avc3 (avcC) video and mp4a (esds) audio. Any other
+layout makes the parser give up, returning None, so the caller falls back
+to ffprobe.
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterator, Union
+
+# format_name of the ffprobe mov demuxer
+FORMAT_NAME = "mov,mp4,m4a,3gp,3g2,mj2"
+
+DICT_AVC_PROFILE = {
+    66: "Baseline",
+    77: "Main",
+    88: "Extended",
+    100: "High",
+    110: "High 10",
+    122: "High 4:2:2",
+    244: "High 4:4:4 Predictive",
+}
+
+# esds objectTypeIndication
+DICT_AUDIO_OBJECT_TYPE = {
+    0x40: "aac",
+    0x66: "aac",
+    0x67: "aac",
+    0x68: "aac",
+    0x69: "mp3",
+    0x6B: "mp3",
+}
+
+DICT_AAC_PROFILE = {1: "Main", 2: "LC", 3: "SSR", 4: "LTP", 5: "HE-AAC"}
+
+# box types whose payload is a list of boxes
+SET_CONTAINER = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+class Box:
+    """Position of a box in the file.
+
+    Attributes:
+        type (bytes): four character code
+        start (int): offset of the payload
+        end (int): offset after the box
+    """
+
+    __slots__ = ("type", "start", "end")
+
+    def __init__(self, type_: bytes, start: int, end: int):
+        self.type = type_
+        self.start = start
+        self.end = end
+
+
+def iter_box(data: mmap.mmap, start: int, end: int) -> Iterator[Box]:
+    """Iterates the boxes between two offsets, without reading their
+    payload.
+
+    Raises:
+        ValueError: if a box size is invalid
+    """
+
+    offset = start
+    while offset + 8 <= end:
+        size, type_ = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise ValueError("truncated box header")
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError(f"invalid size of box {type_!r}")
+        yield Box(type_, offset + header, offset + size)
+        offset += size
+
+
+def find_box(
+    data: mmap.mmap, box: Box, type_: bytes, skip: int = 0
+) -> Union[Box, None]:
+    """Returns the first child box of a type, or None"""
+
+    for child in iter_box(data, box.start + skip, box.end):
+        if child.type == type_:
+            return child
+    return None
+
+
+def read_descriptor_header(data: mmap.mmap, offset: int) -> tuple:
+    """Reads the tag and the expandable size of an MPEG-4 descriptor.
+
+    Returns:
+        tuple: (tag, size, offset of the payload)
+    """
+
+    tag = data[offset]
+    offset += 1
+    size = 0
+    for _ in range(4):
+        byte = data[offset]
+        offset += 1
+        size = (size << 7) | (byte & 0x7F)
+        if byte & 0x80 == 0:
+            break
+    return tag, size, offset
+
+
+def parse_esds(data: mmap.mmap, box: Box) -> dict:
+    """Returns codec_name, profile and channels of an esds box. Missing
+    keys could not be decoded."""
+
+    d = {}
+    tag, _, offset = read_descriptor_header(data, box.start + 4)
+    if tag != 0x03:
+        return d
+    flags = data[offset + 2]
+    offset += 3
+    if flags & 0x80:
+        offset += 2
+    if flags & 0x40:
+        offset += 1 + data[offset]
+    if flags & 0x20:
+        offset += 2
+    tag, _, offset = read_descriptor_header(data, offset)
+    if tag != 0x04:
+        return d
+    object_type = data[offset]
+    if object_type not in DICT_AUDIO_OBJECT_TYPE:
+        return d
+    d["codec_name"] = DICT_AUDIO_OBJECT_TYPE[object_type]
+    offset += 13
+    if offset >= box.end or d["codec_name"] != "aac":
+        return d
+    tag, size, offset = read_descriptor_header(data, offset)
+    if tag != 0x05 or size < 2:
+        return d
+    # AudioSpecificConfig
+    bits = int.from_bytes(data[offset:offset + min(size, 5)], "big")
+    qt_bit = min(size, 5) * 8
+    audio_object_type = bits >> (qt_bit - 5)
+    frequency_index = (bits >> (qt_bit - 9)) & 0x0F
+    shift = qt_bit - 13 if frequency_index != 0x0F else qt_bit - 37
+    if shift >= 0:
+        channel_config = (bits >> shift) & 0x0F
+        if 0 < channel_config < 7:
+            d["channels"] = channel_config
+        elif channel_config == 7:
+            d["channels"] = 8
+    if audio_object_type in DICT_AAC_PROFILE:
+        d["profile"] = DICT_AAC_PROFILE[audio_object_type]
+    return d
+
+
+def get_sample_bytes(data: mmap.mmap, stbl: Box) -> Union[int, None]:
+    """Returns the total bytes of the samples of a track, from stsz"""
+
+    stsz = find_box(data, stbl, b"stsz")
+    if stsz is None:
+        return None
+    sample_size, sample_count = struct.unpack_from(">II", data, stsz.start + 4)
+    if sample_size != 0:
+        return sample_size * sample_count
+    if stsz.start + 12 + 4 * sample_count > stsz.end:
+        raise ValueError("truncated stsz")
+    return sum(struct.unpack_from(f">{sample_count}I", data, stsz.start + 12))
+
+
+def parse_track(data: mmap.mmap, trak: Box) -> Union[dict, None]:
+    """Returns the ffprobe-like stream of a track. None if the track can't
+    be decoded. An empty dict for tracks that are neither video nor audio.
+    """
+
+    mdia = find_box(data, trak, b"mdia")
+    if mdia is None:
+        return None
+    hdlr = find_box(data, mdia, b"hdlr")
+    mdhd = find_box(data, mdia, b"mdhd")
+    minf = find_box(data, mdia, b"minf")
+    if hdlr is None or mdhd is None or minf is None:
+        return None
+    handler = data[hdlr.start + 8:hdlr.start + 12]
+    if handler not in (b"vide", b"soun"):
+        return {}
+
+    if data[mdhd.start] == 1:
+        timescale, duration = struct.unpack_from(">IQ", data, mdhd.start + 20)
+    else:
+        timescale, duration = struct.unpack_from(">II", data, mdhd.start + 12)
+    stbl = find_box(data, minf, b"stbl")
+    if stbl is None:
+        return None
+    stsd = find_box(data, stbl, b"stsd")
+    if stsd is None or struct.unpack_from(">I", data, stsd.start + 4)[0] < 1:
+        return None
+    entry = next(iter_box(data, stsd.start + 8, stsd.end), None)
+    if entry is None:
+        return None
+
+    stream = {}
+    if handler == b"vide":
+        if entry.type not in (b"avc1", b"avc3"):
+            return None
+        width, height = struct.unpack_from(">HH", data, entry.start + 24)
+        avcc = find_box(data, entry, b"avcC", skip=78)
+        if avcc is None:
+            return None
+        profile_idc = data[avcc.start + 1]
+        profile = DICT_AVC_PROFILE.get(profile_idc)
+        if profile is None:
+            return None
+        if profile_idc == 66 and data[avcc.start + 2] & 0x40:
+            profile = "Constrained Baseline"
+        stream = {
+            "codec_name": "h264",
+            "profile": profile,
+            "codec_type": "video",
+            "width": width,
+            "height": height,
+            "is_avc": "true",
+        }
+    else:
+        if entry.type != b"mp4a":
+            return None
+        version = struct.unpack_from(">H", data, entry.start + 8)[0]
+        channels = struct.unpack_from(">H", data, entry.start + 16)[0]
+        skip = {0: 28, 1: 44, 2: 64}.get(version)
+        if skip is None:
+            return None
+        esds = find_box(data, entry, b"esds", skip=skip)
+        if esds is None:
+            return None
+        dict_esds = parse_esds(data, esds)
+        if "codec_name" not in dict_esds:
+            return None
+        stream = {
+            "codec_name": dict_esds["codec_name"],
+            "codec_type": "audio",
+            "channels": dict_esds.get("channels", channels),
+        }
+        if "profile" in dict_esds:
+            stream["profile"] = dict_esds["profile"]
+
+    sample_bytes = get_sample_bytes(data, stbl)
+    if timescale > 0 and duration > 0 and sample_bytes is not None:
+        stream["bit_rate"] = str(int(sample_bytes * 8 * timescale / duration))
+    return stream
+
+
+def parse(path_file: Path) -> Union[dict, None]:
+    """Parses the headers of an MP4/MOV file.
+
+    Args:
+        path_file (Path): video file path
+
+    Returns:
+        Union[dict, None]: metadata with the keys of the lean ffprobe
+            output: {'streams': [...], 'format': {...}}. None if the file
+            is not ISO-BMFF or has any box the parser can't decide.
+
+    Raises:
+        OSError: if the file can't be read
+        ValueError: if the box structure is broken
+    """
+
+    path_file = Path(path_file)
+    with open(path_file, "rb") as f:
+        file_size = path_file.stat().st_size
+        if file_size < 8:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            dict_box = {}
+            for box in iter_box(data, 0, file_size):
+                if box.type in (b"ftyp", b"moov") and box.type not in dict_box:
+                    dict_box[box.type] = box
+            if b"ftyp" not in dict_box or b"moov" not in dict_box:
+                return None
+            moov = dict_box[b"moov"]
+            mvhd = find_box(data, moov, b"mvhd")
+            if mvhd is None:
+                return None
+            if data[mvhd.start] == 1:
+                timescale, duration = struct.unpack_from(
+                    ">IQ", data, mvhd.start + 20
+                )
+            else:
+                timescale, duration = struct.unpack_from(
+                    ">II", data, mvhd.start + 12
+                )
+            if timescale == 0 or duration == 0:
+                # fragmented or broken: leave it to ffprobe
+                return None
+            list_stream = []
+            for trak in iter_box(data, moov.start, moov.end):
+                if trak.type != b"trak":
+                    continue
+                stream = parse_track(data, trak)
+                if stream is None:
+                    return None
+                if len(stream) > 0:
+                    list_stream.append(stream)
+
+    duration_seconds = duration / timescale
+    return {
+        "streams": list_stream,
+        "format": {
+            "filename": str(path_file),
+            "format_name": FORMAT_NAME,
+            "duration": f"{duration_seconds:.6f}",
+            "size": str(file_size),
+            "bit_rate": str(int(file_size * 8 / duration_seconds)),
+        },
+    }
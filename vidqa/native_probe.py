@@ -0,0 +1,46 @@
+"""Probe of video headers without spawning ffprobe.
+
+Dispatches by file extension to a native container parser. Each parser
+returns the metadata in the shape of the lean ffprobe output, or None when
+it can't decide, and then the caller runs ffprobe.
+"""
+
+from __future__ import annotations
+
+import logging
+import struct
+from pathlib import Path
+from typing import Callable, Union
+
+from . import avi_parser, mkv_parser, mp4_parser
+
+DICT_PARSER: dict[str, Callable[[Path], Union[dict, None]]] = {
+    ".mp4": mp4_parser.parse,
+    ".m4v": mp4_parser.parse,
+    ".mov": mp4_parser.parse,
+    ".mkv": mkv_parser.parse,
+    ".webm": mkv_parser.parse,
+    ".avi": avi_parser.parse,
+}
+
+
+def probe_native(path_file: Path) -> Union[dict, None]:
+    """Reads the metadata of a video file with a native parser.
+
+    Args:
+        path_file (Path): video file path
+
+    Returns:
+        Union[dict, None]: metadata in the shape of the lean ffprobe output.
+            None if there is no parser for the extension or if the parser
+            could not decide.
+    """
+
+    parser = DICT_PARSER.get(Path(path_file).suffix.lower())
+    if parser is None:
+        return None
+    try:
+        return parser(path_file)
+    except (OSError, ValueError, IndexError, struct.error) as e:
+        logging.info("native probe failed: %s\n%s", path_file, e)
+        return None
@@ -0,0 +1,304 @@
+"""Streaming pipeline mode: probe, classify and convert at the same time.
+
+Stages connected by bounded queues:
+- discovery: feeds the video paths found in the tree snapshot
+- probe: flags['probe_workers'] threads running ffprobe, through the
+  probe cache
+- classify: formats the metadata of each probed file, sets its
+  type_conversion and adds it to the job store as a pending job
+- convert: the conversion scheduler, which claims jobs as soon as they are
+  added
+
+The report CSV is refreshed from the job store at checkpoints while the
+stages run. If the pipeline is interrupted, the job store is left marked
+with discovery incomplete and the next run streams the tree again, keeping
+the state of the jobs already converted.
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+from . import make_reencode, probe_cache, video_report
+from .conversion_policy import TargetProfile, get_profile
+from .job_cost import get_cost_model
+from .job_store import JobStore, get_path_job_store
+from .scheduler import JobFeed
+from .utils import TreeSnapshot
+
+# maximum items waiting between two stages
+QUEUE_SIZE = 64
+# maximum probed files classified and added to the job store at once
+BATCH_SIZE = 32
+
+_END = None
+
+
+def is_discovery_complete(path_file_report: Path) -> bool:
+    """Checks if the report of a pipeline run has all the files of the
+    project.
+
+    Args:
+        path_file_report (Path): report path. csv.
+
+    Returns:
+        bool: False if the report does not exist or its pipeline run was
+            interrupted before the last file was added.
+    """
+
+    if not Path(path_file_report).exists():
+        return False
+    path_file_db = get_path_job_store(path_file_report)
+    if not path_file_db.exists():
+        return True
+    job_store = JobStore(path_file_db)
+    try:
+        return job_store.is_discovery_complete()
+    finally:
+        job_store.close()
+
+
+def classify_batch(
+    list_record: list[video_report.ProbeRecord],
+    profile: Union[TargetProfile, None] = None,
+) -> list[dict]:
+    """Formats probed files as report lines with type_conversion.
+
+    Args:
+        list_record (list[video_report.ProbeRecord]): probe records
+        profile (TargetProfile, optional): target of the conversion.
+            Defaults to the default profile.
+
+    Returns:
+        list[dict]: report lines
+    """
+
+    if len(list_record) == 0:
+        return []
+    df = video_report.include_type_conversion(
+        video_report.get_report_dataframe(list_record), profile
+    )
+    return df.to_dict("records")
+
+
+def run_pipeline(
+    path_file_report: Path,
+    list_path_video: list[Path],
+    path_folder_encoded: Path,
+    flags: dict,
+    snapshot: Union[TreeSnapshot, None] = None,
+) -> list[Path]:
+    """Probes, classifies and converts the videos of a project as a
+    streaming pipeline. Conversions start as soon as the first files are
+    classified.
+
+    Args:
+        path_file_report (Path): report path. csv.
+        list_path_video (list[Path]): videos of the project
+        path_folder_encoded (Path): converted videos folder path
+        flags (dict): video conversion flags. Also uses 'probe_workers',
+            'cache_probe', 'cache_path', 'cache_max_entries' and the probe
+            flags, see video_report.
+        snapshot (TreeSnapshot, optional): tree snapshot with the stat of
+            the videos, for the probe cache. Defaults to None.
+
+    Returns:
+        list[Path]: likely corrupted videos
+    """
+
+    probe_workers = max(1, int(flags.get("probe_workers", 1)))
+    probe_mode = video_report.get_probe_mode(flags)
+    fast_probe = video_report.get_fast_probe(flags)
+    native = video_report.get_native(flags)
+    policy = video_report.get_probe_policy(flags)
+    profile = get_profile(flags)
+    checkpoint_seconds = float(flags.get("checkpoint_seconds", 60))
+    if flags.get("cache_probe", 0) == 1:
+        cache = probe_cache.get_probe_cache(
+            flags.get("cache_path", ""),
+            max_entries=flags.get("cache_max_entries", 200000),
+        )
+    else:
+        cache = None
+
+    queue_path = queue.Queue(maxsize=QUEUE_SIZE)
+    queue_probe = queue.Queue(maxsize=QUEUE_SIZE)
+    job_feed = JobFeed()
+    cost_model = get_cost_model()
+    job_store = JobStore(get_path_job_store(path_file_report))
+    if not Path(path_file_report).exists():
+        # a store left without its report is not resumed
+        job_store.clear()
+    job_store.set_discovery_complete(False)
+    list_path_corrupt = []
+    list_path_fallback = []
+    list_path_timeout = []
+    # the metadata dump is written while the files are probed
+    metadata_writer = video_report.MetadataWriter(
+        video_report.get_path_metadata_dump(
+            path_file_report, flags.get("metadata_gzip", 0) == 1
+        )
+    )
+    stop = threading.Event()
+
+    def put(queue_: queue.Queue, item) -> bool:
+        # gives up when the pipeline is stopped, so no stage blocks forever
+        while not stop.is_set():
+            try:
+                queue_.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(queue_: queue.Queue):
+        # returns _END when the pipeline is stopped
+        while not stop.is_set():
+            try:
+                return queue_.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _END
+
+    def discover() -> None:
+        try:
+            for path_file in list_path_video:
+                if not put(queue_path, path_file):
+                    return
+        finally:
+            for _ in range(probe_workers):
+                put(queue_path, _END)
+
+    def probe() -> None:
+        try:
+            while True:
+                path_file = get(queue_path)
+                if path_file is _END:
+                    return
+                stat_result = None
+                if snapshot is not None:
+                    stat_result = snapshot.get_stat(path_file)
+                try:
+                    result = video_report.probe_file_cached(
+                        path_file,
+                        cache,
+                        stat_result,
+                        probe_mode,
+                        fast_probe,
+                        native,
+                        policy,
+                    )
+                    # pass on only the record, not the raw metadata
+                    result["record"] = None
+                    if result["metadata"] is not None:
+                        metadata_writer.write(
+                            result["path_file"], result["metadata"]
+                        )
+                        result[
+                            "record"
+                        ] = video_report.ProbeRecord.from_metadata(
+                            result["path_file"],
+                            result["metadata"],
+                            stat_result,
+                        )
+                        result["metadata"] = None
+                except Exception as e:
+                    logging.error("ffprobe failed: %s\n%s", path_file, e)
+                    result = {
+                        "path_file": str(path_file),
+                        "metadata": None,
+                        "corrupt": True,
+                        "fallback": False,
+                        "timeout": False,
+                        "record": None,
+                    }
+                if not put(queue_probe, result):
+                    return
+        finally:
+            put(queue_probe, _END)
+
+    def classify() -> None:
+        qt_probe_done = 0
+        list_path_file = []
+        last_checkpoint = time.monotonic()
+        try:
+            while qt_probe_done < probe_workers and not stop.is_set():
+                list_result = [get(queue_probe)]
+                while len(list_result) < BATCH_SIZE:
+                    try:
+                        list_result.append(queue_probe.get_nowait())
+                    except queue.Empty:
+                        break
+                list_record = []
+                for result in list_result:
+                    if result is _END:
+                        qt_probe_done += 1
+                        continue
+                    if result["corrupt"]:
+                        list_path_corrupt.append(Path(result["path_file"]))
+                    if result["fallback"]:
+                        list_path_fallback.append(Path(result["path_file"]))
+                    if result["timeout"]:
+                        list_path_timeout.append(Path(result["path_file"]))
+                    if result["record"] is not None:
+                        list_record.append(result["record"])
+                list_row = classify_batch(list_record, profile)
+                job_store.add_jobs(list_row, cost_model)
+                list_path_file += [x["path_file"] for x in list_row]
+                if len(list_row) > 0:
+                    job_feed.notify()
+                if time.monotonic() - last_checkpoint >= checkpoint_seconds:
+                    job_store.export_report(path_file_report)
+                    last_checkpoint = time.monotonic()
+            if not stop.is_set():
+                # drop jobs of files that left the project since a previous
+                # interrupted run
+                job_store.remove_jobs_except(list_path_file)
+                job_store.set_discovery_complete(True)
+                logging.info(
+                    "Pipeline: all %s videos probed", len(list_path_video)
+                )
+        except Exception as e:
+            logging.error("Pipeline classify stage failed: %s", e)
+            stop.set()
+        finally:
+            job_feed.close()
+
+    list_thread = [threading.Thread(target=discover, daemon=True)]
+    list_thread += [
+        threading.Thread(target=probe, daemon=True)
+        for _ in range(probe_workers)
+    ]
+    list_thread.append(threading.Thread(target=classify, daemon=True))
+    logging.info(
+        "Pipeline: %s videos, %s probe workers",
+        len(list_path_video),
+        probe_workers,
+    )
+    for thread in list_thread:
+        thread.start()
+    try:
+        make_reencode.run_jobs(
+            job_store, path_file_report, path_folder_encoded, flags, job_feed
+        )
+    finally:
+        stop.set()
+        # a probe in progress still writes to the cache and the metadata
+        # dump
+        for thread in list_thread:
+            thread.join()
+        job_store.export_report(path_file_report)
+        job_store.close()
+        metadata_writer.close()
+        if cache is not None:
+            cache.evict()
+            cache.close()
+
+    video_report.save_fallback_report(list_path_fallback, path_file_report)
+    video_report.save_timeout_report(list_path_timeout, path_file_report)
+    return list_path_corrupt
@@ -0,0 +1,433 @@
+"""Persistent cache of ffprobe metadata keyed by file fingerprint."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+# full: -show_programs -show_format -show_streams
+# lean: only the entries read by the report. A full entry also serves a
+# lean lookup.
+# native: lean entries read by a native header parser, see native_probe
+# {mode}_fast: probed with the fast probe limits
+# native and fast entries only approximate the ffprobe defaults, so they
+# only serve lookups that allow them, see get_accepted_modes.
+PROBE_MODE_FULL = "full"
+PROBE_MODE_LEAN = "lean"
+PROBE_MODE_NATIVE = "native"
+FAST_SUFFIX = "_fast"
+# entries stored by add and last access updates of lookups written to the
+# database at once
+BATCH_SIZE = 256
+
+
+def get_cache_dir() -> Path:
+    """Returns the user-level cache folder of vidqa.
+
+    The environment variable VIDQA_CACHE_DIR has priority. Otherwise
+    %LOCALAPPDATA%/vidqa on Windows and $XDG_CACHE_HOME/vidqa
+    (~/.cache/vidqa) elsewhere.
+
+    Returns:
+        Path: cache folder path. Not created.
+    """
+
+    cache_dir = os.environ.get("VIDQA_CACHE_DIR", "")
+    if cache_dir:
+        return Path(cache_dir)
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", str(Path.home()))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", str(Path.home() / ".cache"))
+    return Path(base) / "vidqa"
+
+
+def get_fingerprint(
+    path_file: Path, stat_result: Union[os.stat_result, None] = None
+) -> tuple:
+    """Returns the fingerprint of a file: (absolute path, size, mtime_ns,
+    inode).
+
+    On Windows, os.DirEntry.stat reports inode 0 while os.stat reports the
+    file index, so an inode 0 on either side is not compared, see
+    is_same_fingerprint.
+
+    Args:
+        path_file (Path): file path
+        stat_result (os.stat_result, optional): stat already taken from the
+            file, to avoid a new filesystem call. Defaults to None.
+
+    Returns:
+        tuple: (str, int, int, int)
+    """
+
+    if stat_result is None:
+        stat_result = os.stat(path_file)
+    return (
+        str(Path(path_file).absolute()),
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+        stat_result.st_ino,
+    )
+
+
+def is_same_fingerprint(fingerprint: tuple, fingerprint_cached: tuple) -> bool:
+    """Checks if a file still has the fingerprint it had when cached.
+
+    Args:
+        fingerprint (tuple): current fingerprint, see get_fingerprint
+        fingerprint_cached (tuple): fingerprint stored in the cache
+
+    Returns:
+        bool: True if path, size and mtime_ns are equal and the inodes are
+            equal or one of them is unknown (0)
+    """
+
+    *key, inode = fingerprint
+    *key_cached, inode_cached = fingerprint_cached
+    if key != key_cached:
+        return False
+    return inode == inode_cached or inode == 0 or inode_cached == 0
+
+
+def get_accepted_modes(
+    probe_mode: str, native: bool = False, fast: bool = False
+) -> list[str]:
+    """Returns the cached probe modes that serve a lookup.
+
+    Args:
+        probe_mode (str): 'full' or 'lean'
+        native (bool, optional): the lookup allows the native parsers.
+            Only in the lean mode. Defaults to False.
+        fast (bool, optional): the lookup allows the fast probe.
+            Defaults to False.
+
+    Returns:
+        list[str]: probe modes
+    """
+
+    list_mode = [PROBE_MODE_FULL]
+    if probe_mode != PROBE_MODE_FULL:
+        list_mode.append(probe_mode)
+    if fast:
+        list_mode += [x + FAST_SUFFIX for x in list_mode]
+    if native and probe_mode == PROBE_MODE_LEAN:
+        list_mode.append(PROBE_MODE_NATIVE)
+    return list_mode
+
+
+def get_row(fingerprint: tuple, metadata: dict, probe_mode: str) -> tuple:
+    """Returns the row of the probe table of a file, accessed now"""
+
+    path, size, mtime_ns, inode = fingerprint
+    return (
+        path,
+        size,
+        mtime_ns,
+        inode,
+        json.dumps(metadata),
+        time.time(),
+        probe_mode,
+    )
+
+
+class ProbeCache:
+    """SQLite store of parsed ffprobe output.
+
+    A single row is kept per absolute path. A lookup only hits when size,
+    mtime_ns and inode are still the same as when the file was probed, and
+    the cached probe mode has the entries of the requested one. An unknown
+    inode (0) matches any inode, see get_fingerprint.
+
+    Entries stored with add and the last access of lookups are buffered and
+    written BATCH_SIZE at a time, or by flush. evict, remove_stale, info
+    and close flush first.
+    """
+
+    def __init__(self, path_file_db: Path, max_entries: int = 200000):
+        self.path_file_db = Path(path_file_db)
+        self.max_entries = int(max_entries)
+        self.path_file_db.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._list_row_pending: list[tuple] = []
+        self._list_access_pending: list[tuple[float, str]] = []
+        self._conn = sqlite3.connect(
+            str(self.path_file_db), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probe ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "metadata TEXT NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "probe_mode TEXT NOT NULL DEFAULT 'full')"
+        )
+        list_column = [
+            x[1] for x in self._conn.execute("PRAGMA table_info(probe)")
+        ]
+        if "probe_mode" not in list_column:
+            self._conn.execute(
+                "ALTER TABLE probe ADD COLUMN "
+                "probe_mode TEXT NOT NULL DEFAULT 'full'"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_probe_last_access "
+            "ON probe (last_access)"
+        )
+        self._conn.commit()
+
+    def get(
+        self,
+        fingerprint: tuple,
+        probe_mode: str = PROBE_MODE_FULL,
+        native: bool = False,
+        fast: bool = False,
+    ) -> Union[dict, None]:
+        """Returns the cached metadata of a file, or None if missing or if
+        the file changed since it was probed.
+
+        Args:
+            fingerprint (tuple): see get_fingerprint
+            probe_mode (str, optional): 'full' or 'lean'.
+                Defaults to 'full'.
+            native (bool, optional): accept metadata of the native
+                parsers. Defaults to False.
+            fast (bool, optional): accept metadata of the fast probe.
+                Defaults to False.
+
+        Returns:
+            Union[dict, None]: ffprobe metadata
+        """
+
+        path, size, mtime_ns, inode = fingerprint
+        list_mode = get_accepted_modes(probe_mode, native, fast)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT metadata FROM probe "
+                "WHERE path = ? AND size = ? AND mtime_ns = ? "
+                "AND (inode = ? OR inode = 0 OR ? = 0) "
+                "AND probe_mode IN (" + ", ".join("?" * len(list_mode)) + ")",
+                (path, size, mtime_ns, inode, inode, *list_mode),
+            ).fetchone()
+            if row is None:
+                return None
+            self._list_access_pending.append((time.time(), path))
+            if len(self._list_access_pending) >= BATCH_SIZE:
+                self._flush()
+        return json.loads(row[0])
+
+    def put_many(
+        self,
+        list_item: list[tuple[tuple, dict]],
+        probe_mode: str = PROBE_MODE_FULL,
+    ) -> None:
+        """Stores metadata for many files in a single transaction.
+
+        Args:
+            list_item (list[tuple[tuple, dict]]): list of
+                (fingerprint, metadata)
+            probe_mode (str, optional): probe mode of the metadata, see
+                PROBE_MODE_FULL. Defaults to 'full'.
+        """
+
+        list_row = [
+            get_row(fingerprint, metadata, probe_mode)
+            for fingerprint, metadata in list_item
+        ]
+        with self._lock:
+            self._list_row_pending += list_row
+            self._flush()
+
+    def add(
+        self,
+        fingerprint: tuple,
+        metadata: dict,
+        probe_mode: str = PROBE_MODE_FULL,
+    ) -> None:
+        """Stores the metadata of a file with the next batch of entries.
+
+        Args:
+            fingerprint (tuple): see get_fingerprint
+            metadata (dict): ffprobe metadata
+            probe_mode (str, optional): probe mode of the metadata, see
+                PROBE_MODE_FULL. Defaults to 'full'.
+        """
+
+        row = get_row(fingerprint, metadata, probe_mode)
+        with self._lock:
+            self._list_row_pending.append(row)
+            if len(self._list_row_pending) >= BATCH_SIZE:
+                self._flush()
+
+    def flush(self) -> None:
+        """Writes the buffered entries and last access updates"""
+
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        # callers hold the lock
+        if (
+            len(self._list_row_pending) == 0
+            and len(self._list_access_pending) == 0
+        ):
+            return
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO probe "
+            "(path, size, mtime_ns, inode, metadata, last_access, "
+            "probe_mode) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._list_row_pending,
+        )
+        self._conn.executemany(
+            "UPDATE probe SET last_access = ? WHERE path = ?",
+            self._list_access_pending,
+        )
+        self._conn.commit()
+        self._list_row_pending = []
+        self._list_access_pending = []
+
+    def put(
+        self,
+        fingerprint: tuple,
+        metadata: dict,
+        probe_mode: str = PROBE_MODE_FULL,
+    ) -> None:
+        """Stores the metadata of a file.
+
+        Args:
+            fingerprint (tuple): see get_fingerprint
+            metadata (dict): ffprobe metadata
+            probe_mode (str, optional): probe mode of the metadata, see
+                PROBE_MODE_FULL. Defaults to 'full'.
+        """
+
+        self.put_many([(fingerprint, metadata)], probe_mode)
+
+    def evict(self, max_entries: Union[int, None] = None) -> int:
+        """Removes the least recently used entries above max_entries.
+
+        Args:
+            max_entries (int, optional): entries to keep. Defaults to the
+                value given in the constructor.
+
+        Returns:
+            int: number of entries removed
+        """
+
+        if max_entries is None:
+            max_entries = self.max_entries
+        with self._lock:
+            self._flush()
+            cursor = self._conn.execute(
+                "DELETE FROM probe WHERE path IN ("
+                "SELECT path FROM probe ORDER BY last_access DESC "
+                "LIMIT -1 OFFSET ?)",
+                (int(max_entries),),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def remove_stale(self) -> int:
+        """Removes entries whose file no longer exists or changed.
+
+        Returns:
+            int: number of entries removed
+        """
+
+        with self._lock:
+            self._flush()
+            list_row = self._conn.execute(
+                "SELECT path, size, mtime_ns, inode FROM probe"
+            ).fetchall()
+        list_path_stale = []
+        for path, size, mtime_ns, inode in list_row:
+            try:
+                fingerprint = get_fingerprint(Path(path))
+            except OSError:
+                list_path_stale.append((path,))
+                continue
+            if not is_same_fingerprint(
+                fingerprint, (path, size, mtime_ns, inode)
+            ):
+                list_path_stale.append((path,))
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM probe WHERE path = ?", list_path_stale
+            )
+            self._conn.commit()
+        return len(list_path_stale)
+
+    def clear(self) -> None:
+        """Removes all entries"""
+
+        with self._lock:
+            self._list_row_pending = []
+            self._list_access_pending = []
+            self._conn.execute("DELETE FROM probe")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def info(self) -> dict:
+        """Returns cache statistics
+
+        Returns:
+            dict: keys: ['path', 'entries', 'max_entries', 'size_bytes',
+                         'oldest_access', 'newest_access']
+        """
+
+        with self._lock:
+            self._flush()
+            entries, oldest, newest = self._conn.execute(
+                "SELECT COUNT(*), MIN(last_access), MAX(last_access) "
+                "FROM probe"
+            ).fetchone()
+        size_bytes = sum(
+            x.stat().st_size
+            for x in self.path_file_db.parent.glob(
+                self.path_file_db.name + "*"
+            )
+        )
+        return {
+            "path": str(self.path_file_db),
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "size_bytes": size_bytes,
+            "oldest_access": oldest,
+            "newest_access": newest,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+
+def get_probe_cache(cache_path: str = "", max_entries: int = 200000):
+    """Opens the probe cache.
+
+    Args:
+        cache_path (str, optional): sqlite file path. If empty, uses
+            probe_cache.sqlite3 in the user-level cache folder.
+            Defaults to "".
+        max_entries (int, optional): cache size cap. Defaults to 200000.
+
+    Returns:
+        ProbeCache: probe cache
+    """
+
+    if cache_path:
+        path_file_db = Path(cache_path)
+    else:
+        path_file_db = get_cache_dir() / "probe_cache.sqlite3"
+    logging.info("Probe cache: %s", path_file_db)
+    return ProbeCache(path_file_db, max_entries=max_entries)
@@ -0,0 +1,224 @@
+"""Columnar export of reports, Parquet or Feather, through pyarrow.
+
+The report CSV loses its types: integer columns with gaps come back as
+float, paths of empty columns as float NaN. The export keeps them, with a
+fixed schema (COLUMN_TYPES) shared by every project, so the reports of
+many projects are read as a single dataset (see read_reports). Codec,
+format, profile and conversion type columns are dictionary encoded.
+
+The report columns are the flattened probe metadata. The raw metadata
+stays in the JSON Lines dump of the report.
+
+pyarrow is an optional dependency: pip install vidqa[arrow]
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# export format: file extension
+DICT_EXTENSION = {"parquet": ".parquet", "feather": ".feather"}
+
+# column: kind of values. 'category' columns are dictionary encoded.
+COLUMN_TYPES = {
+    "project": "category",
+    "duration": "string",
+    "duration_seconds": "float",
+    "file_size": "int",
+    "file_mtime_ns": "int",
+    "format_name": "category",
+    "total_bitrate": "int",
+    "video_bitrate": "int",
+    "video_codec": "category",
+    "audio_codec": "category",
+    "audio_channels": "int",
+    "is_avc": "int",
+    "video_profile": "category",
+    "video_resolution_height": "int",
+    "video_resolution_width": "int",
+    "path_file": "string",
+    "file_path_folder": "string",
+    "file_name": "string",
+    "type_conversion": "category",
+    "conversion_done": "int",
+    "path_file_converted": "string",
+}
+
+DICT_PANDAS_DTYPE = {
+    "string": "string",
+    "float": "float64",
+    "int": "Int64",
+    "category": "category",
+}
+
+
+def check_pyarrow() -> None:
+    """Raises ImportError if pyarrow is not installed"""
+
+    if pa is None:
+        raise ImportError(
+            "The report export needs pyarrow: pip install vidqa[arrow]"
+        )
+
+
+def get_schema() -> pa.Schema:
+    """Returns the arrow schema of an exported report"""
+
+    check_pyarrow()
+    dict_arrow_type = {
+        "string": pa.string(),
+        "float": pa.float64(),
+        "int": pa.int64(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+    }
+    return pa.schema(
+        [(name, dict_arrow_type[kind]) for name, kind in COLUMN_TYPES.items()]
+    )
+
+
+def read_report_csv(path_file_report: Path) -> pd.DataFrame:
+    """Reads a report CSV with the types of COLUMN_TYPES, adding the
+    missing columns as empty.
+
+    Args:
+        path_file_report (Path): report path. csv.
+
+    Returns:
+        pd.DataFrame: report, with the column 'project': the name of the
+            report, which is the name of the project folder
+    """
+
+    dict_dtype = {
+        name: DICT_PANDAS_DTYPE[kind] for name, kind in COLUMN_TYPES.items()
+    }
+    df = pd.read_csv(path_file_report, dtype=dict_dtype)
+    df["project"] = Path(path_file_report).stem
+    for name in COLUMN_TYPES:
+        if name not in df.columns:
+            df[name] = pd.Series(
+                index=df.index, dtype=DICT_PANDAS_DTYPE[COLUMN_TYPES[name]]
+            )
+    return df[list(COLUMN_TYPES)]
+
+
+def get_path_report_export(path_file_report: Path, format_: str) -> Path:
+    """Returns the path of the export of a report: {report}.parquet or
+    {report}.feather, next to the report"""
+
+    return Path(path_file_report).with_suffix(DICT_EXTENSION[format_])
+
+
+def export_report(path_file_report: Path, format_: str) -> Path:
+    """Exports a report CSV as Parquet or Feather.
+
+    Args:
+        path_file_report (Path): report path. csv.
+        format_ (str): 'parquet' or 'feather'
+
+    Returns:
+        Path: exported report
+
+    Raises:
+        ImportError: if pyarrow is not installed
+        ValueError: if the format is not known
+    """
+
+    if format_ not in DICT_EXTENSION:
+        raise ValueError(f"Report export format not known: {format_}")
+    check_pyarrow()
+    df = read_report_csv(path_file_report)
+    table = pa.Table.from_pandas(df, schema=get_schema(), preserve_index=False)
+    path_file_export = get_path_report_export(path_file_report, format_)
+    path_file_temp = Path(str(path_file_export) + ".tmp")
+    if format_ == "parquet":
+        pq.write_table(table, path_file_temp)
+    else:
+        feather.write_feather(table, path_file_temp)
+    os.replace(path_file_temp, path_file_export)
+    logging.info("Report exported: %s", path_file_export)
+    return path_file_export
+
+
+def get_list_path_export(list_path: list[Path]) -> list[Path]:
+    """Returns the exported reports of a list of files and folders.
+    Folders are searched recursively, like the folder with all the
+    vidqa_* log folders."""
+
+    list_path_export = []
+    for path in list_path:
+        path = Path(path)
+        if path.is_dir():
+            for extension in DICT_EXTENSION.values():
+                list_path_export += sorted(path.rglob("*" + extension))
+        else:
+            list_path_export.append(path)
+    return list_path_export
+
+
+def read_reports(
+    list_path: list[Path],
+    columns: Union[list[str], None] = None,
+    filters: Union[list, ds.Expression, None] = None,
+) -> pd.DataFrame:
+    """Reads exported reports of many projects as one table. Only the
+    selected columns are read and the filters are pushed down to the scan,
+    skipping the Parquet row groups that can't match.
+
+    Args:
+        list_path (list[Path]): exported reports, or folders to search for
+            them. Parquet and Feather may be mixed.
+        columns (list[str], optional): columns to read. Defaults to None,
+            all the columns.
+        filters (Union[list, ds.Expression], optional): rows to
+            read, as a pyarrow expression or in the format of the filters
+            of pandas.read_parquet, e.g. [('video_codec', '!=', 'h264')].
+            Defaults to None, all the rows.
+
+    Returns:
+        pd.DataFrame: reports, with the column 'project'. Dictionary
+            encoded columns are categorical.
+
+    Raises:
+        ImportError: if pyarrow is not installed
+    """
+
+    check_pyarrow()
+    dict_list_path = {}
+    for path_file in get_list_path_export(list_path):
+        format_ = "parquet" if path_file.suffix == ".parquet" else "feather"
+        dict_list_path.setdefault(format_, []).append(str(path_file))
+    schema = get_schema()
+    # the pandas types of read_report_csv
+    types_mapper = {
+        pa.int64(): pd.Int64Dtype(),
+        pa.string(): pd.StringDtype(),
+    }.get
+    if len(dict_list_path) == 0:
+        table = schema.empty_table()
+        return table.to_pandas(types_mapper=types_mapper)[
+            columns or schema.names
+        ]
+    list_dataset = [
+        ds.dataset(list_path_file, format=format_, schema=schema)
+        for format_, list_path_file in dict_list_path.items()
+    ]
+    dataset = list_dataset[0]
+    if len(list_dataset) > 1:
+        dataset = ds.dataset(list_dataset)
+    if isinstance(filters, list):
+        filters = pq.filters_to_expression(filters)
+    table = dataset.to_table(columns=columns, filter=filters)
+    return table.to_pandas(types_mapper=types_mapper)
@@ -0,0 +1,157 @@
+"""Salvage of converted videos left in the log folder.
+
+The output of a conversion has a fixed name, see
+make_reencode.get_path_file_dest. When the job of a video has no record of
+its conversion, because the report was lost or deleted, or the run stopped
+between the end of ffmpeg and the update of the job store, an existing
+output with that name is validated with ffprobe and adopted instead of
+being encoded again. Salvage is off by default, see the flag salvage.
+
+An output is valid when it is not older than its source, its duration
+matches the source (see DURATION_TOLERANCE_SECONDS and
+DURATION_TOLERANCE_RATIO) and its streams match the recipe of the
+conversion: encoded streams in the codecs of the target profile, copied
+streams in the codec of the source, and an audio stream only if the source
+has one. Truncated outputs of interrupted conversions fail the duration
+check.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from . import video_report
+from .conversion_policy import DICT_RECIPE, TargetProfile
+
+# the output duration may differ from the source by the larger of both
+DURATION_TOLERANCE_SECONDS = 1.0
+DURATION_TOLERANCE_RATIO = 0.01
+
+
+def get_codec(value) -> str:
+    """Returns the codec of a report line, '' for a missing stream"""
+
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    return str(value)
+
+
+def is_stream_valid(
+    codec_source: str,
+    codec_output: str,
+    encoded: bool,
+    list_codec_target: list[str],
+) -> bool:
+    """Checks a stream of an output against the recipe of its conversion.
+
+    Args:
+        codec_source (str): codec of the source stream. '' if none.
+        codec_output (str): codec of the output stream. '' if none.
+        encoded (bool): the recipe encodes the stream
+        list_codec_target (list[str]): codecs of the target profile
+
+    Returns:
+        bool: True if the stream matches the recipe
+    """
+
+    if codec_source == "":
+        return codec_output == ""
+    if encoded:
+        return codec_output.lower() in list_codec_target
+    return codec_output == codec_source
+
+
+def is_output_valid(
+    dict_video_data: dict,
+    path_file_dest: Path,
+    profile: TargetProfile,
+    flags: dict,
+) -> bool:
+    """Checks if an existing output is the complete conversion of a video.
+
+    Args:
+        dict_video_data (dict): report line of the video. Keys
+            type_conversion, duration_seconds, video_codec, audio_codec
+            and file_mtime_ns, if the report has it.
+        path_file_dest (Path): output path, see
+            make_reencode.get_path_file_dest
+        profile (TargetProfile): target of the conversion
+        flags (dict): video conversion flags. Uses the probe_timeout and
+            probe_retries flags.
+
+    Returns:
+        bool: True if the output can be adopted as converted
+    """
+
+    try:
+        stat_dest = os.stat(path_file_dest)
+    except OSError:
+        return False
+    recipe = DICT_RECIPE.get(dict_video_data.get("type_conversion"))
+    if recipe is None:
+        return False
+    _, video_encoded, audio_encoded = recipe
+
+    file_mtime_ns = dict_video_data.get("file_mtime_ns")
+    if file_mtime_ns is not None and not pd.isna(file_mtime_ns):
+        if stat_dest.st_mtime_ns < int(file_mtime_ns):
+            logging.info(
+                "Output older than its source, not salvaged: %s",
+                path_file_dest,
+            )
+            return False
+
+    # ffprobe with its default limits: the native parsers and the fast
+    # probe only approximate the duration and the codecs
+    result = video_report.probe_file(
+        path_file_dest,
+        fast_probe=None,
+        native=False,
+        policy=video_report.get_probe_policy(flags),
+    )
+    if result["metadata"] is None or result["corrupt"]:
+        logging.info("Output not readable, not salvaged: %s", path_file_dest)
+        return False
+    record = video_report.ProbeRecord.from_metadata(
+        str(path_file_dest), result["metadata"], stat_dest
+    )
+    if record is None:
+        return False
+
+    duration_seconds = float(dict_video_data.get("duration_seconds") or 0)
+    tolerance = max(
+        DURATION_TOLERANCE_SECONDS,
+        duration_seconds * DURATION_TOLERANCE_RATIO,
+    )
+    if abs(record.duration_seconds - duration_seconds) > tolerance:
+        logging.info(
+            "Output duration %.2fs, source %.2fs, not salvaged: %s",
+            record.duration_seconds,
+            duration_seconds,
+            path_file_dest,
+        )
+        return False
+
+    if not is_stream_valid(
+        get_codec(dict_video_data.get("video_codec")),
+        record.video_codec,
+        video_encoded,
+        profile.video_codecs,
+    ) or not is_stream_valid(
+        get_codec(dict_video_data.get("audio_codec")),
+        record.audio_codec,
+        audio_encoded,
+        profile.audio_codecs,
+    ):
+        logging.info(
+            "Output streams %s/%s do not match the recipe, not salvaged: %s",
+            record.video_codec,
+            record.audio_codec or "none",
+            path_file_dest,
+        )
+        return False
+    return True
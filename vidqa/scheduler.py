@@ -0,0 +1,199 @@
+"""Concurrent scheduler of conversion jobs.
+
+Jobs run in two lanes with separate limits:
+- io: stream copy jobs (2_container, 3_only_audio). Bound by disk/network,
+  so many of them can run at the same time.
+- cpu: libx264 jobs (4_only_video, 5_total_conv). Each one receives a
+  budget of ffmpeg threads.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Union
+
+from .job_cost import DICT_ORDER_BY
+from .job_store import JobStore
+
+LANE_IO = "io"
+LANE_CPU = "cpu"
+
+DICT_LANE_TYPE_CONVERSION = {
+    LANE_IO: ["2_container", "3_only_audio"],
+    LANE_CPU: ["4_only_video", "5_total_conv"],
+}
+
+
+def get_lane(type_conversion: str) -> str:
+    """Returns the lane of a type_conversion: 'io' or 'cpu'"""
+
+    for lane, list_type_conversion in DICT_LANE_TYPE_CONVERSION.items():
+        if type_conversion in list_type_conversion:
+            return lane
+    return LANE_CPU
+
+
+class JobFeed:
+    """Signals jobs added to the job store while the scheduler runs.
+
+    The producer calls notify() after adding jobs and close() after the
+    last one. The scheduler keeps waiting for jobs until the feed is
+    closed.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._event = threading.Event()
+
+    def notify(self) -> None:
+        self._event.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._event.set()
+
+    def pop(self) -> bool:
+        """Returns True if there was a signal since the last call"""
+
+        if not self._event.is_set():
+            return False
+        self._event.clear()
+        return True
+
+    def is_drained(self) -> bool:
+        """Returns True if the feed is closed and all its signals were
+        popped"""
+
+        return self.closed and not self._event.is_set()
+
+    def wait(self, timeout: float) -> None:
+        self._event.wait(timeout)
+
+
+class ConversionScheduler:
+    """Runs the pending jobs of a job store with bounded concurrency per
+    lane.
+
+    Args:
+        io_jobs (int, optional): concurrent jobs in the io lane.
+            Defaults to 2.
+        cpu_jobs (int, optional): concurrent jobs in the cpu lane.
+            Defaults to 1.
+        threads_per_job (int, optional): ffmpeg threads of each cpu job.
+            0 lets ffmpeg decide. Defaults to 0.
+        job_order (str, optional): ordering policy of the jobs of each lane,
+            see job_cost.DICT_ORDER_BY. With 'quick_wins', idle cpu slots
+            also run pending io jobs. Defaults to 'fifo'.
+    """
+
+    def __init__(
+        self,
+        io_jobs: int = 2,
+        cpu_jobs: int = 1,
+        threads_per_job: int = 0,
+        job_order: str = "fifo",
+    ):
+        self.dict_limit = {
+            LANE_IO: max(1, int(io_jobs)),
+            LANE_CPU: max(1, int(cpu_jobs)),
+        }
+        self.threads_per_job = max(0, int(threads_per_job))
+        # seconds between checks of the job feed while jobs are running
+        self.feed_timeout = 1.0
+        if job_order not in DICT_ORDER_BY:
+            raise ValueError(f"job_order not recognized: {job_order}")
+        self.job_order = job_order
+        self.dict_lane_type_conversion = dict(DICT_LANE_TYPE_CONVERSION)
+        if job_order == "quick_wins":
+            self.dict_lane_type_conversion[LANE_CPU] = (
+                DICT_LANE_TYPE_CONVERSION[LANE_IO]
+                + DICT_LANE_TYPE_CONVERSION[LANE_CPU]
+            )
+
+    def get_flags(self, lane: str, flags: dict) -> dict:
+        """Returns the conversion flags of a job of the lane"""
+
+        flags_job = dict(flags)
+        if lane == LANE_CPU and self.threads_per_job > 0:
+            flags_job["threads"] = self.threads_per_job
+        return flags_job
+
+    def run(
+        self,
+        job_store: JobStore,
+        flags: dict,
+        func_job: Callable[[dict, dict], object],
+        func_done: Callable[[dict, object, BaseException], None],
+        job_feed: Union[JobFeed, None] = None,
+    ) -> None:
+        """Claims and runs jobs until no pending job is left.
+
+        func_job runs in a worker thread. func_done always runs in the
+        calling thread, one job at a time.
+
+        With a job_feed, jobs may be added to the job store during the run,
+        and the run only ends after the feed is closed.
+
+        Args:
+            job_store (JobStore): job store
+            flags (dict): video conversion flags
+            func_job (Callable[[dict, dict], object]): receives the job and
+                the lane flags. Returns the job result.
+            func_done (Callable[[dict, object, BaseException], None]):
+                receives the job, the result and the exception raised by
+                func_job, or None.
+            job_feed (JobFeed, optional): feed of jobs added during the
+                run. Defaults to None.
+        """
+
+        dict_running = {LANE_IO: 0, LANE_CPU: 0}
+        dict_future = {}
+        dict_exhausted = {LANE_IO: False, LANE_CPU: False}
+        max_workers = sum(self.dict_limit.values())
+        logging.info(
+            "Scheduler lanes: io=%s cpu=%s threads_per_job=%s order=%s",
+            self.dict_limit[LANE_IO],
+            self.dict_limit[LANE_CPU],
+            self.threads_per_job,
+            self.job_order,
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                if job_feed is not None and job_feed.pop():
+                    dict_exhausted = {LANE_IO: False, LANE_CPU: False}
+                for lane, limit in self.dict_limit.items():
+                    while (
+                        not dict_exhausted[lane] and dict_running[lane] < limit
+                    ):
+                        job = job_store.claim_next(
+                            self.dict_lane_type_conversion[lane],
+                            self.job_order,
+                        )
+                        if job is None:
+                            dict_exhausted[lane] = True
+                            break
+                        future = executor.submit(
+                            func_job, job, self.get_flags(lane, flags)
+                        )
+                        dict_future[future] = (job, lane)
+                        dict_running[lane] += 1
+
+                if len(dict_future) == 0:
+                    if job_feed is None or job_feed.is_drained():
+                        break
+                    job_feed.wait(self.feed_timeout)
+                    continue
+
+                set_done, _ = wait(
+                    dict_future,
+                    timeout=None if job_feed is None else self.feed_timeout,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in set_done:
+                    job, lane = dict_future.pop(future)
+                    dict_running[lane] -= 1
+                    exception = future.exception()
+                    result = None if exception else future.result()
+                    func_done(job, result, exception)
@@ -0,0 +1,609 @@
+"""Segment-parallel video encode of long videos.
+
+A long source is split at keyframes into chunks of the video stream (stream
+copy), the chunks are encoded in parallel ffmpeg processes and then joined
+without reencode by the concat demuxer. The audio is taken once, from the
+source, in the final mux. The output has the first video stream and the
+first audio stream of the source. The single-pass conversion keeps the
+default stream selection of ffmpeg instead, so sources where both differ,
+see is_layout_kept, are converted in a single pass.
+
+The segment encodes of a job share the ffmpeg threads of its cpu lane slot,
+see get_segment_budget.
+
+With a SegmentCheckpoint, the chunks and each encoded segment are recorded
+in the job store as soon as they are complete, so an interrupted
+conversion resumes from the segments already encoded.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Union
+
+from .conversion_policy import DICT_RECIPE, TargetProfile, get_profile
+from .ffprobe_micro import ffprobe
+from .job_store import JobStore
+from .video_tools import FFmpegProgress, run_ffmpeg
+
+# extensions of the outputs that take the mp4 muxer flag faststart
+SET_EXTENSION_FASTSTART = {".mp4", ".m4v", ".mov"}
+
+# ffprobe -show_entries of the streams read by is_layout_kept
+STREAM_ENTRIES = (
+    "stream=index,codec_type,width,height,channels"
+    ":stream_disposition=default,attached_pic"
+)
+
+
+def use_segmented(
+    flags: dict, type_conversion: str, duration_seconds: float
+) -> bool:
+    """Checks if a conversion should run segment-parallel.
+
+    Args:
+        flags (dict): video conversion flags. Key 'segment_min_duration':
+            minimum duration in seconds of the source. 0 disables.
+        type_conversion (str): type of conversion
+        duration_seconds (float): source duration
+
+    Returns:
+        bool: True to run segment-parallel
+    """
+
+    segment_min_duration = float(flags.get("segment_min_duration", 0))
+    recipe = DICT_RECIPE.get(type_conversion)
+    # only conversions that encode the video
+    if segment_min_duration <= 0 or recipe is None or not recipe[1]:
+        return False
+    try:
+        return float(duration_seconds) >= segment_min_duration
+    except (TypeError, ValueError):
+        return False
+
+
+def get_stream_score(stream: dict) -> int:
+    """Returns the score of a stream in the default stream selection of
+    ffmpeg: the resolution of a video, the channels of an audio, with a
+    bonus for the default disposition. Attached pictures score 1."""
+
+    disposition = stream.get("disposition", {})
+    if stream.get("codec_type") == "video":
+        if disposition.get("attached_pic"):
+            return 1
+        score = int(stream.get("width", 0)) * int(stream.get("height", 0))
+    else:
+        score = int(stream.get("channels", 0))
+    return score + 5000000 * bool(disposition.get("default"))
+
+
+def get_default_layout(list_stream: list[dict]) -> list[int]:
+    """Returns the streams of a source kept by the single-pass conversion,
+    with the default stream selection of ffmpeg: the best video, the best
+    audio (see get_stream_score, the first one on a tie) and the first
+    subtitle.
+
+    Args:
+        list_stream (list[dict]): streams of the source, from ffprobe
+
+    Returns:
+        list[int]: stream indexes
+    """
+
+    list_index = []
+    for codec_type in ("video", "audio"):
+        list_stream_type = [
+            x for x in list_stream if x.get("codec_type") == codec_type
+        ]
+        if len(list_stream_type) > 0:
+            # max keeps the first of the streams with the best score
+            stream = max(list_stream_type, key=get_stream_score)
+            list_index.append(int(stream["index"]))
+    for stream in list_stream:
+        if stream.get("codec_type") == "subtitle":
+            list_index.append(int(stream["index"]))
+            break
+    return list_index
+
+
+def get_segmented_layout(list_stream: list[dict]) -> list[int]:
+    """Returns the streams of a source kept by the segmented conversion:
+    the first video and the first audio.
+
+    Args:
+        list_stream (list[dict]): streams of the source, from ffprobe
+
+    Returns:
+        list[int]: stream indexes
+    """
+
+    list_index = []
+    for codec_type in ("video", "audio"):
+        for stream in list_stream:
+            if stream.get("codec_type") == codec_type:
+                list_index.append(int(stream["index"]))
+                break
+    return list_index
+
+
+def is_layout_kept(path_file_origin: Path) -> bool:
+    """Checks if the segmented conversion of a source outputs the same
+    streams as its single-pass conversion.
+
+    Args:
+        path_file_origin (Path): source video
+
+    Returns:
+        bool: False if the streams differ or the probe failed
+    """
+
+    result = ffprobe(path_file_origin, show_entries=STREAM_ENTRIES)
+    try:
+        list_stream = result.get_output_as_dict().get("streams", [])
+    except ValueError:
+        list_stream = []
+    if result.return_code != 0 or len(list_stream) == 0:
+        logging.warning("Stream probe failed: %s", path_file_origin)
+        return False
+    if get_default_layout(list_stream) != get_segmented_layout(list_stream):
+        logging.info(
+            "Streams not kept by the segmented conversion: %s",
+            path_file_origin,
+        )
+        return False
+    return True
+
+
+def get_folder_work(path_file_dest: Path) -> Path:
+    """Returns the work folder of the segments of a conversion"""
+
+    path_file_dest = Path(path_file_dest)
+    return path_file_dest.parent / (path_file_dest.stem + "_segments")
+
+
+def split_video(
+    path_file_origin: Path, folder_work: Path, segment_seconds: float
+) -> list[Path]:
+    """Splits the first video stream of a file at keyframes, without
+    reencode.
+
+    Args:
+        path_file_origin (Path): source video
+        folder_work (Path): folder to receive the chunks
+        segment_seconds (float): minimum chunk duration. Chunks end at the
+            first keyframe after it.
+
+    Returns:
+        list[Path]: chunks, in order. Empty if the split failed.
+    """
+
+    for path_file_chunk in folder_work.glob("source_*.mkv"):
+        path_file_chunk.unlink()
+    list_arg = [
+        "-y",
+        "-i",
+        path_file_origin,
+        "-map",
+        "0:v:0",
+        "-c",
+        "copy",
+        "-map_metadata",
+        "-1",
+        "-f",
+        "segment",
+        "-segment_time",
+        str(segment_seconds),
+        "-reset_timestamps",
+        "1",
+        folder_work / "source_%05d.mkv",
+    ]
+    if run_ffmpeg(list_arg) != 0:
+        return []
+    return sorted(folder_work.glob("source_*.mkv"))
+
+
+def get_segment_budget(flags: dict) -> tuple[int, int]:
+    """Splits the ffmpeg threads of the cpu lane slot of a job between its
+    segment encodes.
+
+    Args:
+        flags (dict): video conversion flags. Keys 'segment_workers'
+            (default 4), 'threads' (threads of the job, set by the
+            scheduler from threads_per_job) and 'cpu_jobs' (default 1).
+            Without threads, the slot gets its share of the cpus.
+
+    Returns:
+        tuple[int, int]: (parallel segment encodes, ffmpeg threads of each)
+    """
+
+    segment_workers = max(1, int(flags.get("segment_workers", 4)))
+    threads = int(flags.get("threads", 0))
+    if threads <= 0:
+        cpu_jobs = max(1, int(flags.get("cpu_jobs", 1)))
+        threads = max(1, (os.cpu_count() or 1) // cpu_jobs)
+    segment_workers = min(segment_workers, threads)
+    return segment_workers, threads // segment_workers
+
+
+def get_path_file_encoded(path_file_chunk: Path) -> Path:
+    return path_file_chunk.parent / path_file_chunk.name.replace(
+        "source_", "encoded_"
+    )
+
+
+def encode_segment(
+    path_file_chunk: Path,
+    path_file_encoded: Path,
+    flags: dict,
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+) -> int:
+    """Encodes a video chunk with the video arguments of the target
+    profile.
+
+    Args:
+        path_file_chunk (Path): chunk of the source
+        path_file_encoded (Path): encoded chunk
+        flags (dict): video conversion flags
+        on_progress (Callable[[FFmpegProgress], None], optional): progress
+            callback. Defaults to None.
+
+    Returns:
+        int: ffmpeg return code
+    """
+
+    list_arg = (
+        ["-y", "-i", path_file_chunk, "-map", "0:v:0"]
+        + get_profile(flags).get_video_args(flags, faststart=False)
+        + [path_file_encoded]
+    )
+    return run_ffmpeg(list_arg, on_progress)
+
+
+def concat_segments(
+    list_path_file_encoded: list[Path],
+    path_file_origin: Path,
+    path_file_dest: Path,
+    type_conversion: str,
+    profile: Union[TargetProfile, None] = None,
+) -> int:
+    """Joins the encoded chunks with the concat demuxer, without reencode,
+    and muxes the first audio stream of the source. Other streams of the
+    source are dropped.
+
+    Args:
+        list_path_file_encoded (list[Path]): encoded chunks, in order
+        path_file_origin (Path): source video
+        path_file_dest (Path): output video, with the extension of the
+            target profile
+        type_conversion (str): '4_only_video' copies the audio,
+            '5_total_conv' converts it with the audio arguments of the
+            target profile.
+        profile (TargetProfile, optional): target profile. Defaults to the
+            default profile.
+
+    Returns:
+        int: ffmpeg return code
+    """
+
+    path_file_list = list_path_file_encoded[0].parent / "concat.txt"
+    with open(path_file_list, "w", encoding="utf-8") as f:
+        for path_file_encoded in list_path_file_encoded:
+            path_escaped = str(path_file_encoded.absolute()).replace(
+                "'", "'\\''"
+            )
+            f.write(f"file '{path_escaped}'\n")
+
+    if profile is None:
+        profile = get_profile({})
+    if DICT_RECIPE[type_conversion][2]:
+        list_arg_audio = profile.get_audio_args()
+    else:
+        list_arg_audio = ["-c:a", "copy"]
+    if Path(path_file_dest).suffix.lower() in SET_EXTENSION_FASTSTART:
+        list_arg_audio += ["-movflags", "+faststart"]
+
+    list_arg = (
+        [
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            path_file_list,
+            "-i",
+            path_file_origin,
+            "-map",
+            "0:v:0",
+            "-map",
+            "1:a:0?",
+            "-map_metadata",
+            "-1",
+            "-c:v",
+            "copy",
+        ]
+        + list_arg_audio
+        + [path_file_dest]
+    )
+    return run_ffmpeg(list_arg)
+
+
+def get_recipe(path_file_origin: Path, flags: dict) -> str:
+    """Identifies the source file and the encode parameters of a segmented
+    conversion. Segments are only reused with the same recipe.
+
+    Args:
+        path_file_origin (Path): source video
+        flags (dict): video conversion flags
+
+    Returns:
+        str: recipe. json.
+    """
+
+    stat_result = os.stat(path_file_origin)
+    flags_encode = dict(flags)
+    # the thread budget does not change the encoded stream
+    flags_encode.pop("threads", None)
+    return json.dumps(
+        {
+            "source": [stat_result.st_size, stat_result.st_mtime_ns],
+            "segment_seconds": float(flags.get("segment_seconds", 300)),
+            "args": get_profile(flags_encode).get_video_args(
+                flags_encode, faststart=False
+            ),
+        }
+    )
+
+
+class SegmentCheckpoint:
+    """Segments of the segmented conversion of a job, recorded in the job
+    store.
+
+    Args:
+        job_store (JobStore): job store
+        path_file (str): path_file of the job
+    """
+
+    def __init__(self, job_store: JobStore, path_file: str):
+        self.job_store = job_store
+        self.path_file = str(path_file)
+
+    def load(self, recipe: str) -> list[dict]:
+        """Returns the recorded segments. Committed segments whose encoded
+        file is missing or changed return to not committed.
+
+        Args:
+            recipe (str): recipe of the conversion
+
+        Returns:
+            list[dict]: segments, see JobStore.get_segments. Empty if there
+                is no usable split of the source.
+        """
+
+        list_segment = self.job_store.get_segments(self.path_file)
+        for segment in list_segment:
+            if segment["recipe"] != recipe:
+                return []
+            if not Path(segment["path_file_chunk"]).exists():
+                return []
+        for segment in list_segment:
+            if segment["path_file_encoded"] is None:
+                continue
+            path_file_encoded = Path(segment["path_file_encoded"])
+            if (
+                not path_file_encoded.exists()
+                or path_file_encoded.stat().st_size != segment["encoded_size"]
+            ):
+                segment["path_file_encoded"] = None
+        return list_segment
+
+    def set_chunks(
+        self, recipe: str, list_path_file_chunk: list[Path]
+    ) -> None:
+        self.job_store.set_segments(
+            self.path_file, recipe, list_path_file_chunk
+        )
+
+    def commit(
+        self, index: int, path_file_encoded: Path, duration_seconds: float
+    ) -> None:
+        self.job_store.commit_segment(
+            self.path_file,
+            index,
+            path_file_encoded,
+            path_file_encoded.stat().st_size,
+            duration_seconds,
+        )
+
+    def clear(self) -> None:
+        self.job_store.clear_segments(self.path_file)
+
+
+class SegmentProgress:
+    """Sums the progress of the chunks encoded in parallel into a single
+    FFmpegProgress of the whole video.
+
+    Args:
+        on_progress (Callable[[FFmpegProgress], None]): progress callback of
+            the whole video, or None.
+        offset_seconds (float, optional): media time of the segments
+            already committed. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        on_progress: Union[Callable[[FFmpegProgress], None], None],
+        offset_seconds: float = 0,
+    ):
+        self.on_progress = on_progress
+        self.offset_seconds = offset_seconds
+        self.dict_progress: dict[int, FFmpegProgress] = {}
+        self._lock = threading.Lock()
+
+    def get_out_time_seconds(self, index: int) -> float:
+        """Returns the media time written by the encode of a chunk"""
+
+        with self._lock:
+            progress = self.dict_progress.get(index)
+        return 0.0 if progress is None else progress.out_time_seconds
+
+    def get_callback(self, index: int) -> Callable[[FFmpegProgress], None]:
+        def on_progress_segment(progress: FFmpegProgress) -> None:
+            with self._lock:
+                self.dict_progress[index] = progress
+                if self.on_progress is None:
+                    return
+                total = FFmpegProgress()
+                total.out_time_seconds = self.offset_seconds
+                running = False
+                for progress_segment in self.dict_progress.values():
+                    total.frame += progress_segment.frame
+                    total.fps += progress_segment.fps
+                    total.total_size += progress_segment.total_size
+                    total.out_time_seconds += progress_segment.out_time_seconds
+                    if progress_segment.progress != "end":
+                        total.speed += progress_segment.speed
+                        running = True
+                total.progress = "continue" if running else "end"
+                if running:
+                    self.on_progress(total)
+
+        return on_progress_segment
+
+
+def convert_segmented(
+    path_file_origin: Path,
+    path_file_dest: Path,
+    type_conversion: str,
+    flags: dict,
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+    segment_checkpoint: Union[SegmentCheckpoint, None] = None,
+) -> int:
+    """Converts a long video to the target profile encoding chunks in
+    parallel.
+
+    Args:
+        path_file_origin (Path): source video
+        path_file_dest (Path): output video
+        type_conversion (str): '4_only_video' or '5_total_conv'
+        flags (dict): video conversion flags. Keys 'segment_seconds'
+            (chunk duration, default 300) and 'segment_workers' (parallel
+            chunk encodes, default 4, within the thread budget of the job,
+            see get_segment_budget).
+        on_progress (Callable[[FFmpegProgress], None], optional): progress
+            callback. Defaults to None.
+        segment_checkpoint (SegmentCheckpoint, optional): records the
+            segments, to resume an interrupted conversion. Defaults to None.
+
+    Returns:
+        int: 0 on success. Otherwise, the return code of the ffmpeg step
+             that failed.
+    """
+
+    segment_seconds = float(flags.get("segment_seconds", 300))
+    segment_workers, threads_segment = get_segment_budget(flags)
+    flags_segment = dict(flags, threads=threads_segment)
+    path_file_origin = Path(path_file_origin)
+    path_file_dest = Path(path_file_dest)
+    folder_work = get_folder_work(path_file_dest)
+    folder_work.mkdir(parents=True, exist_ok=True)
+    recipe = get_recipe(path_file_origin, flags)
+
+    list_segment = []
+    if segment_checkpoint is not None:
+        list_segment = segment_checkpoint.load(recipe)
+    if len(list_segment) > 0:
+        logging.info(
+            "Resume segmented conversion (%s of %s segments done): %s",
+            sum(x["path_file_encoded"] is not None for x in list_segment),
+            len(list_segment),
+            path_file_origin,
+        )
+    else:
+        logging.info(
+            "Convert segmented (%ss chunks, %s workers): %s",
+            segment_seconds,
+            segment_workers,
+            path_file_origin,
+        )
+        list_path_file_chunk = split_video(
+            path_file_origin, folder_work, segment_seconds
+        )
+        if len(list_path_file_chunk) == 0:
+            logging.error("Split in segments failed: %s", path_file_origin)
+            return -1
+        if segment_checkpoint is not None:
+            segment_checkpoint.set_chunks(recipe, list_path_file_chunk)
+        list_segment = [
+            {
+                "idx": index,
+                "path_file_chunk": str(path_file_chunk),
+                "path_file_encoded": None,
+                "duration_seconds": None,
+            }
+            for index, path_file_chunk in enumerate(list_path_file_chunk)
+        ]
+
+    segment_progress = SegmentProgress(
+        on_progress,
+        sum(
+            x["duration_seconds"] or 0
+            for x in list_segment
+            if x["path_file_encoded"] is not None
+        ),
+    )
+    return_code_failed = 0
+    with ThreadPoolExecutor(max_workers=segment_workers) as executor:
+        dict_future = {}
+        for segment in list_segment:
+            if segment["path_file_encoded"] is not None:
+                continue
+            path_file_chunk = Path(segment["path_file_chunk"])
+            future = executor.submit(
+                encode_segment,
+                path_file_chunk,
+                get_path_file_encoded(path_file_chunk),
+                flags_segment,
+                segment_progress.get_callback(segment["idx"]),
+            )
+            dict_future[future] = segment
+
+        # commit each segment as soon as it is encoded
+        for future in as_completed(dict_future):
+            segment = dict_future[future]
+            return_code = future.result()
+            if return_code != 0:
+                logging.error(
+                    "Segment encode failed: %s", segment["path_file_chunk"]
+                )
+                return_code_failed = return_code
+                continue
+            path_file_encoded = get_path_file_encoded(
+                Path(segment["path_file_chunk"])
+            )
+            segment["path_file_encoded"] = str(path_file_encoded)
+            if segment_checkpoint is not None:
+                segment_checkpoint.commit(
+                    segment["idx"],
+                    path_file_encoded,
+                    segment_progress.get_out_time_seconds(segment["idx"]),
+                )
+    if return_code_failed != 0:
+        return return_code_failed
+
+    return_code = concat_segments(
+        [Path(x["path_file_encoded"]) for x in list_segment],
+        path_file_origin,
+        path_file_dest,
+        type_conversion,
+        get_profile(flags),
+    )
+    if return_code == 0:
+        shutil.rmtree(folder_work, ignore_errors=True)
+    return return_code
@@ -1,11 +1,174 @@
 from __future__ import annotations
 
 import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Union
 
 import natsort
 import unidecode
 
+# threads listing folders, or stating files of folders that can't be listed
+STAT_WORKERS = 16
+# paths from this length can't be reached on Windows without the long path
+# support, but os.DirEntry.is_dir and os.DirEntry.stat do not fail on them
+MAX_PATH = 260
+
+
+def get_natural_sort_key(path: Path) -> str:
+    return unidecode.unidecode(
+        str(path).encode("utf-8", errors="ignore").decode().lower()
+    )
+
+
+class TreeEntry:
+    """File or folder found by scan_tree, with its cached stat result.
+    stat is None for folders."""
+
+    __slots__ = ("path", "is_dir", "stat")
+
+    def __init__(self, path: Path, is_dir: bool, stat=None):
+        self.path = path
+        self.is_dir = is_dir
+        self.stat = stat
+
+
+class TreeSnapshot:
+    """Recursive listing of a folder taken with a single os.scandir walk.
+
+    Shared by the path length check, the UTF-8 name sanitizer, the video
+    selection and the probe cache fingerprint, so the tree is walked and
+    each file is stat'ed only once per run.
+    """
+
+    def __init__(self, root: Path, sort: bool = True):
+        self.root = Path(root)
+        self.sort = sort
+        self.files: list[TreeEntry] = []
+        self.dirs: list[TreeEntry] = []
+        self.errors: list[Path] = []
+        self._dict_file: dict[str, TreeEntry] = {}
+
+    def refresh(self) -> TreeSnapshot:
+        """Walks the tree again, in place. Needed after files or folders
+        were renamed or moved.
+
+        Returns:
+            TreeSnapshot: self
+        """
+
+        if not self.root.exists():
+            logging.error("Folder not exists: %s", self.root)
+            raise FileNotFoundError(f"Folder not exists: {self.root}")
+
+        files: list[TreeEntry] = []
+        dirs: list[TreeEntry] = []
+        errors: list[Path] = []
+        stack = [str(self.root)]
+        while stack:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as it:
+                    list_dir_entry = list(it)
+            except OSError as e:
+                logging.error("path_too_long: %s\n%s", folder, e)
+                errors.append(Path(folder))
+                continue
+            for dir_entry in list_dir_entry:
+                if len(dir_entry.path) >= MAX_PATH and not os.path.exists(
+                    dir_entry.path
+                ):
+                    logging.error("path_too_long: %s", dir_entry.path)
+                    errors.append(Path(dir_entry.path))
+                    continue
+                try:
+                    if dir_entry.is_dir():
+                        dirs.append(TreeEntry(Path(dir_entry.path), True))
+                        stack.append(dir_entry.path)
+                    else:
+                        files.append(
+                            TreeEntry(
+                                Path(dir_entry.path), False, dir_entry.stat()
+                            )
+                        )
+                except OSError:
+                    logging.error("path_too_long: %s", dir_entry.path)
+                    errors.append(Path(dir_entry.path))
+
+        if self.sort:
+            files = natsort.natsorted(
+                files, lambda x: get_natural_sort_key(x.path)
+            )
+            dirs = natsort.natsorted(
+                dirs, lambda x: get_natural_sort_key(x.path)
+            )
+            errors = natsort.natsorted(errors, get_natural_sort_key)
+
+        self._set_entries(files, dirs, errors)
+        return self
+
+    def _set_entries(
+        self,
+        files: list[TreeEntry],
+        dirs: list[TreeEntry],
+        errors: list[Path],
+    ) -> None:
+        self.files = files
+        self.dirs = dirs
+        self.errors = errors
+        self._dict_file = {str(x.path): x for x in files}
+
+    def get_file_paths(self) -> list[Path]:
+        return [x.path for x in self.files]
+
+    def get_stat(self, path_file: Path):
+        """Returns the cached stat result of a file, or None if the file is
+        not in the snapshot."""
+
+        entry = self._dict_file.get(str(path_file))
+        if entry is None:
+            return None
+        return entry.stat
+
+    def subtree(self, folder_path: Path) -> TreeSnapshot:
+        """Returns the snapshot of an inner folder, without a new walk.
+
+        Args:
+            folder_path (Path): folder inside root
+
+        Returns:
+            TreeSnapshot: snapshot rooted at folder_path
+        """
+
+        prefix = str(folder_path) + os.sep
+        snapshot = TreeSnapshot(folder_path, sort=self.sort)
+        snapshot._set_entries(
+            [x for x in self.files if str(x.path).startswith(prefix)],
+            [x for x in self.dirs if str(x.path).startswith(prefix)],
+            [x for x in self.errors if str(x).startswith(prefix)],
+        )
+        return snapshot
+
+
+def scan_tree(folder_path: Path, sort: bool = True) -> TreeSnapshot:
+    """Walks a folder recursively with os.scandir, caching the stat result
+    of each file.
+
+    Args:
+        folder_path (Path): folder path
+        sort (bool, optional): Classify entries naturally. Defaults to True.
+
+    Raises:
+        FileNotFoundError: folder_path not exists
+
+    Returns:
+        TreeSnapshot: tree snapshot
+    """
+
+    return TreeSnapshot(folder_path, sort=sort).refresh()
+
 
 def get_all_file_path(folder_path: Path, sort=True) -> dict[str, list[Path]]:
     """Returns List of all file paths inside a folder, recursively.
@@ -21,41 +184,105 @@ def get_all_file_path(folder_path: Path, sort=True) -> dict[str, list[Path]]:
         dict[str, list[Path]]: keys: ['content', 'errors']. values: list[Path]
     """
 
-    def iter_folder(
-        sub_folder,
-        list_file_path: list[Path] = [],
-        list_error: list[Path] = [],
-    ) -> tuple[list[Path], list[Path]]:
+    snapshot = scan_tree(folder_path, sort=sort)
+    return {"content": snapshot.get_file_paths(), "errors": snapshot.errors}
 
-        for x in sub_folder.iterdir():
-            if not x.exists():
-                logging.error("path_too_long: %s", x)
-                list_error.append(x)
-                continue
-            if x.is_dir():
-                iter_folder(x, list_file_path, list_error)
-            else:
-                list_file_path.append(x)
-        return list_file_path, list_error
-
-    if not folder_path.exists():
-        logging.error("Folder not exists: %s", folder_path)
-        raise FileNotFoundError(f"Folder not exists: {folder_path}")
-
-    list_file_path, list_error = iter_folder(folder_path)
-
-    if sort:
-        list_file_path = natsort.natsorted(
-            list_file_path,
-            lambda x: unidecode.unidecode(
-                str(x).encode("utf-8", errors="ignore").decode().lower()
-            ),
-        )
-        list_error = natsort.natsorted(
-            list_error,
-            lambda x: unidecode.unidecode(
-                str(x).encode("utf-8", errors="ignore").decode().lower()
+
+def normcase_name(name: str) -> str:
+    """Returns the file name as compared by the file system: case
+    insensitive on Windows"""
+
+    if sys.platform == "win32":
+        return name.lower()
+    return name
+
+
+def stat_or_none(path_file: str) -> Union[os.stat_result, None]:
+    try:
+        return os.stat(path_file)
+    except OSError:
+        return None
+
+
+def stat_folder(
+    folder: str, list_name: list[str]
+) -> Union[dict[str, Union[os.stat_result, None]], None]:
+    """Stats files of a folder with a single os.scandir listing.
+
+    Args:
+        folder (str): folder path
+        list_name (list[str]): names of the files
+
+    Returns:
+        Union[dict[str, Union[os.stat_result, None]], None]: {name: stat
+            result, None if the file does not exist}. None if the folder
+            exists but can't be listed.
+    """
+
+    dict_wanted = {normcase_name(x): x for x in list_name}
+    dict_stat = dict.fromkeys(list_name)
+    try:
+        with os.scandir(folder) as it:
+            for dir_entry in it:
+                name = dict_wanted.get(normcase_name(dir_entry.name))
+                if name is None:
+                    continue
+                try:
+                    # free on Windows, where the listing has the stat
+                    dict_stat[name] = dir_entry.stat()
+                except OSError:
+                    dict_stat[name] = None
+    except (FileNotFoundError, NotADirectoryError):
+        # none of the files exists
+        return dict_stat
+    except OSError as e:
+        logging.debug("Folder not listed: %s\n%s", folder, e)
+        return None
+    return dict_stat
+
+
+def stat_files(
+    list_path_file: list, workers: int = STAT_WORKERS
+) -> dict[str, Union[os.stat_result, None]]:
+    """Stats many files, listing each of their folders once instead of a
+    stat round-trip per file, which is slow on network shares. Folders are
+    listed in parallel, and the files of folders that can't be listed are
+    stated in parallel.
+
+    Args:
+        list_path_file (list): file paths, str or Path
+        workers (int, optional): threads. Defaults to STAT_WORKERS.
+
+    Returns:
+        dict[str, Union[os.stat_result, None]]: {str(path_file): stat
+            result, None if the file does not exist}
+    """
+
+    # folder: {name: path as given}
+    dict_folder: dict[str, dict[str, str]] = {}
+    for path_file in {str(x) for x in list_path_file}:
+        folder, name = os.path.split(path_file)
+        dict_folder.setdefault(folder or os.curdir, {})[name] = path_file
+
+    dict_stat = {}
+    list_path_unlisted = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list_folder = list(dict_folder)
+        for folder, dict_stat_folder in zip(
+            list_folder,
+            executor.map(
+                lambda x: stat_folder(x, list(dict_folder[x])), list_folder
             ),
+        ):
+            if dict_stat_folder is None:
+                list_path_unlisted += list(dict_folder[folder].values())
+                continue
+            for name, stat_result in dict_stat_folder.items():
+                dict_stat[dict_folder[folder][name]] = stat_result
+        dict_stat.update(
+            zip(
+                list_path_unlisted,
+                executor.map(stat_or_none, list_path_unlisted),
+            )
         )
-
-    return {"content": list_file_path, "errors": list_error}
+    return dict_stat
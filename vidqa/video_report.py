@@ -1,12 +1,74 @@
 from __future__ import annotations
 
+import gzip
+import json
 import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import timedelta
+from operator import attrgetter
 from pathlib import Path
+from typing import Iterator, Union
 
+import numpy as np
 import pandas as pd
 
-from .ffprobe_micro import ffprobe
+from . import conversion_policy, native_probe
+from .ffprobe_micro import FFProbeResult, ffprobe
+from .probe_cache import (
+    FAST_SUFFIX,
+    PROBE_MODE_FULL,
+    PROBE_MODE_LEAN,
+    PROBE_MODE_NATIVE,
+    ProbeCache,
+    get_fingerprint,
+)
+from .utils import TreeSnapshot
+
+
+# ffprobe -show_entries of the lean probe: only what format_video_metadata
+# reads
+PROBE_ENTRIES = (
+    "format=filename,duration,bit_rate,format_name,size"
+    ":stream=codec_type,codec_name,profile,width,height,bit_rate,is_avc,"
+    "channels"
+)
+
+# ffprobe errors worth a retry: the file may read fine a moment later
+TRANSIENT_ERRORS = (
+    "Input/output error",
+    "Resource temporarily unavailable",
+    "Stale file handle",
+    "Connection timed out",
+    "Connection reset",
+)
+# seconds before the first retry of a probe, doubled on each retry
+RETRY_BACKOFF = 1.0
+
+# columns of the report built by get_report_dataframe, before
+# type_conversion
+REPORT_COLUMNS = [
+    "duration",
+    "duration_seconds",
+    "file_size",
+    "file_mtime_ns",
+    "format_name",
+    "total_bitrate",
+    "video_bitrate",
+    "video_codec",
+    "audio_codec",
+    "audio_channels",
+    "is_avc",
+    "video_profile",
+    "video_resolution_height",
+    "video_resolution_width",
+    "path_file",
+    "file_path_folder",
+    "file_name",
+]
 
 
 def get_video_codec(stream_video: dict) -> str:
@@ -47,10 +109,10 @@ def get_video_bitrate(dict_inf: dict, stream_video: dict) -> int:
 
     try:
         video_bitrate = stream_video["bit_rate"]
-    except Exception as e:
+    except Exception:
         try:
             video_bitrate = dict_inf["format"]["bit_rate"]
-        except Exception as e:
+        except Exception:
             video_bitrate = 0
 
     return int(video_bitrate)
@@ -63,7 +125,7 @@ def get_is_avc(stream_video: dict) -> int:
             is_avc = 1
         else:
             is_avc = 0
-    except Exception as e:
+    except Exception:
         is_avc = 0
     return is_avc
 
@@ -132,25 +194,449 @@ def get_duration_ffprobe(dict_inf: dict) -> dict:
     return d
 
 
-def get_inf_ffprobe(list_path_file: list[Path]) -> dict:
+def classify_metadata(file_selected: Path, dict_inf_ffprobe: dict) -> dict:
+    """Classifies ffprobe metadata of a video file as valid or corrupt.
+
+    Args:
+        file_selected (Path): video file path
+        dict_inf_ffprobe (dict): ffprobe metadata
+
+    Returns:
+        dict: keys: ['path_file', 'metadata', 'corrupt', 'fallback',
+              'timeout']. 'metadata' is None when ffprobe returned no
+              metadata at all. 'fallback' and 'timeout' are set by
+              probe_file.
+    """
+
+    d = {
+        "path_file": str(file_selected),
+        "metadata": None,
+        "corrupt": False,
+        "fallback": False,
+        "timeout": False,
+    }
+
+    # corrupted for lack of metadata
+    if len(dict_inf_ffprobe) == 0:
+        logging.error(
+            "File likely corrupted-No metadata:\n" + "_" * 25 + "%s\n",
+            file_selected,
+        )
+        d["corrupt"] = True
+        return d
+
+    d["metadata"] = dict_inf_ffprobe
+
+    # corrupt by lack of format-filename metadata
+    try:
+        _ = dict_inf_ffprobe["format"]["filename"]
+    except Exception:
+        d["corrupt"] = True
+        return d
+
+    # corrupt by lack of duration metadata
+    try:
+        _ = dict_inf_ffprobe["format"]["duration"]
+    except Exception as e:
+        logging.error(
+            "%s\nVideo without format-filename metadata:\n%s",
+            e,
+            dict_inf_ffprobe,
+        )
+        d["corrupt"] = True
+    return d
+
+
+def get_probe_mode(flags: dict) -> str:
+    """Returns the probe mode of the flags: 'full' if flags['probe_full'] is
+    1, otherwise 'lean'"""
+
+    if flags.get("probe_full", 0) == 1:
+        return PROBE_MODE_FULL
+    return PROBE_MODE_LEAN
+
+
+def get_native(flags: dict) -> bool:
+    """Returns True if flags['probe_native'] is 1"""
+
+    return flags.get("probe_native", 0) == 1
+
+
+def get_fast_probe(flags: dict) -> Union[dict, None]:
+    """Returns the fast probe limits of the flags, or None if
+    flags['probe_fast'] is not 1.
+
+    Returns:
+        Union[dict, None]: keys: ['probesize' (bytes),
+            'analyzeduration' (microseconds)]
+    """
+
+    if flags.get("probe_fast", 0) != 1:
+        return None
+    return {
+        "probesize": int(flags.get("probe_fast_size", 1000000)),
+        "analyzeduration": int(flags.get("probe_fast_duration", 1000000)),
+    }
+
+
+def get_probe_policy(flags: dict) -> dict:
+    """Returns the timeout and retry policy of ffprobe runs.
+
+    Returns:
+        dict: keys: ['timeout' (seconds, None for no limit, from
+            flags['probe_timeout']), 'retries' (retries on transient I/O
+            errors, from flags['probe_retries'])]
+    """
+
+    timeout = float(flags.get("probe_timeout", 0))
+    return {
+        "timeout": timeout if timeout > 0 else None,
+        "retries": max(0, int(flags.get("probe_retries", 0))),
+    }
+
+
+def is_transient_error(result: FFProbeResult) -> bool:
+    """Checks if a failed ffprobe run reported an error that may not happen
+    again, like an I/O error of a network mount."""
+
+    if result.return_code == 0 or result.timed_out:
+        return False
+    return any(x in (result.error or "") for x in TRANSIENT_ERRORS)
+
+
+def run_ffprobe(
+    file_selected: Path, policy: Union[dict, None] = None, **kwargs
+) -> FFProbeResult:
+    """Runs ffprobe with the timeout of the policy, retrying with
+    exponential backoff while it fails with a transient error.
+
+    Args:
+        file_selected (Path): video file path
+        policy (dict, optional): see get_probe_policy. Defaults to None,
+            no timeout and no retry.
+        **kwargs: arguments of ffprobe_micro.ffprobe
+
+    Returns:
+        FFProbeResult: result of the last run
+    """
+
+    if policy is None:
+        policy = {"timeout": None, "retries": 0}
+    attempt = 0
+    while True:
+        result = ffprobe(file_selected, timeout=policy["timeout"], **kwargs)
+        if attempt >= policy["retries"] or not is_transient_error(result):
+            return result
+        delay = RETRY_BACKOFF * 2**attempt
+        attempt += 1
+        logging.warning(
+            "ffprobe transient error, retry %s/%s in %ss: %s\n%s",
+            attempt,
+            policy["retries"],
+            delay,
+            file_selected,
+            result.error.strip(),
+        )
+        time.sleep(delay)
+
+
+def get_missing_fields(dict_inf_ffprobe: dict) -> list[str]:
+    """Returns the fields required by the report that are missing from
+    ffprobe metadata: duration, video codec, dimensions and bit_rate.
+
+    Args:
+        dict_inf_ffprobe (dict): ffprobe metadata
+
+    Returns:
+        list[str]: missing fields. Empty if complete.
+    """
+
+    list_missing = []
+    dict_format = dict_inf_ffprobe.get("format", {})
+    if "duration" not in dict_format:
+        list_missing.append("duration")
+    stream_video = None
+    for stream in dict_inf_ffprobe.get("streams", []):
+        if stream.get("codec_type") == "video":
+            stream_video = stream
+            break
+    if stream_video is None:
+        list_missing.append("video stream")
+        return list_missing
+    for key in ("codec_name", "width", "height"):
+        if key not in stream_video:
+            list_missing.append(key)
+    if "bit_rate" not in stream_video and "bit_rate" not in dict_format:
+        list_missing.append("bit_rate")
+    return list_missing
+
+
+def probe_file(
+    file_selected: Path,
+    probe_mode: str = PROBE_MODE_LEAN,
+    fast_probe: Union[dict, None] = None,
+    native: bool = False,
+    policy: Union[dict, None] = None,
+) -> dict:
+    """Runs ffprobe on a single video file and classifies the result.
+
+    Args:
+        file_selected (Path): video file path
+        probe_mode (str, optional): 'lean' asks ffprobe only for the
+            entries of the report (PROBE_ENTRIES). 'full' for programs,
+            format and streams in full. Defaults to 'lean'.
+        fast_probe (dict, optional): -probesize and -analyzeduration limits
+            of a first probe, see get_fast_probe. If required fields come
+            back missing, the file is probed again with the default
+            limits and the result has 'fallback' True. Defaults to None.
+        native (bool, optional): in the lean mode, read the headers with
+            a native parser first (see native_probe) and only run ffprobe
+            if it can't decide. Defaults to False.
+        policy (dict, optional): timeout and retries of ffprobe, see
+            get_probe_policy. A file that times out has 'timeout' True and
+            no metadata. Defaults to None, no timeout and no retry.
+
+    Returns:
+        dict: see classify_metadata. Also 'probe_mode', the probe mode of
+            the metadata in the probe cache: 'native' if read by a native
+            parser, '{probe_mode}_fast' if read by the fast probe.
+    """
+
+    if native and probe_mode == PROBE_MODE_LEAN:
+        dict_inf_ffprobe = native_probe.probe_native(file_selected)
+        if (
+            dict_inf_ffprobe is not None
+            and len(get_missing_fields(dict_inf_ffprobe)) == 0
+        ):
+            logging.info("native probe: %s", file_selected)
+            result = classify_metadata(file_selected, dict_inf_ffprobe)
+            result["probe_mode"] = PROBE_MODE_NATIVE
+            return result
+
+    logging.info("run ffprobe: %s", file_selected)
+    show_entries = None if probe_mode == PROBE_MODE_FULL else PROBE_ENTRIES
+    if fast_probe is not None:
+        result_ffprobe = run_ffprobe(
+            file_selected,
+            policy,
+            show_entries=show_entries,
+            probesize=fast_probe["probesize"],
+            analyzeduration=fast_probe["analyzeduration"],
+        )
+        if result_ffprobe.timed_out:
+            return get_timeout_result(file_selected)
+        dict_inf_ffprobe = result_ffprobe.get_output_as_dict()
+        list_missing = get_missing_fields(dict_inf_ffprobe)
+        if len(list_missing) == 0:
+            result = classify_metadata(file_selected, dict_inf_ffprobe)
+            result["probe_mode"] = probe_mode + FAST_SUFFIX
+            return result
+        logging.info(
+            "fast ffprobe missing %s, probe again: %s",
+            ", ".join(list_missing),
+            file_selected,
+        )
+    # generate raw metadata
+    result_ffprobe = run_ffprobe(
+        file_selected, policy, show_entries=show_entries
+    )
+    if result_ffprobe.timed_out:
+        return get_timeout_result(file_selected)
+    dict_inf_ffprobe = result_ffprobe.get_output_as_dict()
+    result = classify_metadata(file_selected, dict_inf_ffprobe)
+    result["fallback"] = fast_probe is not None
+    result["probe_mode"] = probe_mode
+    return result
+
+
+def get_timeout_result(file_selected: Path) -> dict:
+    """Returns the probe result of a file whose ffprobe timed out"""
+
+    d = classify_metadata(file_selected, {})
+    d["corrupt"] = False
+    d["timeout"] = True
+    return d
+
+
+def save_list_path(
+    list_path_file: list[Path], path_file_report: Path, suffix: str
+) -> Union[Path, None]:
+    """Saves a list of files to {report_stem}_{suffix}.csv, next to the
+    report. Nothing is saved when the list is empty.
+
+    Args:
+        list_path_file (list[Path]): files to save
+        path_file_report (Path): report path. csv.
+        suffix (str): suffix of the csv name
+
+    Returns:
+        Union[Path, None]: csv path. None if nothing was saved.
+    """
+
+    if len(list_path_file) == 0:
+        return None
+    path_file_report = Path(path_file_report)
+    path_file_list = path_file_report.parent / (
+        f"{path_file_report.stem}_{suffix}.csv"
+    )
+    df = pd.DataFrame({"path_file": [str(x) for x in list_path_file]})
+    df.to_csv(path_file_list, index=False, encoding="utf-8")
+    return path_file_list
+
+
+def save_fallback_report(
+    list_path_fallback: list[Path], path_file_report: Path
+) -> None:
+    """Saves the files that needed a fallback from the fast probe to
+    {report_stem}_fallback.csv, next to the report. Nothing is saved when
+    the list is empty.
+
+    Args:
+        list_path_fallback (list[Path]): files probed again
+        path_file_report (Path): report path. csv.
+    """
+
+    path_file_fallback = save_list_path(
+        list_path_fallback, path_file_report, "fallback"
+    )
+    if path_file_fallback is not None:
+        logging.info(
+            "%s files needed a full probe: %s",
+            len(list_path_fallback),
+            path_file_fallback,
+        )
+
+
+def save_timeout_report(
+    list_path_timeout: list[Path], path_file_report: Path
+) -> None:
+    """Saves the files whose ffprobe timed out to
+    {report_stem}_timeout.csv, next to the report. Nothing is saved when
+    the list is empty.
+
+    Args:
+        list_path_timeout (list[Path]): files that timed out
+        path_file_report (Path): report path. csv.
+    """
+
+    path_file_timeout = save_list_path(
+        list_path_timeout, path_file_report, "timeout"
+    )
+    if path_file_timeout is not None:
+        logging.warning(
+            "%s files timed out in ffprobe and are not in the report: %s",
+            len(list_path_timeout),
+            path_file_timeout,
+        )
+
+
+def probe_file_cached(
+    file_selected: Path,
+    cache: Union[ProbeCache, None] = None,
+    stat_result: Union[os.stat_result, None] = None,
+    probe_mode: str = PROBE_MODE_LEAN,
+    fast_probe: Union[dict, None] = None,
+    native: bool = False,
+    policy: Union[dict, None] = None,
+) -> dict:
+    """Probes a single video file through the probe cache. The metadata of
+    a probed file is stored with the next batch of cache entries, see
+    ProbeCache.add.
+
+    Args:
+        file_selected (Path): video file path
+        cache (ProbeCache, optional): Persistent probe cache.
+            Defaults to None.
+        stat_result (os.stat_result, optional): stat of the file, to
+            fingerprint it without a new filesystem call. Defaults to None.
+        probe_mode (str, optional): 'lean' or 'full', see probe_file.
+            Defaults to 'lean'.
+        fast_probe (dict, optional): see probe_file. Defaults to None.
+        native (bool, optional): see probe_file. Defaults to False.
+        policy (dict, optional): see probe_file. Defaults to None.
+
+    Returns:
+        dict: see classify_metadata
+    """
+
+    if cache is None:
+        return probe_file(
+            file_selected, probe_mode, fast_probe, native, policy
+        )
+    try:
+        fingerprint = get_fingerprint(file_selected, stat_result)
+    except OSError as e:
+        logging.error("Can't stat file: %s\n%s", file_selected, e)
+        return probe_file(
+            file_selected, probe_mode, fast_probe, native, policy
+        )
+    dict_inf_ffprobe = cache.get(
+        fingerprint, probe_mode, native, fast_probe is not None
+    )
+    if dict_inf_ffprobe is not None:
+        logging.info("cached ffprobe: %s", file_selected)
+        return classify_metadata(file_selected, dict_inf_ffprobe)
+    result = probe_file(file_selected, probe_mode, fast_probe, native, policy)
+    if result["metadata"] is not None:
+        cache.add(fingerprint, result["metadata"], result["probe_mode"])
+    return result
+
+
+def get_inf_ffprobe(
+    list_path_file: list[Path],
+    workers: int = 1,
+    cache: Union[ProbeCache, None] = None,
+    snapshot: Union[TreeSnapshot, None] = None,
+    probe_mode: str = PROBE_MODE_LEAN,
+    fast_probe: Union[dict, None] = None,
+    native: bool = False,
+    policy: Union[dict, None] = None,
+    metadata_writer: Union[MetadataWriter, None] = None,
+) -> dict:
     """
     Extracts FFprobe metadata for a list of video files.
 
     Args:
-        list_path_file (list[Path]): A list of file paths for which FFprobe metadata
-        needs to be extracted.
+        list_path_file (list[Path]): A list of file paths for which FFprobe
+        metadata needs to be extracted.
+        workers (int, optional): Maximum number of ffprobe processes running
+            at the same time. Defaults to 1.
+        cache (ProbeCache, optional): Persistent probe cache. Only files
+            missing from the cache, or changed since they were cached, are
+            probed. Defaults to None.
+        snapshot (TreeSnapshot, optional): Tree snapshot holding the
+            stat results of the files, to fingerprint them without new
+            filesystem calls. Defaults to None.
+        probe_mode (str, optional): 'lean' or 'full', see probe_file.
+            Defaults to 'lean'.
+        fast_probe (dict, optional): fast probe limits, see probe_file.
+            Defaults to None.
+        native (bool, optional): try the native header parsers before
+            ffprobe, see probe_file. Defaults to False.
+        policy (dict, optional): timeout and retries of ffprobe, see
+            get_probe_policy. Defaults to None.
+        metadata_writer (MetadataWriter, optional): receives the raw
+            metadata of each file as soon as it is probed, in completion
+            order, see iter_metadata_dump. The raw metadata is not kept in
+            memory. Defaults to None, not saved.
 
     Returns:
-        dict: A dictionary containing two keys - 'metadata' and 'corrupt'.
-              - 'metadata': A list of dictionaries, each containing 'path_file'
-                (file path) and 'metadata' (video metadata).
+        dict: A dictionary containing four keys - 'records', 'corrupt',
+              'fallback' and 'timeout'.
+              - 'records': A list of ProbeRecord, the report fields of the
+                files with a duration and a video stream.
               - 'corrupt': A list of file paths for likely corrupted or
                 unsupported video files.
+              - 'fallback': A list of file paths probed again because the
+                fast probe missed required fields.
+              - 'timeout': A list of file paths whose ffprobe was killed
+                after the policy timeout. They are not in 'metadata' and
+                not in 'corrupt'.
 
     Example:
         list_path_file = ["path/to/video1.mp4", "path/to/video2.avi"]
-        result = get_list_dict_inf_ffprobe(list_path_file)
-        metadata_list = result['metadata']
+        result = get_inf_ffprobe(list_path_file)
+        list_record = result['records']
         corrupt_files = result['corrupt']
 
     Note:
@@ -158,52 +644,74 @@ def get_inf_ffprobe(list_path_file: list[Path]) -> dict:
           - If FFprobe fails to extract metadata for a file or
           - If metadata does not contain format-filename key or
           - If metadata does not contain format-duration key.
+        - Probes run concurrently when workers > 1, but all lists keep the
+          order of list_path_file.
     """
 
-    list_path_corrupt = []
-    list_dict = []
-    for file_selected in list_path_file:
-        d = {}
-        d["path_file"] = str(file_selected)
-        logging.info("run ffprobe: %s", file_selected)
-        # generate raw metadata
-        dict_inf_ffprobe = ffprobe(file_selected).get_output_as_dict()
-
-        # corrupted for lack of metadata
-        if len(dict_inf_ffprobe) == 0:
-            logging.error(
-                "File likely corrupted-No metadata:\n" + "_" * 25 + "%s\n",
-                file_selected,
+    list_record = [None] * len(list_path_file)
+    set_index_corrupt = set()
+    set_index_fallback = set()
+    set_index_timeout = set()
+
+    def consume(index: int, result: dict) -> None:
+        # keep only the record and the categories of the file
+        if result["metadata"] is not None:
+            if metadata_writer is not None:
+                metadata_writer.write(result["path_file"], result["metadata"])
+            stat_result = None
+            if snapshot is not None:
+                stat_result = snapshot.get_stat(list_path_file[index])
+            list_record[index] = ProbeRecord.from_metadata(
+                result["path_file"], result["metadata"], stat_result
             )
-            list_path_corrupt.append(file_selected)
-            continue
+        if result["corrupt"]:
+            set_index_corrupt.add(index)
+        if result["fallback"]:
+            set_index_fallback.add(index)
+        if result["timeout"]:
+            set_index_timeout.add(index)
+
+    def probe(file_selected: Path) -> dict:
+        stat_result = None
+        if snapshot is not None:
+            stat_result = snapshot.get_stat(file_selected)
+        return probe_file_cached(
+            file_selected,
+            cache,
+            stat_result,
+            probe_mode,
+            fast_probe,
+            native,
+            policy,
+        )
 
-        # corrupt by lack of format-filename metadata
-        try:
-            _ = dict_inf_ffprobe["format"]["filename"]
-        except Exception as e:
-            d["metadata"] = dict_inf_ffprobe
-            list_dict.append(d)
-            list_path_corrupt.append(file_selected)
-            continue
-
-        # corrupt by lack of duration metadata
-        try:
-            _ = dict_inf_ffprobe["format"]["duration"]
-        except Exception as e:
-            logging.error(
-                "%s\nVideo without format-filename metadata:\n%s",
-                e,
-                dict_inf_ffprobe,
+    workers = max(1, int(workers))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if workers == 1 or len(list_path_file) <= 1:
+            iterator_result = enumerate(map(probe, list_path_file))
+        else:
+            logging.info("Run ffprobe with %s workers", workers)
+            dict_future = {
+                executor.submit(probe, file_selected): index
+                for index, file_selected in enumerate(list_path_file)
+            }
+            # a slow file does not hold back the files probed after it
+            iterator_result = (
+                (dict_future.pop(x), x.result())
+                for x in as_completed(dict_future)
             )
-            d["metadata"] = dict_inf_ffprobe
-            list_dict.append(d)
-            list_path_corrupt.append(file_selected)
-            continue
+        for index, result in iterator_result:
+            consume(index, result)
+
+    if cache is not None:
+        cache.evict()
 
-        d["metadata"] = dict_inf_ffprobe
-        list_dict.append(d)
-    return {"metadata": list_dict, "corrupt": list_path_corrupt}
+    return {
+        "records": [x for x in list_record if x is not None],
+        "corrupt": [list_path_file[x] for x in sorted(set_index_corrupt)],
+        "fallback": [list_path_file[x] for x in sorted(set_index_fallback)],
+        "timeout": [list_path_file[x] for x in sorted(set_index_timeout)],
+    }
 
 
 def get_total_bitrate(dict_inf: dict) -> int:
@@ -232,99 +740,350 @@ def get_total_bitrate(dict_inf: dict) -> int:
     return total_bitrate
 
 
-def format_video_metadata(list_dict_inf_ffprobe: list[dict[str, str]]):
-    """Generates video metadata report
-
-    Args:
-        list_dict_inf_ffprobe (list[dict[str, str]]):
-            List of Dictionaries returned from FFProbe Metadata Analysis
-
-    Returns:
-        list[dict]: List of Dictionaries formatted
+class ProbeRecord:
+    """Report fields of a probed video, extracted once from its ffprobe
+    metadata, so the metadata itself does not have to be kept.
+
+    Attributes:
+        path_file (str): video file path
+        duration_seconds (float): duration
+        format_name (str): ffprobe format name
+        total_bitrate (int): bitrate of the file
+        video_bitrate (int): bitrate of the first video stream
+        video_codec (str): codec of the first video stream
+        video_profile (str): profile of the first video stream
+        video_resolution_height (int): height of the first video stream
+        video_resolution_width (int): width of the first video stream
+        is_avc (int): 1 if the first video stream is avc, otherwise 0
+        audio_codec (str): codec of the first audio stream, '' if none
+        audio_channels (int): channels of the first audio stream
+        file_size (int): bytes of the file, None if unknown
+        file_mtime_ns (int): modification time of the file, None if
+            unknown
     """
 
-    list_dict = []
-    for dict_file in list_dict_inf_ffprobe:
-        path_file = dict_file["path_file"]
-        logging.info("parsing: %s", path_file)
-        dict_inf_ffprobe = dict_file["metadata"]
-        # parse data
+    __slots__ = (
+        "path_file",
+        "duration_seconds",
+        "format_name",
+        "total_bitrate",
+        "video_bitrate",
+        "video_codec",
+        "video_profile",
+        "video_resolution_height",
+        "video_resolution_width",
+        "is_avc",
+        "audio_codec",
+        "audio_channels",
+        "file_size",
+        "file_mtime_ns",
+    )
+
+    def __init__(
+        self,
+        path_file: str,
+        duration_seconds: float,
+        format_name: str,
+        total_bitrate: int,
+        video_bitrate: int,
+        video_codec: str,
+        video_profile: str,
+        video_resolution_height: int,
+        video_resolution_width: int,
+        is_avc: int,
+        audio_codec: str,
+        audio_channels: int,
+        file_size: Union[int, None] = None,
+        file_mtime_ns: Union[int, None] = None,
+    ):
+        self.path_file = path_file
+        self.duration_seconds = duration_seconds
+        # few distinct values repeated in every record
+        self.format_name = sys.intern(format_name)
+        self.total_bitrate = total_bitrate
+        self.video_bitrate = video_bitrate
+        self.video_codec = sys.intern(video_codec)
+        self.video_profile = sys.intern(video_profile)
+        self.video_resolution_height = video_resolution_height
+        self.video_resolution_width = video_resolution_width
+        self.is_avc = is_avc
+        self.audio_codec = sys.intern(audio_codec)
+        self.audio_channels = audio_channels
+        self.file_size = file_size
+        self.file_mtime_ns = file_mtime_ns
+
+    @classmethod
+    def from_metadata(
+        cls,
+        path_file: str,
+        dict_inf_ffprobe: dict,
+        stat_result: Union[os.stat_result, None] = None,
+    ) -> Union[ProbeRecord, None]:
+        """Extracts the report fields of ffprobe metadata, in a single pass
+        over its streams.
+
+        Args:
+            path_file (str): video file path
+            dict_inf_ffprobe (dict): ffprobe metadata
+            stat_result (os.stat_result, optional): stat of the file, from
+                the tree snapshot. Without it, file_size comes from the
+                ffprobe format size and file_mtime_ns is unknown.
+                Defaults to None.
+
+        Returns:
+            Union[ProbeRecord, None]: None if the metadata has no duration
+                or no video stream, files left out of the report.
+        """
+
+        logging.debug("parsing: %s", path_file)
         duration_dict = get_duration_ffprobe(dict_inf=dict_inf_ffprobe)
         if duration_dict is False:
             logging.error("!File seems corrupt.\n")
-            continue
-        duration = duration_dict["duration_str"]
-        duration_seconds = duration_dict["duration_seconds"]
-        total_bitrate = get_total_bitrate(dict_inf_ffprobe)
-        format_name = dict_inf_ffprobe["format"]["format_name"]
+            return None
 
-        is_video = False
+        stream_video = None
+        stream_audio = None
         for stream in dict_inf_ffprobe["streams"]:
-            if stream["codec_type"] == "video":
+            if stream_video is None and stream["codec_type"] == "video":
                 stream_video = stream
-                is_video = True
-                break
-
-        if is_video:
-            video_codec = get_video_codec(stream_video)
-            video_profile = get_video_profile(stream_video)
-            video_resolution_height = get_video_resolution_height(stream_video)
-            video_resolution_width = get_video_resolution_width(stream_video)
-            video_bitrate = get_video_bitrate(dict_inf_ffprobe, stream_video)
-            is_avc = get_is_avc(stream_video)
-        else:
+            elif stream_audio is None and stream["codec_type"] == "audio":
+                stream_audio = stream
+        if stream_video is None:
             logging.error(
                 "File above don't have tag 'video' in "
                 + f"detail file:\n{path_file}"
             )
-            continue
+            return None
 
-        has_audio = False
-        for stream in dict_inf_ffprobe["streams"]:
-            if stream["codec_type"] == "audio":
-                stream_audio = stream
-                has_audio = True
-                break
-
-        if has_audio is False:
+        if stream_audio is not None:
+            audio_codec = get_audio_codec(stream_audio)
+            audio_channels = get_audio_channels(stream_audio)
+        else:
             logging.info(
                 "File above don't have tag 'audio' in "
                 + f"detail file:\n{path_file}"
             )
-            has_audio = False
-
-        if has_audio:
-            audio_codec = get_audio_codec(stream_audio)
-            audio_channels = get_audio_channels(stream_audio)
-
-        else:
             audio_codec = ""
             audio_channels = 0
 
-        # generate dict
-        d = {}
-        d["duration"] = duration
-        d["duration_seconds"] = duration_seconds
-        d["file_size"] = Path(path_file).stat().st_size
-        d["format_name"] = format_name
-        d["total_bitrate"] = total_bitrate
-        d["video_bitrate"] = video_bitrate
-        d["video_codec"] = video_codec
-        d["audio_codec"] = audio_codec
-        d["audio_channels"] = audio_channels
-        d["is_avc"] = is_avc
-        d["video_profile"] = video_profile
-        d["video_resolution_height"] = video_resolution_height
-        d["video_resolution_width"] = video_resolution_width
-        d["path_file"] = path_file
-        d["file_path_folder"] = str(Path(path_file).parent)
-        d["file_name"] = Path(path_file).name
-        list_dict.append(d)
-
-    return list_dict
-
-
-def include_type_conversion(df: pd.DataFrame) -> pd.DataFrame:
+        if stat_result is not None:
+            file_size = stat_result.st_size
+            file_mtime_ns = stat_result.st_mtime_ns
+        else:
+            file_size = dict_inf_ffprobe["format"].get("size")
+            file_size = None if file_size is None else int(file_size)
+            file_mtime_ns = None
+
+        return cls(
+            path_file=str(path_file),
+            duration_seconds=duration_dict["duration_seconds"],
+            format_name=dict_inf_ffprobe["format"]["format_name"],
+            total_bitrate=get_total_bitrate(dict_inf_ffprobe),
+            video_bitrate=get_video_bitrate(dict_inf_ffprobe, stream_video),
+            video_codec=get_video_codec(stream_video),
+            video_profile=get_video_profile(stream_video),
+            video_resolution_height=get_video_resolution_height(stream_video),
+            video_resolution_width=get_video_resolution_width(stream_video),
+            is_avc=get_is_avc(stream_video),
+            audio_codec=audio_codec,
+            audio_channels=audio_channels,
+            file_size=file_size,
+            file_mtime_ns=file_mtime_ns,
+        )
+
+
+def open_metadata_dump(path_file: Path, mode: str):
+    """Opens a metadata dump as text, through gzip if its name ends with
+    .gz"""
+
+    if Path(path_file).suffix == ".gz":
+        return gzip.open(path_file, mode + "t", encoding="utf-8")
+    return open(path_file, mode, encoding="utf-8")
+
+
+class MetadataWriter:
+    """Streams the raw ffprobe metadata of probed files to a JSON Lines
+    dump, instead of holding it in memory: one {'path_file', 'metadata'}
+    object per line, flushed as each file is probed, so a crash loses at
+    most the line being written. The dump is gzip compressed if its name
+    ends with .gz.
+
+    Thread safe. Use as a context manager, or call close.
+
+    Example:
+        with MetadataWriter(path_file_dump) as metadata_writer:
+            metadata_writer.write(path_file, dict_inf_ffprobe)
+    """
+
+    def __init__(self, path_file: Path):
+        self.path_file = Path(path_file)
+        self._file = open_metadata_dump(self.path_file, "w")
+        self._lock = threading.Lock()
+
+    def write(self, path_file: str, dict_inf_ffprobe: dict) -> None:
+        """Appends the metadata of a file"""
+
+        line = json.dumps(
+            {"path_file": str(path_file), "metadata": dict_inf_ffprobe},
+            separators=(",", ":"),
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> MetadataWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def get_path_metadata_dump(
+    path_file_report: Path, compress: bool = False
+) -> Path:
+    """Returns the path of the metadata dump of a report:
+    {report_stem}_metadata.jsonl, or .jsonl.gz if compressed"""
+
+    path_file_report = Path(path_file_report)
+    suffix = ".jsonl.gz" if compress else ".jsonl"
+    return path_file_report.parent / (
+        path_file_report.stem + "_metadata" + suffix
+    )
+
+
+def iter_metadata_dump(path_file: Path) -> Iterator[dict]:
+    """Reads a metadata dump line by line.
+
+    A dump cut by a crash is read up to its last complete line.
+
+    Args:
+        path_file (Path): metadata dump. jsonl or jsonl.gz
+
+    Yields:
+        dict: keys: ['path_file', 'metadata']
+    """
+
+    with open_metadata_dump(path_file, "r") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    logging.warning("Incomplete last line in %s", path_file)
+                    return
+                yield json.loads(line)
+        except EOFError:
+            logging.warning("Incomplete gzip stream in %s", path_file)
+
+
+def rebuild_report(
+    path_file_dump: Path, path_file_report: Path
+) -> pd.DataFrame:
+    """Rebuilds the report csv from a metadata dump, without ffprobe. Only
+    the probe records are held in memory, not the dump.
+
+    Args:
+        path_file_dump (Path): metadata dump. jsonl or jsonl.gz
+        path_file_report (Path): report path to write. csv.
+
+    Returns:
+        pd.DataFrame: the report, with type_conversion
+    """
+
+    list_record = []
+    for dict_file in iter_metadata_dump(path_file_dump):
+        record = ProbeRecord.from_metadata(
+            dict_file["path_file"], dict_file["metadata"]
+        )
+        if record is not None:
+            list_record.append(record)
+    df = include_type_conversion(get_report_dataframe(list_record))
+    df.to_csv(path_file_report, index=False)
+    return df
+
+
+def get_duration_strings(array_seconds: np.ndarray) -> list[str]:
+    """Formats durations like float_seconds_to_string, for many at once"""
+
+    array_us = np.round(array_seconds * 1e6).astype(np.int64)
+    array_sec, array_us = np.divmod(array_us, 1000000)
+    # like timedelta.seconds, days are left out
+    array_hou, array_sec = np.divmod(array_sec % 86400, 3600)
+    array_min, array_sec = np.divmod(array_sec, 60)
+    return [
+        "%02d:%02d:%02d.%02d" % x
+        for x in zip(
+            array_hou.tolist(),
+            array_min.tolist(),
+            array_sec.tolist(),
+            (array_us // 10000).tolist(),
+        )
+    ]
+
+
+def get_report_dataframe(list_record: list[ProbeRecord]) -> pd.DataFrame:
+    """Builds the video metadata report of probe records, column by
+    column, without filesystem calls.
+
+    Args:
+        list_record (list[ProbeRecord]): probe records
+
+    Returns:
+        pd.DataFrame: report, without type_conversion. See
+            REPORT_COLUMNS.
+    """
+
+    def get_column(name: str) -> list:
+        return list(map(attrgetter(name), list_record))
+
+    list_path_file = get_column("path_file")
+    # report paths come from Path objects, joined with os.sep
+    list_folder_name = [x.rpartition(os.sep) for x in list_path_file]
+    array_duration_seconds = np.array(
+        get_column("duration_seconds"), dtype=float
+    )
+    dict_column = {
+        "duration": get_duration_strings(array_duration_seconds),
+        "duration_seconds": array_duration_seconds,
+        # object columns keep ints and None as they are, for json and sqlite
+        "file_size": pd.Series(get_column("file_size"), dtype=object),
+        "file_mtime_ns": pd.Series(get_column("file_mtime_ns"), dtype=object),
+    }
+    for name in REPORT_COLUMNS[4:-3]:
+        dict_column[name] = get_column(name)
+    dict_column["path_file"] = list_path_file
+    dict_column["file_path_folder"] = [x[0] or "." for x in list_folder_name]
+    dict_column["file_name"] = [x[2] for x in list_folder_name]
+    return pd.DataFrame(dict_column, columns=REPORT_COLUMNS)
+
+
+def format_video_metadata(list_dict_inf_ffprobe: list[dict[str, str]]):
+    """Generates video metadata report
+
+    Args:
+        list_dict_inf_ffprobe (list[dict[str, str]]):
+            List of Dictionaries returned from FFProbe Metadata Analysis
+
+    Returns:
+        list[dict]: List of Dictionaries formatted
+    """
+
+    list_record = []
+    for dict_file in list_dict_inf_ffprobe:
+        record = ProbeRecord.from_metadata(
+            dict_file["path_file"], dict_file["metadata"]
+        )
+        if record is not None:
+            list_record.append(record)
+    return get_report_dataframe(list_record).to_dict("records")
+
+
+def include_type_conversion(
+    df: pd.DataFrame,
+    profile: Union[conversion_policy.TargetProfile, None] = None,
+) -> pd.DataFrame:
     """
     Determines the required type of conversion for each video in the DataFrame
     and creates a 'type_conversion' column accordingly.
@@ -345,6 +1104,9 @@ def include_type_conversion(df: pd.DataFrame) -> pd.DataFrame:
             - 'is_avc': AVC (Advanced Video Coding) flag.
             - 'path_file': File path of the video file.
             - 'format_name': Video file format name.
+        profile (conversion_policy.TargetProfile, optional): target of the
+            conversion. Defaults to the default profile, mp4 H264/AAC
+            with up to 2 audio channels.
 
     Returns:
         pd.DataFrame: DataFrame with an added 'type_conversion' column
@@ -364,33 +1126,7 @@ def include_type_conversion(df: pd.DataFrame) -> pd.DataFrame:
         if column not in df.columns:
             raise ValueError(f"Column '{column}' not found in DataFrame.")
 
-    mask_cv_ok = df["video_codec"].isin(["h264"])
-    mask_ca_ok = df["audio_codec"].isin(["aac"])
-    mask_ac_ok = df["audio_channels"] <= 2
-    mask_isavc = df["is_avc"].isin([1])
-    mask_mp4 = df["path_file"].apply(
-        lambda x: Path(x).suffix.lower() == ".mp4"
-    )
-    mask_format = df["format_name"] == "mov,mp4,m4a,3gp,3g2,mj2"
-
-    stream_video_ok = mask_cv_ok
-    audio_stream_ok = mask_ca_ok & mask_ac_ok
-    container_ok = mask_mp4 & mask_format & mask_isavc
-
-    df["type_conversion"] = ""
-
-    mask_1_not_needed = stream_video_ok & audio_stream_ok & container_ok
-    df.loc[mask_1_not_needed, "type_conversion"] = "1_not_needed"
-
-    mask_2_container = (stream_video_ok & audio_stream_ok) & ~container_ok
-    df.loc[mask_2_container, "type_conversion"] = "2_container"
-
-    mask_3_only_audio = stream_video_ok & ~audio_stream_ok
-    df.loc[mask_3_only_audio, "type_conversion"] = "3_only_audio"
-
-    mask_4_only_video = ~stream_video_ok & audio_stream_ok
-    df.loc[mask_4_only_video, "type_conversion"] = "4_only_video"
-
-    mask_5_total_conv = ~stream_video_ok & ~audio_stream_ok
-    df.loc[mask_5_total_conv, "type_conversion"] = "5_total_conv"
+    if profile is None:
+        profile = conversion_policy.get_profile({})
+    df["type_conversion"] = profile.classify(df)
     return df
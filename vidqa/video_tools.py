@@ -1,55 +1,352 @@
 from __future__ import annotations
 
 import logging
-import os
+import shlex
+import subprocess
+import threading
+import time
+from typing import Callable, Union
 
 
-def convert_container(
+class FFmpegProgress:
+    """Progress of a running ffmpeg job, parsed from `-progress pipe:1`.
+
+    Attributes:
+        frame (int): frames written
+        fps (float): frames per second
+        speed (float): processing speed as a multiple of real time
+        out_time_seconds (float): media time already written
+        total_size (int): bytes written
+        progress (str): 'continue' while running, 'end' when finished
+    """
+
+    __slots__ = (
+        "frame",
+        "fps",
+        "speed",
+        "out_time_seconds",
+        "total_size",
+        "progress",
+    )
+
+    def __init__(self):
+        self.frame = 0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.out_time_seconds = 0.0
+        self.total_size = 0
+        self.progress = "continue"
+
+    def update(self, key: str, value: str) -> None:
+        """Updates the progress with a key=value line of ffmpeg"""
+
+        value = value.strip()
+        try:
+            if key == "frame":
+                self.frame = int(value)
+            elif key == "fps":
+                self.fps = float(value)
+            elif key == "speed":
+                self.speed = float(value.rstrip("x"))
+            elif key == "out_time_us":
+                self.out_time_seconds = int(value) / 1000000
+            elif key == "total_size":
+                self.total_size = int(value)
+            elif key == "progress":
+                self.progress = value
+        except ValueError:
+            # ffmpeg reports N/A before the first frame
+            pass
+
+    def get_eta_seconds(self, duration_seconds: float) -> Union[float, None]:
+        """Returns the estimated seconds to finish, or None if unknown"""
+
+        if self.speed <= 0 or not duration_seconds:
+            return None
+        remaining = max(0.0, duration_seconds - self.out_time_seconds)
+        return remaining / self.speed
+
+
+def get_stringa(list_arg: list[str]) -> str:
+    """Returns the shell representation of a command, to be displayed"""
+
+    return " ".join(shlex.quote(str(x)) for x in list_arg)
+
+
+def run_ffmpeg(
+    list_arg: list[str],
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+) -> int:
+    """Runs ffmpeg without a shell, parsing its machine-readable progress.
+
+    Args:
+        list_arg (list[str]): ffmpeg arguments, without the leading 'ffmpeg'
+        on_progress (Callable[[FFmpegProgress], None], optional): called
+            at each progress report of ffmpeg. Defaults to None.
+
+    Returns:
+        int: ffmpeg return code. 0 on success.
+    """
+
+    command_array = [
+        "ffmpeg",
+        "-hide_banner",
+        "-v",
+        "error",
+        "-nostats",
+        "-progress",
+        "pipe:1",
+    ] + [str(x) for x in list_arg]
+    print("\n", get_stringa(command_array))
+
+    try:
+        process = subprocess.Popen(
+            command_array,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            encoding="utf8",
+            errors="replace",
+        )
+    except OSError as e:
+        logging.critical(
+            "ffmpeg failed to run: %s\n check first that cmd is in your path",
+            e,
+        )
+        return -1
+
+    # drain stderr in parallel, so a verbose ffmpeg never blocks on it
+    list_stderr: list[str] = []
+    thread_stderr = threading.Thread(
+        target=lambda: list_stderr.extend(process.stderr), daemon=True
+    )
+    thread_stderr.start()
+
+    progress = FFmpegProgress()
+    for line in process.stdout:
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        progress.update(key.strip(), value)
+        if key == "progress" and on_progress is not None:
+            on_progress(progress)
+
+    return_code = process.wait()
+    thread_stderr.join()
+    if return_code != 0:
+        logging.error(
+            "ffmpeg exited with code %s:\n%s",
+            return_code,
+            "".join(list_stderr[-20:]).strip(),
+        )
+    return return_code
+
+
+def get_progress_logger(
+    label: str, duration_seconds: float = 0, interval: float = 10
+) -> Callable[[FFmpegProgress], None]:
+    """Returns a progress callback that logs throughput and ETA of a job,
+    at most once per interval.
+
+    Args:
+        label (str): job identification in the log
+        duration_seconds (float, optional): media duration, to estimate ETA.
+            Defaults to 0.
+        interval (float, optional): seconds between logs. Defaults to 10.
+
+    Returns:
+        Callable[[FFmpegProgress], None]: progress callback
+    """
+
+    last_log = [0.0]
+
+    def on_progress(progress: FFmpegProgress) -> None:
+        now = time.monotonic()
+        if progress.progress != "end" and now - last_log[0] < interval:
+            return
+        last_log[0] = now
+        eta_seconds = progress.get_eta_seconds(duration_seconds)
+        logging.info(
+            "%s [%s] fps=%.1f speed=%.2fx out_time=%.1fs size=%.1fMiB "
+            + "eta=%s",
+            label,
+            progress.progress,
+            progress.fps,
+            progress.speed,
+            progress.out_time_seconds,
+            progress.total_size / 2**20,
+            "?" if eta_seconds is None else f"{eta_seconds:.0f}s",
+        )
+
+    return on_progress
+
+
+def get_recipe_args(
+    type_conversion: str,
+    path_file_video_origin: str,
+    path_file_video_dest: str,
+    flags: dict,
+) -> list[str]:
+    """get ffmpeg arguments of a conversion from the target profile
+
+    Args:
+        type_conversion (str): type of conversion, see
+            conversion_policy.DICT_RECIPE
+        path_file_video_origin (str): input video path
+        path_file_video_dest (str): output video path
+        flags (dict): video conversion flags. Key 'target_profile' selects
+            the profile.
+
+    Returns:
+        list[str]: ffmpeg arguments
+    """
+
+    # conversion_policy imports get_libx264_args from this module
+    from .conversion_policy import get_profile
+
+    return get_profile(flags).get_recipe_args(
+        type_conversion, path_file_video_origin, path_file_video_dest, flags
+    )
+
+
+def convert_container_get_args(
     path_file_video_origin: str, path_file_video_dest: str, flags: dict = {}
-) -> None:
+) -> list[str]:
+    return get_recipe_args(
+        "2_container", path_file_video_origin, path_file_video_dest, flags
+    )
+
+
+def convert_container(
+    path_file_video_origin: str,
+    path_file_video_dest: str,
+    flags: dict = {},
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+) -> int:
     """Make release for mp4 H264/AAC changing container without re-encode.
 
     Args:
         path_file_video_origin (str): Original video file path
         path_file_video_dest (str): Path of the edited video file
+        on_progress (Callable[[FFmpegProgress], None], optional): progress
+            callback. Defaults to None.
+
+    Returns:
+        int: ffmpeg return code
     """
 
     logging.info(
         "Convert video extension without reencode: %s", path_file_video_origin
     )
 
-    stringa = (
-        f'ffmpeg -v quiet -stats -y -i "{path_file_video_origin}" '
-        + "-map_metadata -1 "
-        + "-vcodec copy "
-        + f'-acodec copy "{path_file_video_dest}"'
+    list_arg = convert_container_get_args(
+        path_file_video_origin, path_file_video_dest, flags
     )
-    print(stringa)
-    os.system(stringa)
+    return run_ffmpeg(list_arg, on_progress)
 
 
-def convert_only_audio(
+def convert_only_audio_get_args(
     path_file_video_origin: str, path_file_video_dest: str, flags: dict = {}
-) -> None:
+) -> list[str]:
+    return get_recipe_args(
+        "3_only_audio", path_file_video_origin, path_file_video_dest, flags
+    )
+
+
+def convert_only_audio(
+    path_file_video_origin: str,
+    path_file_video_dest: str,
+    flags: dict = {},
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+) -> int:
     """Make release for mp4 H264/AAC converting only audio
 
     Args:
         path_file_video_origin (str): Original video file path
         path_file_video_dest (str): Path of the edited video file
+        on_progress (Callable[[FFmpegProgress], None], optional): progress
+            callback. Defaults to None.
+
+    Returns:
+        int: ffmpeg return code
     """
 
     logging.info("Convert only audio: %s", path_file_video_origin)
 
-    stringa = (
-        f'ffmpeg -v quiet -stats -y -i "{path_file_video_origin}" '
-        + "-map_metadata -1 "
-        + "-vcodec copy "
-        + "-c:a aac "
-        + "-ac 2 "
-        + f'"{path_file_video_dest}"'
+    list_arg = convert_only_audio_get_args(
+        path_file_video_origin, path_file_video_dest, flags
+    )
+    return run_ffmpeg(list_arg, on_progress)
+
+
+def get_libx264_args(
+    flags: dict = {"crf": 18, "maxrate": 4}, faststart: bool = True
+) -> list[str]:
+    """get ffmpeg libx264 output arguments
+
+    Args:
+        flags (dict, optional): video conversion flags. Optional key
+            'threads' limits the libx264 threads.
+            Defaults to {'crf': 18, 'maxrate': 4}.
+        faststart (bool, optional): include the mp4 muxer flag faststart.
+            Defaults to True.
+
+    Returns:
+        list[str]: ffmpeg arguments
+    """
+
+    crf = float(flags.get("crf", 18))
+    maxrate = float(flags.get("maxrate", 4))
+    bufsize = maxrate * 2
+    threads = int(flags.get("threads", 0))
+    list_arg = ["-c:v", "libx264"]
+    if threads > 0:
+        list_arg += ["-threads", str(threads)]
+    list_arg += [
+        "-crf",
+        str(crf),
+        "-maxrate",
+        f"{str(maxrate)}M",
+        "-bufsize",
+        f"{str(bufsize)}M",
+        "-preset",
+        "faster",
+        "-flags",
+        "+global_header",
+        "-pix_fmt",
+        "yuv420p",
+        "-profile:v",
+        "baseline",
+        "-tune",
+        "zerolatency",
+    ]
+    if faststart:
+        list_arg += ["-movflags", "+faststart"]
+    return list_arg
+
+
+def convert_only_video_get_args(
+    path_file_video_origin: str,
+    path_file_video_dest: str,
+    flags: dict = {"crf": 18, "maxrate": 4},
+) -> list[str]:
+    """get ffmpeg arguments to reencode a video with the target profile
+
+    Args:
+        path_file_video_origin (str): input video path
+        path_file_video_dest (str): output video path
+        flags (dict, optional): video conversion flags. Optional key
+            'threads' limits the libx264 threads and 'target_profile'
+            selects the profile. Defaults to {'crf': 18, 'maxrate': 4}.
+
+    Returns:
+        list[str]: ffmpeg arguments
+    """
+
+    return get_recipe_args(
+        "4_only_video", path_file_video_origin, path_file_video_dest, flags
     )
-    print("\n", stringa)
-    os.system(stringa)
 
 
 def convert_only_video_get_stringa(
@@ -62,41 +359,26 @@ def convert_only_video_get_stringa(
     Args:
         path_file_video_origin (str): input video path
         path_file_video_dest (str): output video path
-        flags (dict, optional): video conversion flags.
+        flags (dict, optional): video conversion flags. Optional key
+            'threads' limits the libx264 threads.
             Defaults to {'crf': 18, 'maxrate': 4}.
 
     Returns:
         str: ffmpeg string command
     """
 
-    crf = float(flags.get("crf", 18))
-    maxrate = float(flags.get("maxrate", 4))
-    bufsize = maxrate * 2
-    stringa = (
-        "ffmpeg -v quiet -stats -y "
-        + f'-i "{path_file_video_origin}" '
-        + "-map_metadata -1 "
-        + "-c:v libx264 "
-        + f"-crf {str(crf)} "
-        + f"-maxrate {str(maxrate)}M "
-        + f"-bufsize {str(bufsize)}M "
-        + "-preset faster "
-        + "-flags +global_header "
-        + "-pix_fmt yuv420p "
-        + "-profile:v baseline "
-        + "-tune zerolatency "
-        + "-movflags +faststart "
-        + "-c:a copy "
-        + f'"{path_file_video_dest}"'
+    list_arg = convert_only_video_get_args(
+        path_file_video_origin, path_file_video_dest, flags
     )
-    return stringa
+    return get_stringa(["ffmpeg"] + list_arg)
 
 
 def convert_only_video(
     path_file_video_origin: str,
     path_file_video_dest: str,
     flags: dict = {"crf": 18, "maxrate": 4},
-) -> None:
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+) -> int:
     """Make release for mp4 H264/AAC converting only video
 
     Args:
@@ -104,15 +386,42 @@ def convert_only_video(
         path_file_video_dest (str): Path of the edited video file
         flags (dict, optional): video conversion flags.
             Defaults to {'crf': 18, 'maxrate': 4}.
+        on_progress (Callable[[FFmpegProgress], None], optional): progress
+            callback. Defaults to None.
+
+    Returns:
+        int: ffmpeg return code
     """
 
     logging.info("Convert only video: %s", path_file_video_origin)
 
-    stringa = convert_only_video_get_stringa(
+    list_arg = convert_only_video_get_args(
         path_file_video_origin, path_file_video_dest, flags
     )
-    print("\n", stringa)
-    os.system(stringa)
+    return run_ffmpeg(list_arg, on_progress)
+
+
+def convert_audio_video_get_args(
+    path_file_video_origin: str,
+    path_file_video_dest: str,
+    flags: dict = {"crf": 18, "maxrate": 4},
+) -> list[str]:
+    """get ffmpeg arguments to convert a video with the target profile
+
+    Args:
+        path_file_video_origin (str): input video path
+        path_file_video_dest (str): output video path
+        flags (dict, optional): video conversion flags. Optional key
+            'threads' limits the libx264 threads and 'target_profile'
+            selects the profile. Defaults to {'crf': 18, 'maxrate': 4}.
+
+    Returns:
+        list[str]: ffmpeg arguments
+    """
+
+    return get_recipe_args(
+        "5_total_conv", path_file_video_origin, path_file_video_dest, flags
+    )
 
 
 def convert_audio_video_get_stringa(
@@ -125,42 +434,26 @@ def convert_audio_video_get_stringa(
     Args:
         path_file_video_origin (str): input video path
         path_file_video_dest (str): output video path
-        flags (dict, optional): video conversion flags.
+        flags (dict, optional): video conversion flags. Optional key
+            'threads' limits the libx264 threads.
             Defaults to {'crf': 18, 'maxrate': 4}.
 
     Returns:
         str: ffmpeg string command
     """
 
-    crf = float(flags.get("crf", 18))
-    maxrate = float(flags.get("maxrate", 4))
-    bufsize = maxrate * 2
-    stringa = (
-        "ffmpeg -v quiet -stats -y "
-        + f'-i "{path_file_video_origin}" '
-        + "-map_metadata -1 "
-        + "-c:v libx264 "
-        + f"-crf {str(crf)} "
-        + f"-maxrate {str(maxrate)}M "
-        + f"-bufsize {str(bufsize)}M "
-        + "-preset faster "
-        + "-flags +global_header "
-        + "-pix_fmt yuv420p "
-        + "-profile:v baseline "
-        + "-tune zerolatency "
-        + "-movflags +faststart "
-        + "-c:a aac "
-        + "-ac 2 "
-        + f'"{path_file_video_dest}"'
+    list_arg = convert_audio_video_get_args(
+        path_file_video_origin, path_file_video_dest, flags
     )
-    return stringa
+    return get_stringa(["ffmpeg"] + list_arg)
 
 
 def convert_audio_video(
     path_file_video_origin: str,
     path_file_video_dest: str,
     flags: dict = {"crf": 18, "maxrate": 4},
-) -> None:
+    on_progress: Union[Callable[[FFmpegProgress], None], None] = None,
+) -> int:
     """Make release for mp4 H264/AAC converting audio and video
 
     Args:
@@ -168,10 +461,14 @@ def convert_audio_video(
         path_file_video_dest (str): Path of the edited video file
         flags (dict, optional): video conversion flags.
             Defaults to {'crf': 18, 'maxrate': 4}.
+        on_progress (Callable[[FFmpegProgress], None], optional): progress
+            callback. Defaults to None.
+
+    Returns:
+        int: ffmpeg return code
     """
 
-    stringa = convert_audio_video_get_stringa(
+    list_arg = convert_audio_video_get_args(
         path_file_video_origin, path_file_video_dest, flags
     )
-    print("\n", stringa)
-    os.system(stringa)
+    return run_ffmpeg(list_arg, on_progress)
@@ -3,8 +3,8 @@
 from __future__ import annotations
 
 import hashlib
-import json
 import logging
+import os
 import shutil
 import time
 from pathlib import Path
@@ -14,7 +14,16 @@ import pandas as pd
 
 from vidqa import utils
 
-from . import config, make_reencode, video_report
+from . import (
+    catalog,
+    config,
+    conversion_policy,
+    make_reencode,
+    pipeline,
+    probe_cache,
+    report_export,
+    video_report,
+)
 from .check_path import test_folders_has_path_too_long
 
 
@@ -39,7 +48,11 @@ def logging_config():
     logging.getLogger("").addHandler(console)
 
 
-def get_list_path_video(folder_path: Path, video_extensions: tuple) -> list:
+def get_list_path_video(
+    folder_path: Path,
+    video_extensions: tuple,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
+) -> list:
     """
     Retrieves a list of file paths with specified video extensions in the given
     folder.
@@ -49,6 +62,8 @@ def get_list_path_video(folder_path: Path, video_extensions: tuple) -> list:
                             for video files.
         video_extensions (tuple): A tuple of strings representing valid video
                                   file extensions.
+        snapshot (utils.TreeSnapshot, optional): Tree snapshot of folder_path.
+                                  If None, the folder is walked.
 
     Returns:
         list: A list of Path objects representing the selected video files.
@@ -78,21 +93,19 @@ def get_list_path_video(folder_path: Path, video_extensions: tuple) -> list:
         "Find for video with extension: %s", str_tuple_video_extension
     )
 
-    # get_all_file_path
-    dict_all_file_result = utils.get_all_file_path(folder_path)
+    if snapshot is None:
+        snapshot = utils.scan_tree(folder_path)
 
     # In case of error by max_path, interrupts execution
-    if len(dict_all_file_result["errors"]) != 0:
-        list_file_path_too_long = [
-            str(x) for x in dict_all_file_result["errors"]
-        ]
+    if len(snapshot.errors) != 0:
+        list_file_path_too_long = [str(x) for x in snapshot.errors]
         for file_path_too_long in list_file_path_too_long:
             logging.error("File path too long: %s", file_path_too_long)
         raise ValueError("file_path_too_long")
 
     # Select desired videos by extension
     list_file_selected = []
-    list_file_path = dict_all_file_result["content"].copy()
+    list_file_path = snapshot.get_file_paths()
     for file_path in list_file_path:
         if file_path.name.lower().endswith(tuple_video_extension):
             logging.info("Selected file: %s", file_path.name)
@@ -103,17 +116,20 @@ def get_list_path_video(folder_path: Path, video_extensions: tuple) -> list:
     return list_file_selected
 
 
-def get_file_path_converted(path_origin: Path) -> Path:
-    """ "Converts the absolute path of a video file, to its MP4 equivalent"
+def get_file_path_converted(path_origin: Path, suffix: str = ".mp4") -> Path:
+    """ "Converts the absolute path of a video file, to its converted
+    equivalent"
 
     Args:
         path_origin (Path): video path
+        suffix (str, optional): extension of the converted video.
+            Defaults to ".mp4".
 
     Returns:
-        Path: video path in mp4
+        Path: video path with the extension of the converted video
     """
 
-    file_path_c = path_origin.parent / (path_origin.stem + ".mp4")
+    file_path_c = path_origin.parent / (path_origin.stem + suffix)
     return file_path_c
 
 
@@ -137,12 +153,19 @@ def replace_converted_video(path_origin: Path, path_converted: Path) -> None:
             f"path_file_converted not found: {path_converted}"
         )
 
-    file_path_converted_destination = get_file_path_converted(path_origin)
+    # the converted video keeps the extension of its target profile
+    file_path_converted_destination = get_file_path_converted(
+        path_origin, path_converted.suffix
+    )
     # if destination exists, rename with suffix _2
     if file_path_converted_destination.exists():
         file_path_converted_destination = (
             file_path_converted_destination.parent
-            / (file_path_converted_destination.stem + "_2.mp4")
+            / (
+                file_path_converted_destination.stem
+                + "_2"
+                + path_converted.suffix
+            )
         )
 
     # remove path_origin
@@ -183,7 +206,8 @@ def replace_converted_video_all(report_path: Path):
 
     Note:
         The report file should contain columns 'path_file' for original video
-        paths and 'path_file_converted' for corresponding converted video paths.
+        paths and 'path_file_converted' for corresponding converted video
+        paths.
     """
 
     while True:
@@ -212,39 +236,56 @@ def replace_converted_video_all(report_path: Path):
         replace_converted_video(Path(path_origin), Path(path_converted))
 
 
-def sanitize_files(folder_path: Path, max_path=250, max_name=150):
+def sanitize_files(
+    folder_path: Path,
+    max_path=250,
+    max_name=150,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
+):
     """Ensures that file path lengths are reasonable.
     Review in a loop with pauses until the need is satisfied.
 
     Args:
         folder_path (Path): folder path
+        snapshot (utils.TreeSnapshot, optional): tree snapshot of folder_path.
+            Refreshed in place after each correction pause.
     """
 
     logging.info("Star folder analysis: %s", str(folder_path))
+    if snapshot is None:
+        snapshot = utils.scan_tree(folder_path)
     while True:
         (
             list_folders_path_approved,
             list_folders_path_rejected,
         ) = test_folders_has_path_too_long(
-            [folder_path], max_path=max_path, max_name=max_name
+            [folder_path],
+            max_path=max_path,
+            max_name=max_name,
+            snapshot=snapshot,
         )
 
         if len(list_folders_path_rejected) > 0:
             input("\nAfter correcting, press something to continue.\n")
+            snapshot.refresh()
         else:
             return list_folders_path_approved
 
 
-def sanitize_file_or_folder(item: Path):
+def sanitize_file_or_folder(item: Path) -> bool:
     """Check if the file name or folder is compatible with Encoding UTF-8.
     If not, it renames to become compatible.
 
     Args:
         item (Path): Path of file or folder
+
+    Returns:
+        bool: True if the item was renamed
     """
 
     try:
         item.name.encode("utf-8")
+        return False
     except UnicodeEncodeError:
         new_item_name = item.name.encode("utf-8", errors="ignore").decode()
         new_item = item.parent / new_item_name
@@ -255,28 +296,327 @@ def sanitize_file_or_folder(item: Path):
         )
         logging.error("_Fixing. Rename to: %s", new_item_name)
         item.rename(new_item)
+        return True
 
 
-def apply_recursive_in_folder(func_: Callable, folder_path: Path):
+def apply_recursive_in_folder(
+    func_: Callable,
+    folder_path: Path,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
+) -> int:
     """Sanitizes all folders and files for UTF-8 compatible names
 
+    Items are visited deepest first, so renaming a folder never invalidates
+    the paths of items still to be visited.
+
     Args:
         func_ (Callable): function to be apply to all folder and files
         folder_path (Path): folder path
+        snapshot (utils.TreeSnapshot, optional): tree snapshot of folder_path.
+            If None, the folder is walked.
+
+    Returns:
+        int: number of items for which func_ returned True
+    """
+
+    if snapshot is None:
+        snapshot = utils.scan_tree(folder_path, sort=False)
+    list_item = [x.path for x in snapshot.files + snapshot.dirs]
+    list_item.sort(key=lambda x: len(x.parts), reverse=True)
+    qt_changed = 0
+    for item in list_item:
+        if func_(item):
+            qt_changed += 1
+    return qt_changed
+
+
+def get_list_path_video_sanitized(
+    folder_path: Path,
+    video_extensions: tuple,
+    flags: dict,
+    snapshot: utils.TreeSnapshot,
+) -> Union[list, None]:
+    """
+    Sanitizes the file and folder names of the project and retrieves its
+    video files.
+
+    Args:
+        folder_path (Path): Path object representing the directory to search
+                            for video files.
+        video_extensions (tuple): A tuple of strings representing valid video
+                                  file extensions.
+        flags (dict): uses the keys 'max_path' and 'max_name'.
+        snapshot (utils.TreeSnapshot): Tree snapshot of folder_path.
+                                  Refreshed after renames.
+
+    Returns:
+        Union[list, None]: A list of Path objects representing the video
+                           files. None if no folder was approved.
+    """
+
+    max_path = flags.get("max_path", 260)
+    max_name = flags.get("max_name", 150)
+    list_folders_path_approved = sanitize_files(
+        folder_path, max_path=max_path, max_name=max_name, snapshot=snapshot
+    )
+
+    if len(list_folders_path_approved) == 0:
+        return None
+
+    # sanitize all file/folder names
+    qt_renamed = apply_recursive_in_folder(
+        sanitize_file_or_folder, folder_path, snapshot
+    )
+    if qt_renamed > 0:
+        snapshot.refresh()
+
+    return get_list_path_video(folder_path, video_extensions, snapshot)
+
+
+def probe_videos(
+    list_path_video: list[Path],
+    report_path: Path,
+    flags: dict,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
+    metadata_writer: Union[video_report.MetadataWriter, None] = None,
+) -> dict:
+    """Probes videos with the probe flags, through the probe cache if
+    enabled, and saves the lists of fallback and timed out files next to
+    the report.
+
+    Args:
+        list_path_video (list[Path]): videos to probe
+        report_path (Path): report path. csv.
+        flags (dict): uses the probe and cache flags
+        snapshot (utils.TreeSnapshot, optional): Tree snapshot holding the
+            stat of the videos. Defaults to None.
+        metadata_writer (video_report.MetadataWriter, optional): receives
+            the raw metadata. Defaults to None.
+
+    Returns:
+        dict: see video_report.get_inf_ffprobe
+    """
+
+    if flags.get("cache_probe", 0) == 1:
+        cache = probe_cache.get_probe_cache(
+            flags.get("cache_path", ""),
+            max_entries=flags.get("cache_max_entries", 200000),
+        )
+    else:
+        cache = None
+    try:
+        inf_ffprobe = video_report.get_inf_ffprobe(
+            list_path_video,
+            workers=int(flags.get("probe_workers", 1)),
+            cache=cache,
+            snapshot=snapshot,
+            probe_mode=video_report.get_probe_mode(flags),
+            fast_probe=video_report.get_fast_probe(flags),
+            native=video_report.get_native(flags),
+            policy=video_report.get_probe_policy(flags),
+            metadata_writer=metadata_writer,
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+    video_report.save_fallback_report(
+        inf_ffprobe.get("fallback", []), report_path
+    )
+    video_report.save_timeout_report(
+        inf_ffprobe.get("timeout", []), report_path
+    )
+    return inf_ffprobe
+
+
+def is_report_line_unchanged(
+    row: dict, stat_result: Union[os.stat_result, None]
+) -> bool:
+    """Checks if the file of a report line is still the one probed: same
+    file_size and, if the line has it, same file_mtime_ns.
+
+    Args:
+        row (dict): report line
+        stat_result (os.stat_result): current stat of the file. None if
+            the file left the project.
+
+    Returns:
+        bool: True if unchanged
+    """
+
+    if stat_result is None:
+        return False
+    if pd.isna(row.get("file_size")) or (
+        int(row["file_size"]) != stat_result.st_size
+    ):
+        return False
+    file_mtime_ns = row.get("file_mtime_ns")
+    if file_mtime_ns is None or pd.isna(file_mtime_ns):
+        return True
+    return int(file_mtime_ns) == stat_result.st_mtime_ns
+
+
+def refresh_video_report(
+    report_path: Path,
+    folder_path: Path,
+    video_extensions: tuple,
+    flags: dict,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
+) -> list:
+    """
+    Refreshes an existing video metadata report with the current videos of
+    the folder. Only new or changed videos are probed, videos that left the
+    folder are dropped and the lines of untouched videos are kept, with
+    their conversion state.
+
+    Args:
+        report_path (Path): existing report. csv.
+        folder_path (Path): Path object representing the directory to search
+                            for video files.
+        video_extensions (tuple): A tuple of strings representing valid video
+                                  file extensions.
+        flags (dict): uses the probe, cache and metadata_gzip flags.
+        snapshot (utils.TreeSnapshot, optional): Tree snapshot of
+                                  folder_path. If None, the folder is walked
+                                  once.
+
+    Returns:
+        list: likely corrupted videos, among the probed ones
+
+    Note:
+        - A video is unchanged while its file_size and file_mtime_ns match
+          the tree snapshot. Lines of reports without file_mtime_ns are
+          compared by size only, and get the column.
+        - A converted line whose path_file_converted is gone is set to be
+          converted again.
+        - The metadata dump keeps the lines of the untouched videos and
+          gets the ones of the probed videos.
     """
 
-    for item in folder_path.rglob("*"):
-        if item.is_file() or item.is_dir():
-            func_(item)
+    if snapshot is None:
+        snapshot = utils.scan_tree(folder_path)
+    list_path_video = get_list_path_video_sanitized(
+        folder_path, video_extensions, flags, snapshot
+    )
+    if list_path_video is None:
+        return []
+
+    dict_stat = {}
+    for path_file in list_path_video:
+        stat_result = snapshot.get_stat(path_file)
+        if stat_result is None:
+            stat_result = path_file.stat()
+        dict_stat[str(path_file)] = stat_result
+    df = pd.read_csv(report_path, dtype={"path_file_converted": str})
+    list_keep = [
+        is_report_line_unchanged(row, dict_stat.get(str(row["path_file"])))
+        for row in df.to_dict("records")
+    ]
+    df_keep = df.loc[list_keep].copy()
+    set_path_keep = {str(x) for x in df_keep["path_file"]}
+    list_path_probe = [
+        x for x in list_path_video if str(x) not in set_path_keep
+    ]
+    qt_removed = sum(
+        1
+        for x in df.loc[[not x for x in list_keep], "path_file"]
+        if str(x) not in dict_stat
+    )
+    logging.info(
+        "Report refresh: %s videos kept, %s new or changed, %s removed",
+        len(df_keep),
+        len(list_path_probe),
+        qt_removed,
+    )
+
+    qt_lost = 0
+    if "conversion_done" in df_keep.columns:
+        dict_stat_converted = utils.stat_files(
+            df_keep["path_file_converted"].dropna()
+        )
+        mask_lost = (df_keep["conversion_done"] == 1) & df_keep[
+            "path_file_converted"
+        ].apply(
+            lambda x: isinstance(x, str) and dict_stat_converted[x] is None
+        )
+        qt_lost = int(mask_lost.sum())
+        if qt_lost > 0:
+            logging.warning(
+                "%s converted videos not found, to convert again", qt_lost
+            )
+            df_keep.loc[mask_lost, "conversion_done"] = 0
+            df_keep.loc[mask_lost, "path_file_converted"] = None
+    if (
+        len(list_path_probe) == 0
+        and qt_removed == 0
+        and qt_lost == 0
+        and "file_mtime_ns" in df.columns
+    ):
+        return []
+    df_keep["file_mtime_ns"] = [
+        dict_stat[str(x)].st_mtime_ns for x in df_keep["path_file"]
+    ]
+
+    # new metadata dump: the kept lines of the old dumps plus the probed
+    # videos
+    path_file_dump = video_report.get_path_metadata_dump(
+        report_path, flags.get("metadata_gzip", 0) == 1
+    )
+    path_file_dump_temp = path_file_dump.parent / (
+        "tmp_" + path_file_dump.name
+    )
+    list_path_dump_old = [
+        x
+        for x in (
+            video_report.get_path_metadata_dump(report_path, False),
+            video_report.get_path_metadata_dump(report_path, True),
+        )
+        if x.exists()
+    ]
+    with video_report.MetadataWriter(path_file_dump_temp) as metadata_writer:
+        set_path_dumped = set()
+        for path_file_dump_old in list_path_dump_old:
+            for dict_file in video_report.iter_metadata_dump(
+                path_file_dump_old
+            ):
+                path_file = dict_file["path_file"]
+                if path_file in set_path_keep and (
+                    path_file not in set_path_dumped
+                ):
+                    metadata_writer.write(path_file, dict_file["metadata"])
+                    set_path_dumped.add(path_file)
+        inf_ffprobe = probe_videos(
+            list_path_probe, report_path, flags, snapshot, metadata_writer
+        )
+    for path_file_dump_old in list_path_dump_old:
+        path_file_dump_old.unlink()
+    os.replace(path_file_dump_temp, path_file_dump)
+
+    if len(inf_ffprobe["records"]) > 0:
+        df_new = video_report.include_type_conversion(
+            video_report.get_report_dataframe(inf_ffprobe["records"]),
+            conversion_policy.get_profile(flags),
+        )
+        if "conversion_done" in df_keep.columns:
+            df_new["conversion_done"] = 0
+            df_new["path_file_converted"] = None
+        df_keep = pd.concat([df_keep, df_new], ignore_index=True)
+    path_file_temp = Path(str(report_path) + ".tmp")
+    df_keep.to_csv(path_file_temp, index=False)
+    os.replace(path_file_temp, report_path)
+    return inf_ffprobe.get("corrupt", [])
 
 
 def create_video_report(
-    report_path: Path, folder_path: Path, video_extensions: tuple, flags: dict
+    report_path: Path,
+    folder_path: Path,
+    video_extensions: tuple,
+    flags: dict,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
 ) -> list:
     """
     Creates a video metadata report identifying which ones need conversion and
     saves it to a CSV file.
-    Also dumps all video metadata into a single JSON file located in the same
+    Also dumps the video metadata into a single JSON file located in the same
     folder as the report.
 
     Args:
@@ -286,6 +626,9 @@ def create_video_report(
                             for video files.
         video_extensions (tuple): A tuple of strings representing valid video
                                   file extensions.
+        snapshot (utils.TreeSnapshot, optional): Tree snapshot of
+                                  folder_path, reused by all the stages.
+                                  If None, the folder is walked once.
 
     Returns:
         None
@@ -301,117 +644,153 @@ def create_video_report(
           directory to be UTF-8 compatible.
         - Extracts video metadata from valid video files with extensions
           specified in `video_extensions`.
-        - Dumps all video metadata into a single JSON file located in the
-          same folder as the report. Named {report_name}_metadata.json
+        - Dumps all video metadata, as each file is probed, into a JSON
+          Lines file located in the same folder as the report. Named
+          {report_name}_metadata.jsonl, or .jsonl.gz with the flag
+          metadata_gzip. See video_report.rebuild_report.
         - Generates a CSV report containing video metadata and saves it to the
           specified `report_path`.
         - Videos to be converted are identified in the report.
     """
 
-    max_path = flags.get("max_path", 260)
-    max_name = flags.get("max_name", 150)
-    list_folders_path_approved = sanitize_files(
-        folder_path, max_path=max_path, max_name=max_name
+    if snapshot is None:
+        snapshot = utils.scan_tree(folder_path)
+    list_path_video = get_list_path_video_sanitized(
+        folder_path, video_extensions, flags, snapshot
     )
-
-    if len(list_folders_path_approved) == 0:
+    if list_path_video is None:
         return []
-
-    # sanitize all file/folder names
-    apply_recursive_in_folder(sanitize_file_or_folder, folder_path)
-
-    list_path_video = get_list_path_video(folder_path, video_extensions)
     if len(list_path_video) == 0:
         logging.info("There are no video files.")
         return
 
-    inf_ffprobe = video_report.get_inf_ffprobe(list_path_video)
-    list_dict_inf_ffprobe = inf_ffprobe.get("metadata", "")
+    # the metadata dump is written while the files are probed
+    with video_report.MetadataWriter(
+        video_report.get_path_metadata_dump(
+            report_path, flags.get("metadata_gzip", 0) == 1
+        )
+    ) as metadata_writer:
+        inf_ffprobe = probe_videos(
+            list_path_video, report_path, flags, snapshot, metadata_writer
+        )
     list_corrupt_videos = inf_ffprobe.get("corrupt", "")
 
-    # save metadata json file
-    metadata_json_path = report_path.parent / (
-        report_path.stem + "_metadata.json"
-    )
-    save_list_dict_as_json_file(
-        list_dict=list_dict_inf_ffprobe, file_path=metadata_json_path
+    # generates CSV metadata report of the probe records
+    df_video_metadata = video_report.get_report_dataframe(
+        inf_ffprobe["records"]
     )
-    # format list_dict to report needs
-    list_dict_report_video_metadata = video_report.format_video_metadata(
-        list_dict_inf_ffprobe
-    )
-
-    # generates CSV metadata report
-    df_video_metadata = pd.DataFrame(list_dict_report_video_metadata)
 
     # set column type_conversion
     # Values: 1_not_needed,2_container,3_only_audio,4_only_video,5_total_conv
-    df_video_metadata = video_report.include_type_conversion(df_video_metadata)
+    df_video_metadata = video_report.include_type_conversion(
+        df_video_metadata, conversion_policy.get_profile(flags)
+    )
 
     df_video_metadata.to_csv(report_path, index=False)
     return list_corrupt_videos
 
 
-def save_list_dict_as_json_file(list_dict: list, file_path: Path):
-    """Save list_dict as json file
+def get_list_path_integrity_failed(df: pd.DataFrame) -> list[str]:
+    """Returns the files of a report that are missing or changed since
+    they were probed. Each referenced folder is listed once, see
+    utils.stat_files.
 
     Args:
-        list_dict (list): list of dict
-        file_path (Path): path file
-    """
-
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(list_dict, f, indent=4)
+        df (pd.DataFrame): report. Columns path_file and
+            path_file_converted, and file_size and file_mtime_ns if the
+            report has them.
 
+    Returns:
+        list[str]: missing input and output files, and input files whose
+            size or mtime differ from the report, marked '(changed)'
+    """
 
-def check_report_integrity(report_path: Path) -> bool:
-    """Checks the existence of the input and output files in the report
-    If any of them don't exist, offers the option to delete the report and
+    list_row = df.to_dict("records")
+    list_path_converted = df["path_file_converted"].dropna().to_list()
+    dict_stat = utils.stat_files(
+        [x["path_file"] for x in list_row] + list_path_converted
+    )
+    list_path_failed = []
+    for row in list_row:
+        path_file = str(row["path_file"])
+        stat_result = dict_stat[path_file]
+        if stat_result is None:
+            list_path_failed.append(path_file)
+        elif not pd.isna(row.get("file_size")) and (
+            not is_report_line_unchanged(row, stat_result)
+        ):
+            list_path_failed.append(f"{path_file} (changed)")
+    list_path_failed += [
+        str(x) for x in list_path_converted if dict_stat[str(x)] is None
+    ]
+    return list_path_failed
+
+
+def check_report_integrity(
+    report_path: Path, keep_converted: bool = False
+) -> bool:
+    """Checks the existence of the input and output files in the report,
+    and that the input files did not change since they were probed.
+    If any of them fails, offers the option to delete the report and
     output files.
     Also offers the option to check again.
 
     Args:
         report_path (Path): report path.
                             Necessary columns: path_file, path_file_converted
+        keep_converted (bool, optional): when starting from scratch, keep
+            the converted videos, to be salvaged by the next conversion
+            (see salvage). Defaults to False.
 
     Returns:
         bool: True to continue. False to start from scratch.
     """
 
+    if keep_converted:
+        action = (
+            "delete the report and start from scratch, adopting the "
+            + "already converted videos that are still valid"
+        )
+    else:
+        action = (
+            "delete both the already converted videos and the report and "
+            + "start from scratch"
+        )
     message = (
         "\nAttention:\nThere are file paths recorded in the plan_report that "
-        + "were not found and thus it is not possible to continue the "
-        + "conversion.\n\n"
-        + "Press 'y' to delete both the already converted videos and the "
-        + "report and start from scratch.\n\n"
+        + "were not found or changed and thus it is not possible to continue "
+        + "the conversion.\n\n"
+        + f"Press 'y' to {action}.\n\n"
         + "Press any other key to check again the existence of the necessary "
         + "files to continue from where it stopped."
     )
 
     while True:
-        df = pd.read_csv(Path(report_path))
-        list_path_not_exists = [
-            x
-            for x in df["path_file"].dropna().to_list()
-            + df["path_file_converted"].dropna().to_list()
-            if not Path(x).exists()
-        ]
-        if len(list_path_not_exists) == 0:
+        # nullable ints keep the nanoseconds of file_mtime_ns
+        df = pd.read_csv(
+            Path(report_path),
+            dtype={
+                "path_file_converted": str,
+                "file_size": "Int64",
+                "file_mtime_ns": "Int64",
+            },
+        )
+        list_path_failed = get_list_path_integrity_failed(df)
+        if len(list_path_failed) == 0:
             return True
         else:
-            for path_file in list_path_not_exists:
+            for path_file in list_path_failed:
                 print(f"- {path_file}")
             print(message)
             delete_all = input("Answer: ")
             if delete_all == "y":
                 report_path.unlink()
-                list_path_exists = [
-                    x
-                    for x in df["path_file_converted"].dropna().to_list()
-                    if Path(x).exists()
-                ]
-                if len(list_path_exists) != 0:
-                    for path_file in list_path_exists:
+                if keep_converted:
+                    return False
+                list_path_converted = df["path_file_converted"].dropna()
+                dict_stat = utils.stat_files(list_path_converted)
+                for path_file in list_path_converted:
+                    if dict_stat[str(path_file)] is not None:
                         Path(path_file).unlink()
                 return False
             else:
@@ -463,15 +842,36 @@ def get_folder_log(
     return folder_log
 
 
+def save_report_export(report_path: Path, flags: dict) -> None:
+    """Exports the report as parquet or feather, if flags['report_export']
+    asks for it. See report_export.
+
+    Args:
+        report_path (Path): report path. csv.
+        flags (dict): flags. Key 'report_export': 'none', 'parquet' or
+            'feather'.
+    """
+
+    format_ = flags.get("report_export", "none")
+    if format_ in ("", "none"):
+        return
+    try:
+        report_export.export_report(report_path, format_)
+    except ImportError as e:
+        logging.error("Report export skipped: %s", e)
+
+
 def vidqa(
     folder_path: Path,
     report_path: Union[Path, None] = None,
     path_folder_convert: Union[Path, None] = None,
     video_extensions: tuple = None,
     flags: Union[dict, None] = None,
+    snapshot: Union[utils.TreeSnapshot, None] = None,
 ):
     """Warning if file path or file name is greater than they should.
-    Ensure that video profile is format mp4, v/a codecs H264/aac,
+    Ensure that videos match the target profile of flags['target_profile']
+    (see conversion_policy). Default: format mp4, v/a codecs H264/aac,
     audio channels <=2.
 
     Args:
@@ -482,6 +882,8 @@ def vidqa(
         video_extensions (Optional[Tuple[str, ...]]): Tuple of video file
             extensions to be analyzed.
         flags (Optional[Dict[str, Any]]): Dictionary of flags.
+        snapshot (Optional[utils.TreeSnapshot]): Tree snapshot of folder_path
+            already taken by the caller.
     """
 
     config_file = Path(__file__).absolute().parent / "config.ini"
@@ -497,6 +899,38 @@ def vidqa(
         max_name = int(config_data.get("max_name", 150))
         corrupt_del = int(config_data.get("corrupt_del", 0))
         corrupt_bkp = int(config_data.get("corrupt_bkp", 1))
+        probe_workers = int(config_data.get("probe_workers", 1))
+        cache_probe = int(config_data.get("cache_probe", 0))
+        cache_path = config_data.get("cache_path", "")
+        cache_max_entries = int(config_data.get("cache_max_entries", 200000))
+        io_jobs = int(config_data.get("io_jobs", 2))
+        cpu_jobs = int(config_data.get("cpu_jobs", 1))
+        threads_per_job = int(config_data.get("threads_per_job", 0))
+        job_order = config_data.get("job_order", "fifo")
+        segment_min_duration = float(
+            config_data.get("segment_min_duration", 0)
+        )
+        segment_seconds = float(config_data.get("segment_seconds", 300))
+        segment_workers = int(config_data.get("segment_workers", 4))
+        pipeline_mode = int(config_data.get("pipeline", 0))
+        probe_full = int(config_data.get("probe_full", 0))
+        probe_fast = int(config_data.get("probe_fast", 0))
+        probe_native = int(config_data.get("probe_native", 0))
+        probe_fast_size = int(config_data.get("probe_fast_size", 1000000))
+        probe_fast_duration = int(
+            config_data.get("probe_fast_duration", 1000000)
+        )
+        probe_timeout = float(config_data.get("probe_timeout", 0))
+        probe_retries = int(config_data.get("probe_retries", 0))
+        metadata_gzip = int(config_data.get("metadata_gzip", 0))
+        report_refresh = int(config_data.get("report_refresh", 0))
+        target_profile = config_data.get(
+            "target_profile", conversion_policy.PROFILE_DEFAULT
+        )
+        report_export_format = config_data.get("report_export", "none")
+        catalog_flag = int(config_data.get("catalog", 0))
+        catalog_path = config_data.get("catalog_path", "")
+        salvage = int(config_data.get("salvage", 0))
         flags = {
             "crf": crf,
             "maxrate": maxrate,
@@ -504,6 +938,32 @@ def vidqa(
             "corrupt_bkp": corrupt_bkp,
             "max_path": max_path,
             "max_name": max_name,
+            "probe_workers": probe_workers,
+            "cache_probe": cache_probe,
+            "cache_path": cache_path,
+            "cache_max_entries": cache_max_entries,
+            "io_jobs": io_jobs,
+            "cpu_jobs": cpu_jobs,
+            "threads_per_job": threads_per_job,
+            "job_order": job_order,
+            "segment_min_duration": segment_min_duration,
+            "segment_seconds": segment_seconds,
+            "segment_workers": segment_workers,
+            "pipeline": pipeline_mode,
+            "probe_full": probe_full,
+            "probe_fast": probe_fast,
+            "probe_native": probe_native,
+            "probe_fast_size": probe_fast_size,
+            "probe_fast_duration": probe_fast_duration,
+            "probe_timeout": probe_timeout,
+            "probe_retries": probe_retries,
+            "metadata_gzip": metadata_gzip,
+            "report_refresh": report_refresh,
+            "target_profile": target_profile,
+            "report_export": report_export_format,
+            "catalog": catalog_flag,
+            "catalog_path": catalog_path,
+            "salvage": salvage,
         }
 
     folder_log = get_folder_log(folder_path, path_folder_convert)
@@ -511,14 +971,53 @@ def vidqa(
     if report_path is None:
         report_path = Path(folder_log) / (folder_path.name + ".csv")
 
-    if report_path.exists():
-        integrity_check_passed = check_report_integrity(report_path)
+    if flags.get("pipeline", 0) == 1 and not pipeline.is_discovery_complete(
+        report_path
+    ):
+        # probe, classify and convert at the same time
+        if snapshot is None:
+            snapshot = utils.scan_tree(folder_path)
+        list_path_video = get_list_path_video_sanitized(
+            folder_path, video_extensions, flags, snapshot
+        )
+        list_corrupt_videos = pipeline.run_pipeline(
+            report_path,
+            list_path_video or [],
+            Path(folder_log),
+            flags,
+            snapshot,
+        )
+        report_erros_path = Path(folder_log) / (
+            folder_path.name + "_errors.csv"
+        )
+        corrupt_handler(list_corrupt_videos, report_erros_path, flags)
+        # before the converted videos replace the originals, to record the
+        # sizes of both
+        catalog.record_report(report_path, flags)
+        replace_converted_video_all(report_path)
+        save_report_export(report_path, flags)
+        return report_path
+
+    if report_path.exists() and flags.get("report_refresh", 0) == 1:
+        # probe only the videos added or changed since the report
+        list_corrupt_videos = refresh_video_report(
+            report_path, folder_path, video_extensions, flags, snapshot
+        )
+        report_erros_path = Path(folder_log) / (
+            folder_path.name + "_errors.csv"
+        )
+        corrupt_handler(list_corrupt_videos, report_erros_path, flags)
+        integrity_check_passed = True
+    elif report_path.exists():
+        integrity_check_passed = check_report_integrity(
+            report_path, keep_converted=flags.get("salvage", 0) == 1
+        )
     else:
         integrity_check_passed = False
 
     if not integrity_check_passed:
         list_corrupt_videos = create_video_report(
-            report_path, folder_path, video_extensions, flags
+            report_path, folder_path, video_extensions, flags, snapshot
         )
         # save list_corrupt_videos to report_erros_path and delete
         # or backup them
@@ -528,7 +1027,9 @@ def vidqa(
         corrupt_handler(list_corrupt_videos, report_erros_path, flags)
 
     make_reencode.make_reencode(report_path, folder_log, flags)
+    catalog.record_report(report_path, flags)
     replace_converted_video_all(report_path)
+    save_report_export(report_path, flags)
     return report_path
 
 
@@ -541,8 +1042,8 @@ def show_corrupt_videos(
 
     Args:
         folder_path (Path): Path objects representing project location.
-        path_folder_convert (Path | None): Path object representing the location
-                                           of converted temp folder.
+        path_folder_convert (Path | None): Path object representing the
+                                           location of converted temp folder.
 
     Example:
         folder_path = Path("/path/to/mytempproject)